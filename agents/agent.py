@@ -1,3 +1,4 @@
+import asyncio
 from typing import Optional, Any
 from datetime import datetime
 
@@ -45,4 +46,7 @@ class Agent():
         }
 
     def run(self):
-        pass
\ No newline at end of file
+        pass
+
+    async def run_async(self):
+        await asyncio.to_thread(self.run)
\ No newline at end of file
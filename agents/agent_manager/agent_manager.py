@@ -1,5 +1,6 @@
 from __future__ import annotations
 
+import asyncio
 import json
 import os
 import shutil
@@ -18,7 +19,8 @@ from agents.memory import Memory
 from agents.tot.tot import ToT
 
 from utils.parsing import dict2xml, xml2xmlstr, xmlstr2dict
-from utils.llm import llm_turn
+from utils.llm import llm_turn_async
+from utils.llm_scheduler import Priority
 from utils.console_io import ProgressIndicator
 from utils.files import write_persistent_note
 
@@ -149,6 +151,9 @@ class AgentManager():
             rprint(f"[red]{self.PRINT_PREFIX} Failed to load agents: {e}[/red]")
 
     def ipc(self, trigger: str, data: dict) -> None:
+        asyncio.run(self.ipc_async(trigger, data))
+
+    async def ipc_async(self, trigger: str, data: dict) -> None:
         self.csm.transition(trigger, locals())
 
         while self.csm.current_state.get_hpath() != "AwaitIPC":
@@ -178,11 +183,12 @@ class AgentManager():
                     self.memory.prime_all_prompts(self.csm.current_state.get_hpath(), "AGTMGR_DIR", dynamic_metaprompt=None, user_frmt={"agents_str": agents_xmlstr, "task": action_xmlstr})
                     dprint(f"{self.PRINT_PREFIX} self.memory.conversation_history:\n{self.memory.conversation_history}")
 
-                    text = llm_turn(client=self.client,
-                                    prompts={'system': self.memory.get_system_prompt(),
-                                            'messages': self.memory.get_messages()},
-                                    stop_sequences=["</output>"],
-                                    temperature=0.0)
+                    text = await llm_turn_async(client=self.client,
+                                                prompts={'system': self.memory.get_system_prompt(),
+                                                        'messages': self.memory.get_messages()},
+                                                stop_sequences=["</output>"],
+                                                temperature=0.0,
+                                                priority=Priority.ROUTING)
                     
                     self.memory.store_llm_response("<output>" + text + "</output>")
 
@@ -200,11 +206,12 @@ class AgentManager():
 
                     dprint(f"{self.PRINT_PREFIX} self.memory.conversation_history:\n{self.memory.conversation_history}")
 
-                    text = llm_turn(client=self.client,
-                                    prompts={'system': self.memory.get_system_prompt(),
-                                             'messages': self.memory.get_messages()},
-                                    stop_sequences=["</output>"],
-                                    temperature=0.7)
+                    text = await llm_turn_async(client=self.client,
+                                                prompts={'system': self.memory.get_system_prompt(),
+                                                         'messages': self.memory.get_messages()},
+                                                stop_sequences=["</output>"],
+                                                temperature=0.7,
+                                                priority=Priority.ROUTING)
                     
                     self.memory.store_llm_response("<output>" + text + "</output>")
 
@@ -226,7 +233,7 @@ class AgentManager():
                     
                     self.register_agent(new_agent)
 
-                    new_agent.run()
+                    await new_agent.run_async()
 
                     # Persist note on completion so UI is aware of execution status and output
                     task_text = action.get('task', 'Unknown task') if isinstance(action, dict) else str(action)
@@ -254,7 +261,7 @@ class AgentManager():
                             rprint(f"[grey][italic] Assigning agent: [bold]{agent.name}[/bold][/italic][/grey]")
 
                             agent.add_task(action)
-                            agent.run()
+                            await agent.run_async()
 
                             # Persist note on completion so UI is aware of execution status and output
                             task_text = action.get('task', 'Unknown task') if isinstance(action, dict) else str(action)
@@ -13,6 +13,7 @@ from agents.prompt_management import load_system_prompt, load_user_prompt, load_
 from utils.custom_types import Message
 from utils.custom_exceptions import PromptError
 from utils.enums import Role
+from utils.llm_tokens import get_token_counter
 from utils.parsing import files2dict
 
 class Memory:
@@ -95,6 +96,7 @@ class Memory:
         if self.conversation_history[-1]["role"] == Role.ASSISTANT.value:
             self.conversation_history[-1]["content"] = result
             self.conversation_history[-1]["timestamp"] = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+            get_token_counter().count_message(self.conversation_history[-1])
         else:
             error_message = f"{self.PRINT_PREFIX} Unexpected role at end of conversation: {self.conversation_history[-1]['role']}"
             print(f"[red][bold]{error_message}[/bold][/red]")
@@ -104,6 +106,7 @@ class Memory:
         now_str = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
         if "timestamp" not in msg:
             msg["timestamp"] = now_str
+        get_token_counter().count_message(msg)
         self.conversation_history.append(msg)
 
     def add_msg_obj(self, msg_obj: AnthropicMessage, frmt: dict[str, str]):
@@ -122,8 +125,13 @@ class Memory:
             'content': msg,
             'timestamp': now_str
         }
+        get_token_counter().count_message(msg_item)
 
         self.conversation_history.append(msg_item)
 
+    def count_tokens(self) -> int:
+        """Estimated size of the system prompt and conversation history, from the counts cached on each message."""
+        return get_token_counter().count_prompt(self.system_prompt or "", self.conversation_history)
+
     def add_result(self, result: dict):
         self.results[len(self.conversation_history)] = result
\ No newline at end of file
@@ -37,6 +37,11 @@ def load_user_prompt(state_path: str, environ_path_key: str, dynamic_metaprompt:
                 launch_debug_tui()
                 continue
 
+            if user_input.strip().lower() == "/stats":
+                from utils.llm_telemetry import print_llm_telemetry_summary
+                print_llm_telemetry_summary()
+                continue
+
             return "<input>" + user_input + "</input>"
 
     else:
@@ -0,0 +1,141 @@
+import asyncio
+from typing import Any, Awaitable, Callable, Generic, Optional, TypeVar
+
+from rich import print as rprint
+from utils.console_io import debug_print as dprint
+
+from agents.state_management import ConversationStateMachine
+from utils.custom_exceptions import ConversationNodeError
+
+
+T = TypeVar("T")
+
+
+class Stage:
+    """
+    One node of a stage graph. run() does the work of its state and returns the trigger to leave it by.
+
+    prefetch, if given, is a blocking function for the part of that work which does not depend on earlier
+    stages (reading prompt files, persistent notes). It is started on a worker thread as soon as a state
+    that can lead here is entered, and run() picks its result up with StageExecutor.prefetched().
+    """
+    def __init__(self, run: Callable[[], Awaitable[str]], prefetch: Optional[Callable[[], Any]] = None) -> None:
+        self.run = run
+        self.prefetch = prefetch
+
+
+class StageExecutor:
+    """
+    Runs an agent's pipeline as a graph of stages. The states and edges are those of the agent's
+    ConversationStateMachine (states.json and transitions.json), and every state that can be entered has a Stage.
+    Each trigger a stage returns goes through csm.transition, so state callbacks and the LLM state attribution
+    behave exactly as they do for a hand-written loop - scope is what the callbacks get as their locals.
+    """
+    PRINT_PREFIX = "[bold][StageExecutor][/bold]"
+
+    def __init__(self, csm: ConversationStateMachine, stages: dict[str, Stage], final_state: str, scope: Optional[dict[str, Any]] = None, prefix: str = "") -> None:
+        if prefix:
+            self.PRINT_PREFIX = f"{prefix} {self.PRINT_PREFIX}"
+
+        self.csm = csm
+        self.stages = stages
+        self.final_state = final_state
+        self.scope = scope if scope is not None else {}
+
+        self._prefetches: dict[str, asyncio.Future] = {}
+
+        missing = sorted(hpath for hpath, state in csm.state_map.items()
+                         if state.transitions and hpath != final_state and hpath not in stages)
+        if missing:
+            error_message = f"{self.PRINT_PREFIX} no stage for state(s) {', '.join(missing)}"
+            rprint(f"[red][bold]{error_message}[/bold][/red]")
+            raise ConversationNodeError(error_message)
+
+    def successors(self, hpath: str) -> set[str]:
+        return {state.get_hpath() for state in self.csm.state_map[hpath].transitions.values()}
+
+    def start_prefetches(self, hpaths: set[str]) -> None:
+        # Results left over from an earlier stage may be stale by now, so every prefetch starts afresh
+        self.discard_prefetches()
+
+        for hpath in hpaths:
+            stage = self.stages.get(hpath)
+            if stage is not None and stage.prefetch is not None:
+                self._prefetches[hpath] = asyncio.ensure_future(asyncio.to_thread(stage.prefetch))
+
+    def discard_prefetches(self) -> None:
+        for future in self._prefetches.values():
+            future.cancel()
+            # Retrieves the exception of a prefetch that failed unused, so it is not reported as unhandled
+            future.add_done_callback(lambda future: future.cancelled() or future.exception())
+
+        self._prefetches.clear()
+
+    async def prefetched(self, hpath: Optional[str] = None) -> Any:
+        """The result of the prefetch of hpath (the current state by default), run now if it was not started earlier."""
+        hpath = hpath if hpath is not None else self.csm.current_state.get_hpath()
+
+        future = self._prefetches.pop(hpath, None)
+        if future is not None:
+            return await future
+
+        prefetch = self.stages[hpath].prefetch
+        return await asyncio.to_thread(prefetch) if prefetch is not None else None
+
+    async def run(self) -> None:
+        """Runs stages from the current state until the final state is reached."""
+        try:
+            while (hpath := self.csm.current_state.get_hpath()) != self.final_state:
+                if hpath not in self.stages:
+                    error_message = f"{self.PRINT_PREFIX} no stage for state {hpath}"
+                    rprint(f"[red][bold]{error_message}[/bold][/red]")
+                    raise ConversationNodeError(error_message)
+
+                # The current state's own prefetch, if it was not started by the previous stage, is run on demand
+                current = self._prefetches.pop(hpath, None)
+                self.start_prefetches(self.successors(hpath) - {hpath})
+                if current is not None:
+                    self._prefetches[hpath] = current
+
+                trigger = await self.stages[hpath].run()
+                dprint(f"{self.PRINT_PREFIX} {hpath} -> {trigger}")
+
+                self.csm.transition(trigger, self.scope)
+        finally:
+            self.discard_prefetches()
+
+
+class ResultStream(Generic[T]):
+    """
+    Processes results that arrive on another thread (such as the votes a quorum predicate sees on the LLM loop)
+    as soon as each one arrives: process() runs on a worker thread of the loop the stream was created on, so
+    slow processing - an XML repair, say - of one result overlaps the calls that are still in flight.
+    feed() is the quorum-side callback and takes every result seen so far, keyed by index.
+    """
+    def __init__(self, process: Callable[[str], T]) -> None:
+        self.process = process
+        self._loop = asyncio.get_running_loop()
+        self._tasks: dict[int, asyncio.Future] = {}
+        self._fed: set[int] = set()
+
+    def feed(self, results: dict[int, str]) -> None:
+        for i, result in results.items():
+            if i not in self._fed:
+                self._fed.add(i)
+                self._loop.call_soon_threadsafe(self._start, i, result)
+
+    def _start(self, i: int, result: str) -> None:
+        if i not in self._tasks:
+            self._tasks[i] = asyncio.ensure_future(asyncio.to_thread(self.process, result))
+
+    async def collect(self, results: dict[int, str]) -> list[T]:
+        """The processed results, in index order, once they are ready. Any that were never fed are processed now."""
+        for i, result in results.items():
+            self._start(i, result)
+
+        return [await self._tasks[i] for i in sorted(results)]
+
+    def discard(self) -> None:
+        for task in self._tasks.values():
+            task.cancel()
+            task.add_done_callback(lambda task: task.cancelled() or task.exception())
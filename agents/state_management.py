@@ -16,6 +16,9 @@ from rich import print as rprint
 from utils.console_io import debug_print as dprint
 
 from utils.custom_exceptions import ConversationNodeError, ConversationEdgeError
+from utils.llm_budget import set_max_tokens_overrides
+from utils.llm_routing import ModelSpec, set_state_route
+from utils.llm_telemetry import format_llm_state, set_llm_state
 
 from agents.ui.callbacks import *
 from agents.tot.callbacks import *
@@ -25,7 +28,7 @@ from agents.agent_manager.callbacks import *
 class ConversationState:
     PRINT_PREFIX = "[bold][CS][/bold]"
 
-    def __init__(self, name: Optional[str] = None, parent: Optional[ConversationState] = None, system="", messages=[], frmt={}, prefix=""):
+    def __init__(self, name: Optional[str] = None, parent: Optional[ConversationState] = None, system="", messages=[], frmt={}, prefix="", max_tokens: Optional[int] = None, time_budget_sec: Optional[float] = None, model: Optional[ModelSpec] = None, temperature: Optional[float] = None):
         dotenv.load_dotenv()
 
         if prefix:
@@ -37,6 +40,14 @@ class ConversationState:
         self.messages: list = messages
         self.frmt = frmt
 
+        # Overrides the learned generation budget for LLM calls made in this state
+        self.max_tokens = max_tokens
+        # Seconds the LLM calls made in this state may take, for agents that enforce it
+        self.time_budget_sec = time_budget_sec
+        # Routes the LLM calls made in this state to another model (or the "small"/"large" tier) and temperature
+        self.model = model
+        self.temperature = temperature
+
         self.formatted_system = None
         self.formatted_messages = None
 
@@ -113,9 +124,19 @@ class ConversationStateMachine:
         self.initialize_conversation_states(state_data)
         self.initialize_transitions(transition_data)
 
+        set_max_tokens_overrides((format_llm_state(self.owner_name, hpath), state.max_tokens)
+                                 for hpath, state in self.state_map.items() if state.max_tokens is not None)
+
+        for hpath, state in self.state_map.items():
+            if state.model is not None or state.temperature is not None:
+                set_state_route(format_llm_state(self.owner_name, hpath), state.model, state.temperature)
+
         self.current_state: ConversationState = self.state_map[init_state_path]
         self.state_history: list[ConversationState] = [self.current_state]
 
+        # LLM calls made from here on are attributed to this state in telemetry
+        set_llm_state(self.owner_name, self.current_state.get_hpath())
+
         self.print_state_hierarchy()
 
         # pygraphviz/graphviz installation is nontrivial on Windows
@@ -132,6 +153,7 @@ class ConversationStateMachine:
             self.state_history.append(deepcopy(self.current_state))
 
             self.current_state = self.current_state.transitions[trigger]
+            set_llm_state(self.owner_name, self.current_state.get_hpath())
 
             self.current_state.on_enter(self, locals)
 
@@ -147,7 +169,11 @@ class ConversationStateMachine:
                                       parent=parent,
                                       system=state_data.get("system", ""),
                                       messages=state_data.get("messages", []),
-                                      prefix=self.PRINT_PREFIX)
+                                      prefix=self.PRINT_PREFIX,
+                                      max_tokens=state_data.get("max_tokens"),
+                                      time_budget_sec=state_data.get("time_budget_sec"),
+                                      model=state_data.get("model"),
+                                      temperature=state_data.get("temperature"))
 
             for child_data in state_data.get("children", []):
                 child_state = create_state(child_data, parent=state)
@@ -83,6 +83,17 @@ class Plan_Callback(StateCallback):
         # Perform actions when exiting Plan
         pass
 
+class DedupPlans_Callback(StateCallback):
+    def on_enter(self, csm, locals):
+        dprint(f"{self.PRINT_PREFIX} Entering DedupPlans")
+        # Perform actions when entering DedupPlans
+        pass
+
+    def on_exit(self, csm, locals):
+        dprint(f"{self.PRINT_PREFIX} Exiting DedupPlans")
+        # Perform actions when exiting DedupPlans
+        pass
+
 class PlanVote_Callback(StateCallback):
     def on_enter(self, csm, locals):
         dprint(f"{self.PRINT_PREFIX} Entering PlanVote")
@@ -127,6 +138,17 @@ class Propose_Callback(StateCallback):
         # Perform actions when exiting Propose
         pass
 
+class DedupProposals_Callback(StateCallback):
+    def on_enter(self, csm, locals):
+        dprint(f"{self.PRINT_PREFIX} Entering DedupProposals")
+        # Perform actions when entering DedupProposals
+        pass
+
+    def on_exit(self, csm, locals):
+        dprint(f"{self.PRINT_PREFIX} Exiting DedupProposals")
+        # Perform actions when exiting DedupProposals
+        pass
+
 class ProposeVote_Callback(StateCallback):
     def on_enter(self, csm, locals):
         dprint(f"{self.PRINT_PREFIX} Entering ProposeVote")
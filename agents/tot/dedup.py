@@ -0,0 +1,118 @@
+import ast
+import hashlib
+import os
+import re
+from typing import Optional
+
+import numpy as np
+
+from utils.console_io import debug_print as dprint
+
+
+PRINT_PREFIX = "[bold][Dedup][/bold]"
+
+CODE_FENCE_PATTERN = re.compile(r"```(?:\w+)?\n?(.*?)```", re.DOTALL)
+TOKEN_PATTERN = re.compile(r"\w+|[^\w\s]")
+
+SHINGLE_SIZE = 3
+MINHASH_PERMUTATIONS = 128
+# Shingle hashes and coefficients are below this Mersenne prime, so a * x + b never overflows 64 bits
+MINHASH_PRIME = (1 << 31) - 1
+MINHASH_SEED = 0
+
+
+def use_dedup() -> bool:
+    return os.environ.get("TOT_DEDUP", "True").lower() == "true"
+
+def get_dedup_threshold(code: bool = False) -> float:
+    # A one-literal change (a different file name, say) leaves long code almost as similar as reworded plans are
+    if code:
+        return float(os.environ.get("TOT_DEDUP_CODE_THRESHOLD", "0.98"))
+
+    return float(os.environ.get("TOT_DEDUP_THRESHOLD", "0.9"))
+
+def get_prior_votes() -> float:
+    return float(os.environ.get("TOT_DEDUP_PRIOR_VOTES", "0.5"))
+
+def get_cluster_prior(sizes: list[int], prior_votes: Optional[float] = None) -> list[float]:
+    """Pseudo first-place votes for each cluster: prior_votes (see get_prior_votes) for every candidate it absorbed."""
+    prior_votes = get_prior_votes() if prior_votes is None else prior_votes
+    return [prior_votes * (size - 1) for size in sizes]
+
+def normalize_whitespace(text: str) -> str:
+    return " ".join(text.split())
+
+def canonicalize_python(candidate: str) -> str:
+    """
+    ast.dump of the code in a fenced proposal, so formatting and comments do not tell proposals apart.
+    Code that does not parse is compared by its text with the whitespace normalized.
+    """
+    match = CODE_FENCE_PATTERN.search(candidate)
+    code = match.group(1) if match else candidate
+
+    try:
+        return ast.dump(ast.parse(code))
+    except (SyntaxError, ValueError):
+        return normalize_whitespace(code)
+
+def get_shingles(text: str) -> set[str]:
+    tokens = TOKEN_PATTERN.findall(text.lower())
+    if len(tokens) < SHINGLE_SIZE:
+        return {" ".join(tokens)}
+
+    return {" ".join(tokens[i:i + SHINGLE_SIZE]) for i in range(len(tokens) - SHINGLE_SIZE + 1)}
+
+class MinHasher:
+    """MinHash signatures over token shingles, so the share of equal entries in two signatures estimates the Jaccard similarity of their texts."""
+    def __init__(self, permutations: int = MINHASH_PERMUTATIONS, seed: int = MINHASH_SEED) -> None:
+        rng = np.random.default_rng(seed)
+        self.a = rng.integers(1, MINHASH_PRIME, size=permutations, dtype=np.uint64)
+        self.b = rng.integers(0, MINHASH_PRIME, size=permutations, dtype=np.uint64)
+
+    def signature(self, text: str) -> np.ndarray:
+        hashes = np.array([int.from_bytes(hashlib.blake2b(shingle.encode("utf-8"), digest_size=4).digest(), "little") for shingle in get_shingles(text)],
+                          dtype=np.uint64) % np.uint64(MINHASH_PRIME)
+
+        # (shingles, permutations) universal hashes, each permutation keeping its smallest
+        return ((hashes[:, None] * self.a[None, :] + self.b[None, :]) % np.uint64(MINHASH_PRIME)).min(axis=0)
+
+    @staticmethod
+    def similarity(signature: np.ndarray, other: np.ndarray) -> float:
+        return float(np.mean(signature == other))
+
+def cluster_candidates(candidates: list[str], code: bool = False, threshold: Optional[float] = None) -> list[list[int]]:
+    """
+    Groups candidates that are identical once canonicalized (whitespace normalized, or ast.dump with code), and
+    then those whose MinHash similarity is at least threshold (see get_dedup_threshold). Returns lists of
+    candidate indices, in order of first appearance, each starting with the candidate that stands for the cluster.
+    There are only PLAN_COUNT or PROPOSAL_COUNT candidates, so every cluster is compared rather than LSH bucketed.
+    """
+    threshold = get_dedup_threshold(code) if threshold is None else threshold
+    hasher = MinHasher()
+
+    clusters: list[list[int]] = []
+    canonical_clusters: dict[str, int] = {}
+    signatures: list[np.ndarray] = []
+
+    for i, candidate in enumerate(candidates):
+        canonical = canonicalize_python(candidate) if code else normalize_whitespace(candidate)
+
+        if canonical in canonical_clusters:
+            clusters[canonical_clusters[canonical]].append(i)
+            continue
+
+        signature = hasher.signature(canonical)
+        similarities = [MinHasher.similarity(signature, cluster_signature) for cluster_signature in signatures]
+        similar = next((cluster_i for cluster_i, similarity in enumerate(similarities) if similarity >= threshold), None)
+
+        if similar is not None:
+            dprint(f"{PRINT_PREFIX} candidate {i} joins candidate {clusters[similar][0]} (MinHash similarity {similarities[similar]:0.2f})")
+            clusters[similar].append(i)
+            canonical_clusters[canonical] = similar
+            continue
+
+        canonical_clusters[canonical] = len(clusters)
+        clusters.append([i])
+        signatures.append(signature)
+
+    return clusters
@@ -0,0 +1,273 @@
+import math
+import os
+import re
+from abc import ABC, abstractmethod
+from collections import Counter
+from typing import Callable, Optional
+
+import numpy as np
+
+from agents.tot.ranking import RANKING_PATTERN, aggregate, get_positions, get_ranking_method, get_wins, leader_confidence, parse_ranking
+
+
+BEST_CANDIDATE_PATTERN = re.compile(r"<best_candidate>\s*(\d+)\s*</best_candidate>")
+WORST_CANDIDATE_PATTERN = re.compile(r"<worst_candidate>\s*(\d+)\s*</worst_candidate>")
+COMPLETE_PATTERN = re.compile(r"<complete>\s*(yes|no)\s*</complete>")
+ERROR_PATTERN = re.compile(r"<error>\s*(yes|no)\s*</error>")
+
+
+def use_vote_quorum() -> bool:
+    return os.environ.get("VOTE_QUORUM", "True").lower() == "true"
+
+def use_adaptive_voting() -> bool:
+    return os.environ.get("VOTE_ADAPTIVE", "False").lower() == "true"
+
+def get_vote_waves(max_voters: int) -> list[int]:
+    """Sizes of the waves adaptive voting launches voters in: VOTE_ADAPTIVE_MIN_VOTERS, then VOTE_ADAPTIVE_WAVE_SIZE at a time up to max_voters."""
+    first_wave = max(1, int(os.environ.get("VOTE_ADAPTIVE_MIN_VOTERS", "2")))
+    wave_size = max(1, int(os.environ.get("VOTE_ADAPTIVE_WAVE_SIZE", "1")))
+
+    waves = [min(first_wave, max_voters)]
+    while sum(waves) < max_voters:
+        waves.append(min(wave_size, max_voters - sum(waves)))
+
+    return waves
+
+def prob_better(wins: int, losses: int) -> float:
+    """
+    Posterior probability that p > 0.5, for the probability p of winning a comparison, after wins and losses
+    under a uniform prior - for integer Beta parameters this is a binomial tail, so it needs no special functions.
+    """
+    a, b = wins + 1, losses + 1
+    n = a + b - 1
+
+    return sum(math.comb(n, k) for k in range(a)) / 2 ** n
+
+def match_group(pattern: re.Pattern, text: str) -> Optional[str]:
+    match = pattern.search(text)
+    return match.group(1) if match else None
+
+
+class VoteQuorum(ABC):
+    """
+    Quorum predicate for llm_turns that keeps the votes it has been shown, keyed by voter index.
+    Votes are read with plain regexes (no XML repair, which would need an LLM call), and a vote that
+    cannot be read that way is treated like one that has not arrived - the full tally still counts it.
+    With VOTE_QUORUM set to "False" it only records the votes and never ends voting early.
+    listener, if set, is shown the votes too, each time one arrives.
+    """
+    def __init__(self, voter_count: int) -> None:
+        self.voter_count = voter_count
+        self.enabled = use_vote_quorum()
+        self.votes: dict[int, str] = {}
+        self.listener: Optional[Callable[[dict[int, str]], None]] = None
+
+    def __call__(self, votes: dict[int, str]) -> bool:
+        self.votes = dict(votes)
+
+        if self.listener is not None:
+            self.listener(self.votes)
+
+        return self.enabled and self.is_decided()
+
+    @abstractmethod
+    def is_decided(self) -> bool:
+        ...
+
+    def is_separated(self, confidence: float) -> bool:
+        """Sequential test for adaptive voting: whether the votes so far settle the outcome with the given confidence."""
+        return False
+
+    @abstractmethod
+    def read_votes(self) -> list[tuple]:
+        """The votes that could be read, each reduced to what the tally compares."""
+
+    def agreement(self) -> float:
+        """Fraction of the readable votes that agree with the most common one (0.0 if none could be read)."""
+        read_votes = self.read_votes()
+        if not read_votes:
+            return 0.0
+
+        return Counter(read_votes).most_common(1)[0][1] / len(read_votes)
+
+    def voter_indices(self) -> list[int]:
+        return sorted(self.votes)
+
+    def ordered_votes(self) -> list[str]:
+        return [self.votes[i] for i in self.voter_indices()]
+
+
+class ExecVoteQuorum(VoteQuorum):
+    """Decided once the SumExecVote majorities (complete > half, else error > half, else neither) can no longer change."""
+    def is_decided(self) -> bool:
+        yes_votes = error_votes = read_votes = 0
+
+        for vote in self.votes.values():
+            complete, error = match_group(COMPLETE_PATTERN, vote), match_group(ERROR_PATTERN, vote)
+            if complete is None or error is None:
+                continue
+
+            read_votes += 1
+            yes_votes += complete == "yes"
+            error_votes += error == "yes"
+
+        outstanding = self.voter_count - read_votes
+        majority = self.voter_count / 2
+
+        if yes_votes > majority:
+            return True
+
+        if yes_votes + outstanding <= majority:
+            return error_votes > majority or error_votes + outstanding <= majority
+
+        return False
+
+    def read_votes(self) -> list[tuple]:
+        read_votes = []
+
+        for vote in self.votes.values():
+            complete, error = match_group(COMPLETE_PATTERN, vote), match_group(ERROR_PATTERN, vote)
+            if complete is not None and error is not None:
+                read_votes.append((complete, error))
+
+        return read_votes
+
+
+class RankingVoteQuorum(VoteQuorum):
+    """
+    Decided once the leading candidate can no longer be overtaken under reduce_scores' +1 best / -1 worst tally.
+    prior, if given, is added to the tally as it is by reduce_scores (see agents.tot.dedup.get_cluster_prior).
+    """
+    def __init__(self, voter_count: int, candidate_count: int, index_maps: list[list[int]], prior: Optional[list[float]] = None) -> None:
+        super().__init__(voter_count)
+        self.candidate_count = candidate_count
+        self.index_maps = index_maps
+        self.prior = prior
+
+    def read_rankings(self) -> list[tuple[int, int]]:
+        """The (best, worst) original candidate indices of each vote that could be read."""
+        rankings = []
+
+        for voter_i, vote in self.votes.items():
+            best, worst = match_group(BEST_CANDIDATE_PATTERN, vote), match_group(WORST_CANDIDATE_PATTERN, vote)
+            if best is None or worst is None or not (1 <= int(best) <= self.candidate_count and 1 <= int(worst) <= self.candidate_count):
+                continue
+
+            index_map = self.index_maps[voter_i]
+            rankings.append((index_map[int(best) - 1], index_map[int(worst) - 1]))
+
+        return rankings
+
+    def get_scores(self, rankings: list[tuple[int, int]]) -> list[float]:
+        scores = list(self.prior) if self.prior is not None else [0.0] * self.candidate_count
+
+        for best, worst in rankings:
+            scores[best] += 1
+            scores[worst] -= 1
+
+        return scores
+
+    def is_decided(self) -> bool:
+        if self.candidate_count < 2:
+            return True
+
+        rankings = self.read_rankings()
+        outstanding = self.voter_count - len(rankings)
+
+        ranked = sorted(self.get_scores(rankings), reverse=True)
+
+        # Each outstanding vote can raise the runner-up by one and lower the leader by one
+        return ranked[0] - ranked[1] > 2 * outstanding
+
+    def is_separated(self, confidence: float) -> bool:
+        """
+        Sign test of the leader against the runner-up: a vote naming the leader best or the runner-up worst is a
+        win for the leader, one naming the runner-up best or the leader worst a loss, and voting can stop once
+        the leader is the better of the two with probability confidence. Checked after every wave, so with few
+        candidates of clearly different quality two or three votes are enough.
+        """
+        if self.candidate_count < 2:
+            return True
+
+        rankings = self.read_rankings()
+        if not rankings:
+            return False
+
+        scores = self.get_scores(rankings)
+        leader, runner_up = sorted(range(self.candidate_count), key=lambda i: scores[i], reverse=True)[:2]
+
+        wins = sum((best == leader) + (worst == runner_up) for best, worst in rankings)
+        losses = sum((best == runner_up) + (worst == leader) for best, worst in rankings)
+
+        return prob_better(wins, losses) >= confidence
+
+    def read_votes(self) -> list[tuple]:
+        read_votes = []
+
+        # Voters see the candidates shuffled, so agreement is on the best candidate's original index
+        for voter_i, vote in self.votes.items():
+            best = match_group(BEST_CANDIDATE_PATTERN, vote)
+            if best is not None and 1 <= int(best) <= self.candidate_count:
+                read_votes.append((self.index_maps[voter_i][int(best) - 1],))
+
+        return read_votes
+
+
+class FullRankingVoteQuorum(VoteQuorum):
+    """
+    Quorum for votes that rank every candidate (VOTE_RANKING), scored with Borda counts or Bradley-Terry
+    strengths (see agents.tot.ranking). With Borda it is decided once the leader can no longer be overtaken;
+    Bradley-Terry scores have no such bound, so there it only ends early through the sequential test.
+    prior is counted as pseudo first-place votes, as reduce_rankings does.
+    """
+    def __init__(self, voter_count: int, candidate_count: int, index_maps: list[list[int]], method: Optional[str] = None, prior: Optional[list[float]] = None) -> None:
+        super().__init__(voter_count)
+        self.candidate_count = candidate_count
+        self.index_maps = index_maps
+        self.method = method or get_ranking_method()
+        self.prior = np.array(prior, dtype=float) if prior is not None else None
+
+    def read_rankings(self) -> tuple[list[list[int]], list[list[int]]]:
+        """The rankings that could be read, in the shuffled order each voter saw, and their voters' index maps."""
+        rankings, index_maps = [], []
+
+        for voter_i, vote in self.votes.items():
+            ranking = parse_ranking(match_group(RANKING_PATTERN, vote), self.candidate_count)
+            if ranking is not None:
+                rankings.append(ranking)
+                index_maps.append(self.index_maps[voter_i])
+
+        return rankings, index_maps
+
+    def is_decided(self) -> bool:
+        if self.candidate_count < 2:
+            return True
+
+        rankings, index_maps = self.read_rankings()
+        outstanding = self.voter_count - len(rankings)
+
+        if self.method != "borda":
+            return outstanding <= 0
+
+        ranked = sorted(aggregate(get_positions(rankings, index_maps, self.candidate_count), "borda", self.prior), reverse=True)
+
+        # Each outstanding vote can put the runner-up first and the leader last
+        return ranked[0] - ranked[1] > (self.candidate_count - 1) * outstanding
+
+    def is_separated(self, confidence: float) -> bool:
+        """Whether the leader beats the runner-up with probability confidence, as estimated by agents.tot.ranking.leader_confidence."""
+        if self.candidate_count < 2:
+            return True
+
+        rankings, index_maps = self.read_rankings()
+        if not rankings:
+            return False
+
+        positions = get_positions(rankings, index_maps, self.candidate_count)
+        return leader_confidence(get_wins(positions, self.prior), aggregate(positions, self.method, self.prior)) >= confidence
+
+    def read_votes(self) -> list[tuple]:
+        rankings, index_maps = self.read_rankings()
+
+        # Agreement is on the original index of each voter's first choice
+        return [(index_map[ranking[0]],) for ranking, index_map in zip(rankings, index_maps)]
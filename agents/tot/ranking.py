@@ -0,0 +1,151 @@
+import math
+import os
+import re
+from typing import Optional
+
+import numpy as np
+
+from rich import print as rprint
+
+
+PRINT_PREFIX = "[bold][Ranking][/bold]"
+
+RANKING_METHODS = ("bradley_terry", "borda")
+
+RANKING_PATTERN = re.compile(r"<ranking>(.*?)</ranking>", re.DOTALL)
+
+# Pseudo-comparisons won by each side of every pair, so Bradley-Terry strengths stay finite when one candidate wins them all
+BT_PRIOR = 0.25
+BT_ITERATIONS = 200
+BT_TOLERANCE = 1e-8
+
+
+def use_full_ranking() -> bool:
+    return os.environ.get("VOTE_RANKING", "False").lower() == "true"
+
+def get_ranking_method() -> str:
+    method = os.environ.get("VOTE_RANKING_METHOD", "bradley_terry").strip().lower()
+
+    if method not in RANKING_METHODS:
+        rprint(f"[yellow]{PRINT_PREFIX} Unknown VOTE_RANKING_METHOD {method!r}, expected one of {', '.join(RANKING_METHODS)} - using bradley_terry[/yellow]")
+        return "bradley_terry"
+
+    return method
+
+def parse_ranking(ranking: Optional[str], candidate_count: int) -> Optional[list[int]]:
+    """
+    The 0-based candidate numbers of a ranking such as "3, 1, 2", best first. Numbers that are out of range or
+    repeated are dropped, and None is returned if fewer than two are left - that ranks nothing.
+    """
+    if ranking is None:
+        return None
+
+    numbers: list[int] = []
+    for number in re.findall(r"\d+", str(ranking)):
+        i = int(number) - 1
+        if 0 <= i < candidate_count and i not in numbers:
+            numbers.append(i)
+
+    return numbers if len(numbers) >= 2 else None
+
+def get_positions(rankings: list[list[int]], index_maps: list[list[int]], candidate_count: int) -> np.ndarray:
+    """
+    (voters, candidates) array of the position each voter ranked each original candidate at, 0 being the best.
+    rankings are in the shuffled order each voter saw (see parse_ranking), and candidates a voter left out
+    share the positions after the ones it ranked.
+    """
+    positions = np.empty((len(rankings), candidate_count), dtype=float)
+
+    for voter_i, (ranking, index_map) in enumerate(zip(rankings, index_maps)):
+        positions[voter_i, :] = (len(ranking) + candidate_count - 1) / 2
+        positions[voter_i, [index_map[i] for i in ranking]] = np.arange(len(ranking))
+
+    return positions
+
+def borda_scores(positions: np.ndarray) -> np.ndarray:
+    """candidate_count - 1 points for each first place, down to 0 for each last place."""
+    return (positions.shape[1] - 1 - positions).sum(axis=0)
+
+def pairwise_wins(positions: np.ndarray) -> np.ndarray:
+    """wins[i, j] is the number of voters that ranked candidate i above candidate j, ties counting half."""
+    above = positions[:, :, None] < positions[:, None, :]
+    tied = positions[:, :, None] == positions[:, None, :]
+
+    wins = above.sum(axis=0) + 0.5 * tied.sum(axis=0)
+    np.fill_diagonal(wins, 0.0)
+
+    return wins
+
+def prior_wins(prior: np.ndarray) -> np.ndarray:
+    """Pairwise wins of prior pseudo first-place votes (see agents.tot.dedup): each of candidate i's beats every other candidate."""
+    prior = np.asarray(prior, dtype=float)
+
+    wins = np.repeat(prior[:, None], len(prior), axis=1)
+    np.fill_diagonal(wins, 0.0)
+
+    return wins
+
+def get_wins(positions: np.ndarray, prior: Optional[np.ndarray] = None) -> np.ndarray:
+    wins = pairwise_wins(positions)
+    return wins if prior is None else wins + prior_wins(prior)
+
+def _with_prior(wins: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    prior = np.full(wins.shape, BT_PRIOR)
+    np.fill_diagonal(prior, 0.0)
+
+    wins = wins + prior
+    return wins, wins + wins.T
+
+def bradley_terry(wins: np.ndarray) -> np.ndarray:
+    """
+    Log strengths (mean 0) of the Bradley-Terry model P(i beats j) = s_i / (s_i + s_j) fitted to wins, with the
+    minorization-maximization updates of Hunter (2004): s_i = wins_i / sum_j n_ij / (s_i + s_j).
+    """
+    wins, comparisons = _with_prior(wins)
+    total_wins = wins.sum(axis=1)
+
+    strengths = np.ones(wins.shape[0])
+    for _ in range(BT_ITERATIONS):
+        updated = total_wins / (comparisons / (strengths[:, None] + strengths[None, :])).sum(axis=1)
+        updated /= np.exp(np.log(updated).mean())
+
+        converged = np.max(np.abs(updated - strengths)) < BT_TOLERANCE
+        strengths = updated
+        if converged:
+            break
+
+    return np.log(strengths)
+
+def leader_confidence(wins: np.ndarray, scores: np.ndarray) -> float:
+    """
+    Estimated probability that the candidate leading on scores is really better than the runner-up: the
+    difference of their Bradley-Terry log strengths over its standard error, read off the inverse Fisher
+    information of the model, so every comparison involving either of them counts - not only their own.
+    """
+    if len(scores) < 2:
+        return 1.0
+
+    leader, runner_up = np.argsort(-scores, kind="stable")[:2]
+
+    log_strengths = bradley_terry(wins)
+    _, comparisons = _with_prior(wins)
+
+    p = 1 / (1 + np.exp(log_strengths[None, :] - log_strengths[:, None]))
+    weights = comparisons * p * (1 - p)
+    information = np.diag(weights.sum(axis=1)) - weights
+
+    # Strengths are only defined up to a common factor, so the information is singular and its pseudo-inverse is used
+    e = np.zeros(len(scores))
+    e[leader], e[runner_up] = 1.0, -1.0
+    standard_error = math.sqrt(max(float(e @ np.linalg.pinv(information) @ e), 1e-12))
+
+    z = (log_strengths[leader] - log_strengths[runner_up]) / standard_error
+    return 0.5 * (1 + math.erf(z / math.sqrt(2)))
+
+def aggregate(positions: np.ndarray, method: str, prior: Optional[np.ndarray] = None) -> np.ndarray:
+    """Scores of the candidates (higher is better) from the positions voters ranked them at, and prior pseudo first-place votes."""
+    if method == "borda":
+        scores = borda_scores(positions)
+        return scores if prior is None else scores + (positions.shape[1] - 1) * np.asarray(prior, dtype=float)
+
+    return bradley_terry(get_wins(positions, prior))
@@ -1,3 +1,4 @@
+import asyncio
 import os
 import json
 import platform
@@ -6,7 +7,7 @@ import signal
 import sys
 import threading
 from datetime import datetime
-from typing import Optional
+from typing import Any, Awaitable, Callable, Optional
 
 # Gracefully handle pynput import in headless/SSH environments without a DISPLAY
 try:
@@ -21,6 +22,7 @@ import numpy as np
 
 from agents.agent import Agent
 from agents.state_management import ConversationStateMachine
+from agents.stage_executor import ResultStream, Stage, StageExecutor
 from agents.execution_management.execution_management import CodeExecutor
 from agents.prompt_management import load_system_prompt, load_user_prompt, get_msg
 
@@ -28,11 +30,19 @@ from agents.memory import Memory
 
 from remote.experience import get_remote_experiences, stage_experience
 from utils.context import get_platform_details
-from utils.custom_exceptions import ExecError
+from utils.custom_exceptions import ExecError, LLMCancelledError
 from utils.enums import Role
-from utils.custom_types import FeedbackDict, PromptsDict
+from utils.custom_types import FeedbackDict, Message, PromptsDict
 from utils.parsing import dict2xml, xml2xmlstr, xmlstr2dict, extract_language_and_code, get_yes_no_input, remove_escape_key, format_nested_dict
-from utils.llm import llm_turns
+from utils.llm import llm_turns, llm_turns_async, run_in_llm_state
+from utils.llm_cancel import CancelToken
+from utils.llm_routing import LARGE, SMALL, get_provider, has_small_model
+from utils.llm_scheduler import Priority
+from utils.llm_telemetry import format_llm_state, record_vote
+from utils.llm_tokens import trim_longest_messages
+from agents.tot.quorum import ExecVoteQuorum, FullRankingVoteQuorum, RankingVoteQuorum, VoteQuorum, get_vote_waves, use_adaptive_voting
+from agents.tot.dedup import cluster_candidates, get_cluster_prior, use_dedup
+from agents.tot.ranking import aggregate, get_positions, get_ranking_method, parse_ranking, use_full_ranking
 from utils.files import create_incrementing_directory, read_persistent_notes
 from utils.constants import CLIENT_VERSION, FRIENDLY_COLOR, get_env_constants
 from utils.console_io import ProgressIndicator, debug_print as dprint
@@ -44,6 +54,29 @@ PLAN_COUNT = int(os.environ.get("PLAN_COUNT", "5"))
 VOTER_COUNT = int(os.environ.get("VOTER_COUNT", "5"))
 PROPOSAL_COUNT = int(os.environ.get("PROPOSAL_COUNT", "5"))
 
+# Run votes on the small model first, and again on the large one only if too few of them agree
+VOTE_CASCADE = os.environ.get("VOTE_CASCADE", "False").lower() == "true"
+VOTE_CASCADE_AGREEMENT = float(os.environ.get("VOTE_CASCADE_AGREEMENT", "0.7"))
+
+# Launch PlanVote and ProposeVote voters in waves, and stop once a sequential test separates the leading candidate
+VOTE_ADAPTIVE = use_adaptive_voting()
+VOTE_ADAPTIVE_MAX_VOTERS = int(os.environ.get("VOTE_ADAPTIVE_MAX_VOTERS") or VOTER_COUNT)
+VOTE_ADAPTIVE_CONFIDENCE = float(os.environ.get("VOTE_ADAPTIVE_CONFIDENCE", "0.9"))
+
+# Have PlanVote and ProposeVote voters rank every candidate, scored by Bradley-Terry strength or Borda count,
+# instead of naming only the best and worst
+VOTE_RANKING = use_full_ranking()
+VOTE_RANKING_METHOD = get_ranking_method()
+
+# Collapse identical and near-duplicate candidates before PlanVote and ProposeVote, each cluster's size counting as a prior
+DEDUP_CANDIDATES = use_dedup()
+
+# Seconds the LLM calls of one state may take before the results received so far are used (0 for no limit)
+STAGE_BUDGET_SEC = float(os.environ.get("TOT_STAGE_BUDGET_SEC", "0"))
+
+# Generate the next step's plans while ExecVote is still out, and keep them unless the task turns out to be done
+SPECULATIVE_PLANNING = os.environ.get("TOT_SPECULATIVE_PLANNING", "True").lower() == "true"
+
 REMOTE_EXAMPLE_COUNT = int(os.environ.get("REMOTE_EXAMPLE_COUNT", "4"))
 
 EVAL_CATEGORIES = ["correctness", "elegance", "understandability", "specificity", "overall"]
@@ -110,6 +143,10 @@ class ToT(Agent):
 
         self.interrupted = False
         self.interrupt_listener = None
+        self.cancel_token = CancelToken()
+        self._run_loop: Optional[asyncio.AbstractEventLoop] = None
+        self._run_task: Optional[asyncio.Task] = None
+        self.speculative_plans: Optional[tuple[str, PromptsDict, asyncio.Task]] = None
         self._setup_interrupt_listener()
 
     def _is_wayland(self) -> bool:
@@ -123,8 +160,12 @@ class ToT(Agent):
         try:
             def _signal_handler(sig, frame):
                 dprint(f"{self.PRINT_PREFIX} Received signal {sig}, initiating graceful shutdown...")
-                self.interrupted = True
-                raise KeyboardInterrupt
+                repeated = self.interrupted
+
+                # Cancelling the running task only takes effect once the loop gets control back, so code blocking
+                # the loop (a prompt, the generated code running) is interrupted by raising - as is a repeated signal
+                if not self.request_interrupt() or repeated or not self._loop_is_waiting(frame):
+                    raise KeyboardInterrupt
 
             signal.signal(signal.SIGINT, _signal_handler)
             signal.signal(signal.SIGTERM, _signal_handler)
@@ -173,7 +214,7 @@ class ToT(Agent):
                         for event in dev.read():
                             if event.type == ecodes.EV_KEY and event.value == 1:  # Key press
                                 if event.code == ecodes.KEY_ESC:
-                                    self.interrupted = True
+                                    self.request_interrupt()
                                     return
             except Exception as e:
                 dprint(f"{self.PRINT_PREFIX} evdev listener thread ended: {e}")
@@ -183,12 +224,209 @@ class ToT(Agent):
 
     def on_press(self, key):
         if keyboard is not None and key == keyboard.Key.esc:
-            self.interrupted = True
+            self.request_interrupt()
+
+    def request_interrupt(self) -> bool:
+        """Flags an interrupt and cancels the running task, if any, and all in-flight LLM calls."""
+        self.interrupted = True
+        self.cancel_token.cancel("interrupted")
+
+        if self._run_loop is not None and self._run_task is not None and not self._run_loop.is_closed():
+            self._run_loop.call_soon_threadsafe(self._run_task.cancel)
+            return True
+
+        return False
+
+    @staticmethod
+    def _loop_is_waiting(frame) -> bool:
+        """Whether a signal arrived while the event loop was waiting on its selector, free to run the task cancel right away."""
+        return frame is not None and os.path.basename(frame.f_code.co_filename) == "selectors.py"
 
     def check_interrupt(self):
         if self.interrupted:
             raise KeyboardInterrupt
 
+    def get_stage_cancel_token(self, state_path: Optional[str] = None) -> CancelToken:
+        """Cancelled with the run, and expires after the time budget of the current state or state_path (states.json "time_budget_sec", else TOT_STAGE_BUDGET_SEC)."""
+        state = self.csm.current_state if state_path is None else self.csm.find_state_by_path(state_path)
+        budget_sec = (state.time_budget_sec if state is not None else None) or STAGE_BUDGET_SEC
+        return self.cancel_token.child(budget_sec if budget_sec > 0 else None)
+
+    def plan_prompts(self, state_path: str, step_num: int, history: list[Message], previous_step: Optional[dict], persistent_notes: str, remote_examples: str) -> PromptsDict:
+        """Prompts of the Plan or PlanErrorFix state of step step_num, following history."""
+        if state_path == "Plan":
+            system_prompt = load_system_prompt(state_path, "TOT_DIR", {"step_num": str(step_num),
+                                                                       "task": self.current_task,
+                                                                       "persistent_notes": persistent_notes,
+                                                                       "remote_examples": remote_examples})
+
+            user_prompt = get_msg(Role.USER, load_user_prompt(state_path, "TOT_DIR", None, {"step_num": str(step_num),
+                                                                                            "task": self.current_task,
+                                                                                            "suffix": ", taking into consideration the results of what you have already done in prior steps:" if step_num > 1 else ":"}))
+        else:
+            frmt = {"step_num": str(step_num),
+                    "task": self.current_task,
+                    "persistent_notes": persistent_notes,
+                    "error": previous_step['error'],  # type: ignore
+                    "output": previous_step['output']}  # type: ignore
+
+            system_prompt = load_system_prompt(state_path, "TOT_DIR", frmt)
+            user_prompt = get_msg(Role.USER, load_user_prompt(state_path, "TOT_DIR", None, frmt))
+
+        assistant_prompt = get_msg(Role.ASSISTANT, f"<step_{step_num}><plan>")
+
+        return {"system": system_prompt, "messages": history + [user_prompt, assistant_prompt]}
+
+    async def generate_plans(self, prompts: PromptsDict, cancel: CancelToken, priority: Optional[Priority] = None) -> list[str]:
+        return await llm_turns_async(client=self.client,
+                                     prompts=prompts,
+                                     stop_sequences=["</plan>"],
+                                     temperature=TEMP,
+                                     n=PLAN_COUNT,
+                                     cancel=cancel,
+                                     priority=priority,
+                                     trim=trim_longest_messages)
+
+    def speculate_plans(self, persistent_notes: str, remote_examples: str) -> None:
+        """
+        Starts generating the next step's plans - with PlanErrorFix if this step wrote to stderr, else with Plan -
+        so they are underway while ExecVote decides whether there is a next step at all. They are requested at
+        the lowest priority, so they only ever take slots the votes that decide the step leave free.
+        """
+        state_path = "PlanErrorFix" if self.unified_step['error'].strip() else "Plan"
+
+        # The history as next_step() is going to leave it
+        unified_user_str, unified_assistant_str = self.step2str()
+        history = self.unified_memory.conversation_history + [get_msg(Role.USER, unified_user_str), get_msg(Role.ASSISTANT, unified_assistant_str)]
+
+        prompts = self.plan_prompts(state_path, self.step_num + 1, history, self.unified_step, persistent_notes, remote_examples)
+        cancel = self.get_stage_cancel_token(state_path)
+
+        # The calls are attributed to the state they are made for
+        async def generate() -> list[str]:
+            return await run_in_llm_state(format_llm_state(self.csm.owner_name, state_path), self.generate_plans(prompts, cancel, Priority.SPECULATIVE))
+
+        task = asyncio.create_task(generate())
+
+        dprint(f"{self.PRINT_PREFIX} speculatively generating the plans of step {self.step_num + 1} with {state_path}")
+        self.speculative_plans = (state_path, prompts, task)
+
+    async def take_speculative_plans(self, state_path: str, prompts: PromptsDict) -> Optional[list[str]]:
+        """The speculative plans, if they were generated for state_path from the same prompts - else None."""
+        if self.speculative_plans is None:
+            return None
+
+        speculative_state_path, speculative_prompts, task = self.speculative_plans
+        self.speculative_plans = None
+
+        # Only role and content are sent - the timestamps of the history differ
+        def request(prompts: PromptsDict) -> tuple:
+            return prompts['system'], [(message['role'], message['content']) for message in prompts['messages']]  # type: ignore
+
+        if speculative_state_path != state_path or request(speculative_prompts) != request(prompts):
+            dprint(f"{self.PRINT_PREFIX} discarding the speculative plans generated with {speculative_state_path}")
+            self.discard_task(task)
+            return None
+
+        dprint(f"{self.PRINT_PREFIX} using the speculative plans")
+        return await task
+
+    def discard_speculative_plans(self) -> None:
+        if self.speculative_plans is not None:
+            dprint(f"{self.PRINT_PREFIX} discarding the speculative plans generated with {self.speculative_plans[0]}")
+            self.discard_task(self.speculative_plans[2])
+            self.speculative_plans = None
+
+    @staticmethod
+    def discard_task(task: asyncio.Task) -> None:
+        task.cancel()
+        # Retrieves the exception of a task that failed before it was discarded, so it is not reported as unhandled
+        task.add_done_callback(lambda task: task.cancelled() or task.exception())
+
+    async def vote(self, prompts: PromptsDict | list[PromptsDict], n: Optional[int], make_quorum: Callable[[], VoteQuorum], start_seq: str, adaptive: bool = False) -> tuple[list[str], VoteQuorum, list[Any]]:
+        """
+        Collects the votes for the current state under a fresh quorum from make_quorum, and returns them with it
+        and with each vote parsed. Votes are parsed as they arrive, so one that needs an XML repair is being
+        repaired while the others are still in flight (see agents.stage_executor.ResultStream).
+        With VOTE_CASCADE they are collected from the small model first, and collected again from the large
+        model if fewer than VOTE_CASCADE_AGREEMENT of them agree.
+        With adaptive (one prompt per voter only), the voters are launched in waves (see get_vote_waves) and no
+        more are launched once quorum.is_separated(VOTE_ADAPTIVE_CONFIDENCE); the voters used and saved go to telemetry.
+        """
+        cancel = self.get_stage_cancel_token()
+
+        def parse(vote: str) -> Any:
+            return xmlstr2dict(self._fix_vote_xml(vote, start_seq), self.client)
+
+        async def call(wave_prompts: PromptsDict | list[PromptsDict], quorum: Callable[[dict[int, str]], bool], model: Optional[str]) -> list[str]:
+            return await llm_turns_async(client=self.client,
+                                         prompts=wave_prompts,
+                                         stop_sequences=["</evaluation>"],
+                                         temperature=TEMP,
+                                         n=n,
+                                         quorum=quorum,
+                                         cancel=cancel,
+                                         model=model,
+                                         priority=Priority.VOTING,
+                                         trim=trim_longest_messages)
+
+        async def collect_waves(quorum: VoteQuorum, model: Optional[str]) -> list[str]:
+            launched = 0
+
+            for wave_size in get_vote_waves(len(prompts)):
+                # The quorum sees every vote so far, keyed by the voter's index in prompts
+                earlier_votes, offset = dict(quorum.votes), launched
+                await call(prompts[offset:offset + wave_size],
+                           lambda votes: quorum({**earlier_votes, **{offset + i: vote for i, vote in votes.items()}}),
+                           model)
+                launched += wave_size
+
+                if quorum.enabled and quorum.is_decided():
+                    break
+                if quorum.is_separated(VOTE_ADAPTIVE_CONFIDENCE):
+                    dprint(f"{self.PRINT_PREFIX} leading candidate separated after {launched} of {len(prompts)} voters")
+                    break
+                # Past the stage budget, the votes received so far are all there is going to be
+                if cancel.expired():
+                    break
+
+            record_vote(launched, len(prompts))
+            return quorum.ordered_votes()
+
+        async def collect(model: Optional[str]) -> tuple[list[str], VoteQuorum, ResultStream]:
+            quorum = make_quorum()
+            stream = ResultStream(parse)
+            quorum.listener = stream.feed
+
+            try:
+                if adaptive and isinstance(prompts, list):
+                    votes = await collect_waves(quorum, model)
+                else:
+                    votes = await call(prompts, quorum, model)
+            except BaseException:
+                stream.discard()
+                raise
+
+            return votes, quorum, stream
+
+        model = None
+
+        if VOTE_CASCADE and has_small_model(get_provider(self.client)):
+            votes, quorum, stream = await collect(SMALL)
+
+            agreement = quorum.agreement()
+            if agreement >= VOTE_CASCADE_AGREEMENT:
+                dprint(f"{self.PRINT_PREFIX} small model votes agree {agreement:.0%} - keeping them")
+                return votes, quorum, await stream.collect(quorum.votes)
+
+            dprint(f"{self.PRINT_PREFIX} small model votes agree {agreement:.0%} - escalating to the large model")
+            stream.discard()
+            model = LARGE
+
+        votes, quorum, stream = await collect(model)
+
+        return votes, quorum, await stream.collect(quorum.votes)
+
     def _fix_vote_xml(self, vote_str: str, start_seq: str) -> str:
         """Ensures that vote XML responses contain valid opening and closing tags."""
         v = vote_str.strip()
@@ -201,8 +439,16 @@ class ToT(Agent):
         return v
 
     def run(self) -> None:
+        asyncio.run(self.run_async())
+
+    async def run_async(self) -> None:
         self.trace = ""
         self.interrupted = False
+        self.cancel_token = CancelToken()
+
+        self._run_loop = asyncio.get_running_loop()
+        self._run_task = asyncio.current_task()
+        self.speculative_plans = None
 
         try:
             self.current_task: Optional[str] = xml2xmlstr(dict2xml(self.tasks[-1]))
@@ -216,6 +462,8 @@ class ToT(Agent):
                 REMOTE_EXPERIENCES = get_remote_experiences(target_vector_name="task",
                                                             target_vector_query=self.current_task,
                                                             limit=REMOTE_EXAMPLE_COUNT)
+
+            self.remote_examples = REMOTE_EXPERIENCES if REMOTE_EXPERIENCES else ""
             
             if REMOTE_EXPERIENCES:
                 rprint(f"[green]done[/green]")
@@ -236,312 +484,346 @@ class ToT(Agent):
             self.close_step_tag = f"</step_{self.step_num}>"
 
             self.unified_step: dict = {}
+            self.stage_data: dict = {}
 
-            while self.csm.current_state.name != "Done":
+            # The pipeline runs as a stage graph over states.json and transitions.json (see agents.stage_executor)
+            self.stage_executor = StageExecutor(self.csm, self.get_stages(), final_state="Done", scope=self.stage_data, prefix=self.PRINT_PREFIX)
+            await self.stage_executor.run()
+
+        except (KeyboardInterrupt, asyncio.CancelledError, LLMCancelledError) as e:
+            if isinstance(e, asyncio.CancelledError) and not self.interrupted:
+                raise
+
+            rprint(f"{self.PRINT_PREFIX}[yellow][bold] Interrupt received. Stopping the agent gracefully...[/bold][/yellow]")
+            self.finalize_task()
+
+        finally:
+            self.discard_speculative_plans()
+            self._run_loop = None
+            self._run_task = None
+
+    def get_stages(self) -> dict[str, Stage]:
+        """
+        The stage of every ToT state. The stages that prompt with the persistent notes have them prefetched while
+        the stage before them is still waiting on the model - all but ExecVote, which reads them once Exec is done.
+        """
+        runs: dict[str, Callable[[], Awaitable[str]]] = {
+            "Plan": self.stage_plan,
+            "PlanErrorFix": self.stage_plan,
+            "DedupPlans": self.stage_dedup_plans,
+            "PlanVote": self.stage_plan_vote,
+            "SumPlanVotes": self.stage_sum_plan_votes,
+            "ChoosePlan": self.stage_choose_plan,
+            "Propose": self.stage_propose,
+            "DedupProposals": self.stage_dedup_proposals,
+            "ProposeVote": self.stage_propose_vote,
+            "SumProposeVotes": self.stage_sum_propose_votes,
+            "ChooseProposition": self.stage_choose_proposition,
+            "Exec": self.stage_exec,
+            "ExecVote": self.stage_exec_vote,
+            "SumExecVote": self.stage_sum_exec_vote,
+        }
+
+        def interruptible(run: Callable[[], Awaitable[str]]) -> Callable[[], Awaitable[str]]:
+            async def run_stage() -> str:
                 self.check_interrupt()
+                return await run()
 
-                persistent_notes = read_persistent_notes()
-                
-                state_path = self.csm.current_state.get_hpath()
-                                            
-                match state_path:
-                    
-                    case "Plan":                        
-                        system_prompt = load_system_prompt(state_path, "TOT_DIR", {"step_num": str(self.step_num),
-                                                                                   "task": self.current_task,
-                                                                                   "persistent_notes": persistent_notes,
-                                                                                   "remote_examples": REMOTE_EXPERIENCES if REMOTE_EXPERIENCES else ""})
-                        
-                        user_prompt = get_msg(Role.USER, load_user_prompt(state_path, "TOT_DIR", None, {"step_num": str(self.step_num),
-                                                                                                        "task": self.current_task,
-                                                                                                        "suffix": ", taking into consideration the results of what you have already done in prior steps:" if self.step_num > 1 else ":"}))
-                        
-                        start_seq = self.open_step_tag + "<plan>"
-                        assistant_prompt = get_msg(Role.ASSISTANT, start_seq)
-
-                        messages = self.unified_memory.conversation_history + [user_prompt, assistant_prompt]
-
-                        rprint(f"planning", end="")
-                        with ProgressIndicator() as PI:               
-                            plan_candidates: list[str] = llm_turns(client=self.client,
-                                                                    prompts={"system": system_prompt,
-                                                                             "messages": messages},
-                                                                    stop_sequences=["</plan>"],
-                                                                    temperature=TEMP,
-                                                                    n=PLAN_COUNT)
-                        rprint(f"[green]done[/green]")
-                        
-                        self.unified_step['plan_candidates'] = plan_candidates
-
-                        if len(self.unified_step['plan_candidates']) != 1:
-                            self.csm.transition("PlanVote", locals())
-                        else:
-                            self.unified_step['best_plan'] = next(iter(self.unified_step['plan_candidates']))
-                            self.csm.transition("Propose", locals())
-
-                    case "PlanVote":
-                        system_prompt = load_system_prompt(state_path, "TOT_DIR", {"step_num": str(self.step_num),
-                                                                                   "task": self.current_task,
-                                                                                   "persistent_notes": persistent_notes})
-                        
-                        start_seq = self.open_step_tag + "<evaluation>"
-                        assistant_prompt = get_msg(Role.ASSISTANT, start_seq)
-                        
-                        plan_index_maps: list[list[int]] = []
-                        prompts: list[PromptsDict] = []
-
-                        for _ in range(VOTER_COUNT):
-                            self.check_interrupt()
-
-                            shuffled_indices, plan_candidates_str = self.format_candidates(plan_candidates)
-
-                            user_prompt = get_msg(Role.USER, load_user_prompt(state_path, "TOT_DIR", None, {"step_num": str(self.step_num),
-                                                                                                            "task": self.current_task,
-                                                                                                            "plan_candidates_str": plan_candidates_str,
-                                                                                                            "suffix": ", taking into consideration the results of what you have already done in prior steps:" if self.step_num > 1 else ":"}))
-                            
-                            messages = self.unified_memory.conversation_history + [user_prompt, assistant_prompt]
-
-                            prompts.append({"system": system_prompt,
-                                            "messages": messages})
-                            plan_index_maps.append(shuffled_indices)
-
-                        rprint(f"voting", end="")
-                        with ProgressIndicator() as PI:
-                            plan_votes = llm_turns(client=self.client,
-                                                    prompts=prompts,
-                                                    stop_sequences=["</evaluation>"],
-                                                    temperature=TEMP,
-                                                    n=None)                
-                        rprint(f"[green]done[/green]")
-
-                        plan_votes = [self._fix_vote_xml(v, start_seq) for v in plan_votes]
-
-                        self.csm.transition("SumPlanVotes", locals())
-
-                    case "SumPlanVotes":
-                        plan_scores = self.reduce_scores(plan_candidates,
-                                                         plan_votes,
-                                                         plan_index_maps)
-                        
-                        self.csm.transition("ChoosePlan", locals())
-
-                    case "ChoosePlan":
-                        best_plan = self.choose(plan_candidates, plan_scores)
-                        self.unified_step['best_plan'] = best_plan
-
-                        self.csm.transition("Propose", locals())
-
-                    case "Propose":
-                        system_prompt = load_system_prompt(state_path, "TOT_DIR", {"task": self.current_task,
-                                                                                   "persistent_notes": persistent_notes,
-                                                                                   "remote_examples": REMOTE_EXPERIENCES if REMOTE_EXPERIENCES else ""})
-
-                        user_prompt = get_msg(Role.USER, load_user_prompt(state_path, "TOT_DIR", None, {"step_num": str(self.step_num),
-                                                                                                        "task": self.current_task,
-                                                                                                        "plan": self.unified_step['best_plan'],
-                                                                                                        "suffix": ", taking into consideration the results of what you have already done in prior steps:" if self.step_num > 1 else ":"}))
-                        
-                        start_seq = self.open_step_tag + "<implementation>" + "\n" + "```python"
-                        assistant_prompt = get_msg(Role.ASSISTANT, start_seq)
-                        
-                        messages = self.unified_memory.conversation_history + [user_prompt, assistant_prompt]
-
-                        rprint(f"proposing implementations", end="")
-                        with ProgressIndicator() as PI:
-                            raw_proposals: list[str] = llm_turns(client=self.client,
+            return run_stage
+
+        # The code Exec runs may write to the notes, so a read started before it finishes could be stale
+        prefetching = {"Plan", "PlanErrorFix", "PlanVote", "Propose", "ProposeVote"}
+
+        return {hpath: Stage(interruptible(run), prefetch=read_persistent_notes if hpath in prefetching else None) for hpath, run in runs.items()}
+
+    async def stage_plan(self) -> str:
+        state_path = self.csm.current_state.get_hpath()
+        persistent_notes = await self.stage_executor.prefetched()
+
+        prompts = self.plan_prompts(state_path,
+                                    self.step_num,
+                                    self.unified_memory.conversation_history,
+                                    self.unified_steps[-1] if self.unified_steps else None,
+                                    persistent_notes,
+                                    self.remote_examples)
+
+        rprint(f"planning" if state_path == "Plan" else "planning a fix", end="")
+        with ProgressIndicator() as PI:
+            plan_candidates = await self.take_speculative_plans(state_path, prompts)
+            if plan_candidates is None:
+                plan_candidates = await self.generate_plans(prompts, self.get_stage_cancel_token())
+        rprint(f"[green]done[/green]")
+
+        self.unified_step['plan_candidates'] = plan_candidates
+        self.stage_data['plan_candidates'] = plan_candidates
+        self.stage_data['plan_prior'] = None
+
+        if len(plan_candidates) != 1:
+            return "DedupPlans" if DEDUP_CANDIDATES else "PlanVote"
+
+        self.unified_step['best_plan'] = next(iter(plan_candidates))
+        return "Propose"
+
+    async def stage_dedup_plans(self) -> str:
+        plan_candidates = self.stage_data['plan_candidates']
+        clusters = cluster_candidates(plan_candidates)
+
+        self.stage_data['plan_candidates'] = [plan_candidates[cluster[0]] for cluster in clusters]
+        self.stage_data['plan_prior'] = get_cluster_prior([len(cluster) for cluster in clusters])
+        dprint(f"{self.PRINT_PREFIX} {len(plan_candidates)} plan candidates collapsed to {len(clusters)}: {clusters}")
+
+        if len(clusters) != 1:
+            return "PlanVote"
+
+        self.unified_step['best_plan'] = self.stage_data['plan_candidates'][0]
+        return "Propose"
+
+    async def stage_plan_vote(self) -> str:
+        state_path = self.csm.current_state.get_hpath()
+        persistent_notes = await self.stage_executor.prefetched()
+        plan_candidates = self.stage_data['plan_candidates']
+
+        system_prompt = load_system_prompt(self.vote_prompt_name(state_path), "TOT_DIR", {"step_num": str(self.step_num),
+                                                                   "task": self.current_task,
+                                                                   "persistent_notes": persistent_notes})
+
+        start_seq = self.open_step_tag + "<evaluation>"
+        assistant_prompt = get_msg(Role.ASSISTANT, start_seq)
+
+        plan_index_maps: list[list[int]] = []
+        prompts: list[PromptsDict] = []
+
+        for _ in range(VOTE_ADAPTIVE_MAX_VOTERS if VOTE_ADAPTIVE else VOTER_COUNT):
+            self.check_interrupt()
+
+            shuffled_indices, plan_candidates_str = self.format_candidates(plan_candidates)
+
+            user_prompt = get_msg(Role.USER, load_user_prompt(state_path, "TOT_DIR", None, {"step_num": str(self.step_num),
+                                                                                            "task": self.current_task,
+                                                                                            "plan_candidates_str": plan_candidates_str,
+                                                                                            "suffix": ", taking into consideration the results of what you have already done in prior steps:" if self.step_num > 1 else ":"}))
+
+            messages = self.unified_memory.conversation_history + [user_prompt, assistant_prompt]
+
+            prompts.append({"system": system_prompt,
+                            "messages": messages})
+            plan_index_maps.append(shuffled_indices)
+
+        rprint(f"voting", end="")
+        with ProgressIndicator() as PI:
+            _, plan_quorum, plan_votes = await self.vote(prompts, None, lambda: self.make_ranking_quorum(len(prompts), len(plan_candidates), plan_index_maps, self.stage_data['plan_prior']), start_seq, adaptive=VOTE_ADAPTIVE)
+        rprint(f"[green]done[/green]")
+
+        # Votes that were cut short by the quorum or failed are missing, so keep only their voters' index maps
+        self.stage_data['plan_index_maps'] = [plan_index_maps[i] for i in plan_quorum.voter_indices()]
+        self.stage_data['plan_votes'] = plan_votes
+
+        return "SumPlanVotes"
+
+    async def stage_sum_plan_votes(self) -> str:
+        reduce = self.reduce_rankings if VOTE_RANKING else self.reduce_scores
+        self.stage_data['plan_scores'] = reduce(self.stage_data['plan_candidates'],
+                                                self.stage_data['plan_votes'],
+                                                self.stage_data['plan_index_maps'],
+                                                self.stage_data['plan_prior'])
+
+        return "ChoosePlan"
+
+    async def stage_choose_plan(self) -> str:
+        self.unified_step['best_plan'] = self.choose(self.stage_data['plan_candidates'], self.stage_data['plan_scores'])
+
+        return "Propose"
+
+    async def stage_propose(self) -> str:
+        state_path = self.csm.current_state.get_hpath()
+        persistent_notes = await self.stage_executor.prefetched()
+
+        system_prompt = load_system_prompt(state_path, "TOT_DIR", {"task": self.current_task,
+                                                                   "persistent_notes": persistent_notes,
+                                                                   "remote_examples": self.remote_examples})
+
+        user_prompt = get_msg(Role.USER, load_user_prompt(state_path, "TOT_DIR", None, {"step_num": str(self.step_num),
+                                                                                        "task": self.current_task,
+                                                                                        "plan": self.unified_step['best_plan'],
+                                                                                        "suffix": ", taking into consideration the results of what you have already done in prior steps:" if self.step_num > 1 else ":"}))
+
+        start_seq = self.open_step_tag + "<implementation>" + "\n" + "```python"
+        assistant_prompt = get_msg(Role.ASSISTANT, start_seq)
+
+        messages = self.unified_memory.conversation_history + [user_prompt, assistant_prompt]
+
+        rprint(f"proposing implementations", end="")
+        with ProgressIndicator() as PI:
+            raw_proposals: list[str] = await llm_turns_async(client=self.client,
                                                              prompts={"system": system_prompt,
                                                                       "messages": messages},
                                                              stop_sequences=["```"],
                                                              temperature=TEMP,
-                                                             n=PROPOSAL_COUNT)
-                        rprint(f"[green]done[/green]")
-                            
-                        proposal_candidates = ["```python" + raw_proposal + "```" for raw_proposal in raw_proposals]
-                        
-                        if len(proposal_candidates) != 1:
-                            self.csm.transition("ProposeVote", locals())
-                        else:
-                            self.unified_step['best_proposition'] = next(iter(proposal_candidates))
-                            self.csm.transition("Exec", locals())
-
-                    case "ProposeVote":
-                        system_prompt = load_system_prompt(state_path, "TOT_DIR", {"step_num": str(self.step_num),
-                                                                                   "persistent_notes": persistent_notes,
-                                                                                   "task": self.current_task})
-                        
-                        start_seq = self.open_step_tag + "<evaluation>"
-                        assistant_prompt = get_msg(Role.ASSISTANT, start_seq)
-
-                        proposal_index_maps: list[list[int]] = []
-                        prompts: list[PromptsDict] = []
-                        
-                        for _ in range(VOTER_COUNT):
-                            self.check_interrupt()
-
-                            shuffled_indices, proposal_candidates_str = self.format_candidates(proposal_candidates)
-
-                            user_prompt = get_msg(Role.USER, load_user_prompt(state_path, "TOT_DIR", None, {"step_num": str(self.step_num),
-                                                                                                            "task": self.current_task,
-                                                                                                            "plan": self.unified_step['best_plan'],
-                                                                                                            "proposal_candidates_str": proposal_candidates_str,
-                                                                                                            "suffix": ", taking into consideration the results of what you have already done in prior steps:" if self.step_num > 1 else ":"}))
-                            
-                            messages = self.unified_memory.conversation_history + [user_prompt, assistant_prompt]
-                            
-                            prompts.append({"system": system_prompt,
-                                            "messages": messages})
-                            proposal_index_maps.append(shuffled_indices)
-
-                        rprint(f"voting on implementations", end="")
-                        with ProgressIndicator() as PI:
-                            proposal_votes = llm_turns(client=self.client,
-                                                    prompts=prompts,
-                                                    stop_sequences=["</evaluation>"],
-                                                    temperature=TEMP,
-                                                    n=None)
-                        rprint(f"[green]done[/green]")
-
-                        proposal_votes = [self._fix_vote_xml(v, start_seq) for v in proposal_votes]
-
-                        self.csm.transition("SumProposeVotes", locals())
-
-                    case "SumProposeVotes":
-                        proposal_scores = self.reduce_scores(proposal_candidates,
-                                                             proposal_votes,
-                                                             proposal_index_maps)
-
-                        self.csm.transition("ChooseProposition", locals())
-
-                    case "ChooseProposition":
-                        best_proposition = self.choose(proposal_candidates, proposal_scores)
-                        self.unified_step['best_proposition'] = best_proposition
-
-                        self.csm.transition("Exec", locals())
-
-                    case "Exec":
-                        fenced_code = self.unified_step['best_proposition']
-                        
-                        parsed_code = extract_language_and_code(fenced_code)
-                        if not parsed_code:
-                            error_message = f"{self.PRINT_PREFIX} code not parsable:\n{fenced_code}"
-                            rprint(f"[red][bold]{error_message}[/bold][/red]")
-                            raise SyntaxError(error_message)
-                        
-                        language, code = parsed_code
-
-                        rprint(f"Proposed code to execute:\n")
-                        rprint(code.strip())
-
-                        execute_code = get_yes_no_input(f"\nDo you want to execute this code?")
-
-                        if execute_code:
-                            self.code_executor.write_code_step_file(code, self.step_num)
-
-                            stdout, stderr = self.code_executor.execute_code_step(self.step_num)
-
-                            dprint(f"{self.PRINT_PREFIX} stdout:")
-                            dprint(stdout)
-                            dprint(f"{self.PRINT_PREFIX} stderr:")
-                            dprint(stderr)
-
-                            self.unified_step['output'] = stdout
-                            self.unified_step['error'] = stderr
-                        else:
-                            rprint(f"{self.PRINT_PREFIX} Code execution skipped.")
-                            self.unified_step['output'] = "Code execution skipped by user."
-                            self.unified_step['error'] = ""
-
-                        self.csm.transition("ExecVote", locals())
-
-                    case "PlanErrorFix":
-                        previous_step = self.unified_steps[-1]
-
-                        frmt = {"step_num": str(self.step_num),
-                                "task": self.current_task,
-                                "persistent_notes": persistent_notes,
-                                "error": previous_step['error'],
-                                "output": previous_step['output']}
-
-                        system_prompt = load_system_prompt(state_path, "TOT_DIR", frmt)      
-                        user_prompt = get_msg(Role.USER, load_user_prompt(state_path, "TOT_DIR", None, frmt))
-                        
-                        start_seq = self.open_step_tag + "<plan>"
-                        assistant_prompt = get_msg(Role.ASSISTANT, start_seq)
-
-                        messages = self.unified_memory.conversation_history + [user_prompt, assistant_prompt]
-
-                        rprint(f"planning a fix", end="")
-                        with ProgressIndicator() as PI:                   
-                            plan_candidates: list[str] = llm_turns(client=self.client,
-                                                            prompts={"system": system_prompt,
-                                                                    "messages": messages},
-                                                            stop_sequences=["</plan>"],
-                                                            temperature=TEMP,
-                                                            n=PLAN_COUNT)
-                        rprint(f"[green]done[/green]")
-                        
-                        self.unified_step['plan_candidates'] = plan_candidates
-
-                        if len(self.unified_step['plan_candidates']) != 1:
-                            self.csm.transition("PlanVote", locals())
-                        else:
-                            self.unified_step['best_plan'] = next(iter(self.unified_step['plan_candidates']))
-                            self.csm.transition("Propose", locals())
-
-                    case "ExecVote":
-                        system_prompt = load_system_prompt(state_path, "TOT_DIR", {"task": self.current_task,
-                                                                                   "persistent_notes": persistent_notes,})
-
-                        user_prompt = get_msg(Role.USER, load_user_prompt(state_path, "TOT_DIR", None, {"step_num": str(self.step_num),
-                                                                                                        "task": self.current_task,
-                                                                                                        "plan": self.unified_step['best_plan'],
-                                                                                                        "implementation": self.unified_step['best_proposition'],
-                                                                                                        "output": self.unified_step['output'],
-                                                                                                        "error": self.unified_step['error']}))
-                        
-                        start_seq = self.open_step_tag + "<evaluation>"
-                        assistant_prompt = get_msg(Role.ASSISTANT, start_seq)
-
-                        messages = self.unified_memory.conversation_history + [user_prompt, assistant_prompt]
-                        
-                        rprint(f"voting on completion status", end="")
-                        with ProgressIndicator() as PI:
-                            exec_votes: list[str] = llm_turns(client=self.client,
-                                                          prompts={"system": system_prompt,
-                                                                   "messages": messages},
-                                                          stop_sequences=["</evaluation>"],
-                                                          temperature=TEMP,
-                                                          n=VOTER_COUNT)
-                        rprint(f"[green]done[/green]")
-                        
-                        exec_votes = [self._fix_vote_xml(v, start_seq) for v in exec_votes]
-
-                        self.unified_step['exec_vote_strs'] = exec_votes
-
-                        self.csm.transition("SumExecVote", locals())
-
-                    case "SumExecVote":
-                        avg_yes_votes, avg_error_votes = self.reduce_scores_exec(self.unified_step)
-
-                        self.next_step()
-
-                        if avg_yes_votes > 0.5:
-                            self.finalize_task()
-                            self.csm.transition("Done", locals())
-                        elif avg_error_votes > 0.5:
-                            self.csm.transition("PlanErrorFix", locals())
-                        else:
-                            self.csm.transition("Plan", locals())
-
-                    case _:
-                        error_message = f"{self.PRINT_PREFIX} unhandled state: {self.csm.current_state.get_hpath()}"
-                        rprint(f"[red][bold]{error_message}[/bold][/red]")
-                        raise ValueError(error_message)
-
-        except KeyboardInterrupt as e:
-            rprint(f"{self.PRINT_PREFIX}[yellow][bold] Interrupt received. Stopping the agent gracefully...[/bold][/yellow]")
+                                                             n=PROPOSAL_COUNT,
+                                                             cancel=self.get_stage_cancel_token(),
+                                                             trim=trim_longest_messages)
+        rprint(f"[green]done[/green]")
+
+        proposal_candidates = ["```python" + raw_proposal + "```" for raw_proposal in raw_proposals]
+        self.stage_data['proposal_candidates'] = proposal_candidates
+        self.stage_data['proposal_prior'] = None
+
+        if len(proposal_candidates) != 1:
+            return "DedupProposals" if DEDUP_CANDIDATES else "ProposeVote"
+
+        self.unified_step['best_proposition'] = next(iter(proposal_candidates))
+        return "Exec"
+
+    async def stage_dedup_proposals(self) -> str:
+        proposal_candidates = self.stage_data['proposal_candidates']
+        clusters = cluster_candidates(proposal_candidates, code=True)
+
+        self.stage_data['proposal_candidates'] = [proposal_candidates[cluster[0]] for cluster in clusters]
+        self.stage_data['proposal_prior'] = get_cluster_prior([len(cluster) for cluster in clusters])
+        dprint(f"{self.PRINT_PREFIX} {len(proposal_candidates)} proposals collapsed to {len(clusters)}: {clusters}")
+
+        if len(clusters) != 1:
+            return "ProposeVote"
+
+        self.unified_step['best_proposition'] = self.stage_data['proposal_candidates'][0]
+        return "Exec"
+
+    async def stage_propose_vote(self) -> str:
+        state_path = self.csm.current_state.get_hpath()
+        persistent_notes = await self.stage_executor.prefetched()
+        proposal_candidates = self.stage_data['proposal_candidates']
+
+        system_prompt = load_system_prompt(self.vote_prompt_name(state_path), "TOT_DIR", {"step_num": str(self.step_num),
+                                                                   "persistent_notes": persistent_notes,
+                                                                   "task": self.current_task})
+
+        start_seq = self.open_step_tag + "<evaluation>"
+        assistant_prompt = get_msg(Role.ASSISTANT, start_seq)
+
+        proposal_index_maps: list[list[int]] = []
+        prompts: list[PromptsDict] = []
+
+        for _ in range(VOTE_ADAPTIVE_MAX_VOTERS if VOTE_ADAPTIVE else VOTER_COUNT):
+            self.check_interrupt()
+
+            shuffled_indices, proposal_candidates_str = self.format_candidates(proposal_candidates)
+
+            user_prompt = get_msg(Role.USER, load_user_prompt(state_path, "TOT_DIR", None, {"step_num": str(self.step_num),
+                                                                                            "task": self.current_task,
+                                                                                            "plan": self.unified_step['best_plan'],
+                                                                                            "proposal_candidates_str": proposal_candidates_str,
+                                                                                            "suffix": ", taking into consideration the results of what you have already done in prior steps:" if self.step_num > 1 else ":"}))
+
+            messages = self.unified_memory.conversation_history + [user_prompt, assistant_prompt]
+
+            prompts.append({"system": system_prompt,
+                            "messages": messages})
+            proposal_index_maps.append(shuffled_indices)
+
+        rprint(f"voting on implementations", end="")
+        with ProgressIndicator() as PI:
+            _, proposal_quorum, proposal_votes = await self.vote(prompts, None, lambda: self.make_ranking_quorum(len(prompts), len(proposal_candidates), proposal_index_maps, self.stage_data['proposal_prior']), start_seq, adaptive=VOTE_ADAPTIVE)
+        rprint(f"[green]done[/green]")
+
+        self.stage_data['proposal_index_maps'] = [proposal_index_maps[i] for i in proposal_quorum.voter_indices()]
+        self.stage_data['proposal_votes'] = proposal_votes
+
+        return "SumProposeVotes"
+
+    async def stage_sum_propose_votes(self) -> str:
+        reduce = self.reduce_rankings if VOTE_RANKING else self.reduce_scores
+        self.stage_data['proposal_scores'] = reduce(self.stage_data['proposal_candidates'],
+                                                    self.stage_data['proposal_votes'],
+                                                    self.stage_data['proposal_index_maps'],
+                                                    self.stage_data['proposal_prior'])
+
+        return "ChooseProposition"
+
+    async def stage_choose_proposition(self) -> str:
+        self.unified_step['best_proposition'] = self.choose(self.stage_data['proposal_candidates'], self.stage_data['proposal_scores'])
+
+        return "Exec"
+
+    async def stage_exec(self) -> str:
+        fenced_code = self.unified_step['best_proposition']
+
+        parsed_code = extract_language_and_code(fenced_code)
+        if not parsed_code:
+            error_message = f"{self.PRINT_PREFIX} code not parsable:\n{fenced_code}"
+            rprint(f"[red][bold]{error_message}[/bold][/red]")
+            raise SyntaxError(error_message)
+
+        language, code = parsed_code
+
+        rprint(f"Proposed code to execute:\n")
+        rprint(code.strip())
+
+        execute_code = get_yes_no_input(f"\nDo you want to execute this code?")
+
+        if execute_code:
+            self.code_executor.write_code_step_file(code, self.step_num)
+
+            stdout, stderr = self.code_executor.execute_code_step(self.step_num)
+
+            dprint(f"{self.PRINT_PREFIX} stdout:")
+            dprint(stdout)
+            dprint(f"{self.PRINT_PREFIX} stderr:")
+            dprint(stderr)
+
+            self.unified_step['output'] = stdout
+            self.unified_step['error'] = stderr
+        else:
+            rprint(f"{self.PRINT_PREFIX} Code execution skipped.")
+            self.unified_step['output'] = "Code execution skipped by user."
+            self.unified_step['error'] = ""
+
+        return "ExecVote"
+
+    async def stage_exec_vote(self) -> str:
+        state_path = self.csm.current_state.get_hpath()
+        persistent_notes = await asyncio.to_thread(read_persistent_notes)
+
+        system_prompt = load_system_prompt(state_path, "TOT_DIR", {"task": self.current_task,
+                                                                   "persistent_notes": persistent_notes,})
+
+        user_prompt = get_msg(Role.USER, load_user_prompt(state_path, "TOT_DIR", None, {"step_num": str(self.step_num),
+                                                                                        "task": self.current_task,
+                                                                                        "plan": self.unified_step['best_plan'],
+                                                                                        "implementation": self.unified_step['best_proposition'],
+                                                                                        "output": self.unified_step['output'],
+                                                                                        "error": self.unified_step['error']}))
+
+        start_seq = self.open_step_tag + "<evaluation>"
+        assistant_prompt = get_msg(Role.ASSISTANT, start_seq)
+
+        messages = self.unified_memory.conversation_history + [user_prompt, assistant_prompt]
+
+        if SPECULATIVE_PLANNING:
+            self.speculate_plans(persistent_notes, self.remote_examples)
+
+        rprint(f"voting on completion status", end="")
+        with ProgressIndicator() as PI:
+            exec_votes, _, parsed_exec_votes = await self.vote({"system": system_prompt, "messages": messages}, VOTER_COUNT, lambda: ExecVoteQuorum(VOTER_COUNT), start_seq)
+        rprint(f"[green]done[/green]")
+
+        self.unified_step['exec_vote_strs'] = [self._fix_vote_xml(v, start_seq) for v in exec_votes]
+        self.stage_data['exec_votes'] = parsed_exec_votes
+
+        return "SumExecVote"
+
+    async def stage_sum_exec_vote(self) -> str:
+        avg_yes_votes, avg_error_votes = self.reduce_scores_exec(self.stage_data['exec_votes'])
+
+        self.next_step()
+
+        if avg_yes_votes > 0.5:
+            self.discard_speculative_plans()
             self.finalize_task()
+            return "Done"
+        elif avg_error_votes > 0.5:
+            return "PlanErrorFix"
+        else:
+            return "Plan"
 
     def finalize_task(self) -> None:
         if self.current_task:
@@ -751,8 +1033,11 @@ If you believe it was optimal, please indicate this."""
         assistant_prompt = get_msg(Role.ASSISTANT, "<reflection>")
         
         messages = [user_prompt, assistant_prompt]
+
+        # Feedback is collected after the run, and after an interrupt has cancelled its token, so it gets its own
+        cancel = CancelToken()
         
-        llm_response = llm_turns(self.client, {'system': system_prompt, 'messages': messages}, ["</reflection>"], TEMP, 1)[0]
+        llm_response = llm_turns(self.client, {'system': system_prompt, 'messages': messages}, ["</reflection>"], TEMP, 1, cancel=cancel)[0]
 
         correct_interpretation = get_yes_no_input(f"""\n[{FRIENDLY_COLOR}][bold]Before your feedback is submitted, let's make sure the LLM understands your intentions.[/bold]
 Here's how it interprets your feedback on the last run:[/{FRIENDLY_COLOR}]
@@ -773,7 +1058,7 @@ Here's how it interprets your feedback on the last run:[/{FRIENDLY_COLOR}]
                 messages.append(get_msg(Role.ASSISTANT, """Here's a revised interpretation of your feedback based on your correction:
 <revised_reflection>"""))
                 
-                llm_response = llm_turns(self.client, {'system': system_prompt, 'messages': messages}, ["</revised_reflection>"], TEMP, 1)[0]
+                llm_response = llm_turns(self.client, {'system': system_prompt, 'messages': messages}, ["</revised_reflection>"], TEMP, 1, cancel=cancel)[0]
 
                 correct_interpretation = get_yes_no_input(f"""Here's a revised interpetation:
 {llm_response}
@@ -818,20 +1103,32 @@ Here's how it interprets your feedback on the last run:[/{FRIENDLY_COLOR}]
 
         return shuffled_indices, formatted_candidates
     
-    def choose(self, candidates: list[str], scores: list[int]) -> str:
+    def vote_prompt_name(self, state_path: str) -> str:
+        """System prompt of a ranking vote state - PlanVoteRanking.xml rather than PlanVote.xml with VOTE_RANKING."""
+        return f"{state_path}Ranking" if VOTE_RANKING else state_path
+
+    def make_ranking_quorum(self, voter_count: int, candidate_count: int, index_maps: list[list[int]], prior: Optional[list[float]] = None) -> VoteQuorum:
+        if VOTE_RANKING:
+            return FullRankingVoteQuorum(voter_count, candidate_count, index_maps, VOTE_RANKING_METHOD, prior)
+
+        return RankingVoteQuorum(voter_count, candidate_count, index_maps, prior)
+
+    def choose(self, candidates: list[str], scores: list[int] | list[float]) -> str:
         best_plan = candidates[np.argmax(scores)]
         dprint(f"{self.PRINT_PREFIX} best_plan:\n{best_plan}")
 
         return best_plan
     
-    def reduce_scores(self, plan_candidates: list[str], candidate_votes: list[str], index_maps: list[list[int]]) -> list[int]:
-        scores = [0] * len(plan_candidates)
+    def reduce_scores(self, plan_candidates: list[str], candidate_votes: list[Any], index_maps: list[list[int]], prior: Optional[list[float]] = None) -> list[float]:
+        """
+        Tallies the votes, as parsed by vote(): +1 for each voter's best candidate and -1 for its worst,
+        on top of prior (the pseudo best votes of agents.tot.dedup.get_cluster_prior), if given.
+        """
+        scores: list[float] = list(prior) if prior is not None else [0] * len(plan_candidates)
 
         assert len(candidate_votes) == len(index_maps)
 
-        for vote_i, vote in enumerate(candidate_votes):
-            parsed_scores = xmlstr2dict(vote, self.client)
-
+        for vote_i, parsed_scores in enumerate(candidate_votes):
             best_candidate_val = self._find_key_recursive(parsed_scores, 'best_candidate')
             worst_candidate_val = self._find_key_recursive(parsed_scores, 'worst_candidate')
 
@@ -854,6 +1151,28 @@ Here's how it interprets your feedback on the last run:[/{FRIENDLY_COLOR}]
 
         return scores
 
+    def reduce_rankings(self, candidates: list[str], candidate_votes: list[Any], index_maps: list[list[int]], prior: Optional[list[float]] = None) -> list[float]:
+        """Scores full-ranking votes (VOTE_RANKING), as parsed by vote(), with VOTE_RANKING_METHOD - prior counting as pseudo first-place votes."""
+        assert len(candidate_votes) == len(index_maps)
+
+        rankings, ranking_index_maps = [], []
+
+        for parsed_ranking, index_map in zip(candidate_votes, index_maps):
+            ranking = parse_ranking(self._find_key_recursive(parsed_ranking, 'ranking'), len(candidates))
+
+            if ranking is None:
+                dprint(f"{self.PRINT_PREFIX} Warning: Could not find a ranking in vote: {parsed_ranking}")
+                continue
+
+            rankings.append(ranking)
+            ranking_index_maps.append(index_map)
+
+        scores = aggregate(get_positions(rankings, ranking_index_maps, len(candidates)), VOTE_RANKING_METHOD,
+                           np.array(prior, dtype=float) if prior is not None else None).tolist()
+        dprint(f"{self.PRINT_PREFIX} {VOTE_RANKING_METHOD} scores: {scores}")
+
+        return scores
+
     def _find_key_recursive(self, d: dict, target_key: str):
         """Recursively search for a key in a nested dictionary."""
         if isinstance(d, dict):
@@ -865,16 +1184,14 @@ Here's how it interprets your feedback on the last run:[/{FRIENDLY_COLOR}]
                     return result
         return None
 
-    def reduce_scores_exec(self, unified_step: dict[str, str | list[str]]) -> tuple[float, float]:
+    def reduce_scores_exec(self, exec_votes: list[Any]) -> tuple[float, float]:
         sum_yes_votes = 0
         avg_yes_votes = 0
 
         sum_error_votes = 0
         avg_error_votes = 0
 
-        for exec_vote_str in unified_step['exec_vote_strs']:
-            parsed_scores = xmlstr2dict(exec_vote_str, self.client)
-
+        for parsed_scores in exec_votes:
             complete = self._find_key_recursive(parsed_scores, 'complete')
             error = self._find_key_recursive(parsed_scores, 'error')
 
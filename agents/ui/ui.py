@@ -23,6 +23,7 @@ from utils.files import read_persistent_notes, write_persistent_note
 from utils.parsing import dict2xml, xml2xmlstr, xmlstr2dict
 from utils.tts import tts
 from utils.llm import llm_turn
+from utils.llm_scheduler import Priority
 
 from anthropic import Anthropic
 
@@ -117,7 +118,8 @@ class UI(Agent):
                                     prompts={'system': self.memory.get_system_prompt(),
                                              'messages': self.memory.get_messages()},
                                     stop_sequences=["</output>"],
-                                    temperature=0.7)
+                                    temperature=0.7,
+                                    priority=Priority.INTERACTIVE)
                     
                     self.memory.store_llm_response("<output>" + text + "</output>")
 
@@ -4,11 +4,12 @@ import json
 import sys
 import os
 import time
+from typing import Optional
+
 import dotenv
 import httpx
 from openai import OpenAI
 
-import requests
 from rich import print as rprint
 
 import traceback
@@ -26,6 +27,10 @@ from utils.constants import *
 
 from agents.agent_manager.agent_manager import AgentManager
 from agents.ui.ui import UI
+from utils.llm import detect_openai_max_n
+from utils.http_transport import get_cert_mode, get_http_client
+from utils.llm_trace import get_llm_backend
+from utils.llm_pool import get_openai_base_urls
 
 
 def _connection_value_state(value: str | None) -> str:
@@ -71,15 +76,39 @@ def ensure_llm_api_endpoint_is_alive(http_client: httpx.Client, openai_base_url:
         raise ConnectionError(error_message) from exc
 
 
+def ensure_llm_api_pool_is_alive(http_client: httpx.Client, openai_base_urls: list[str]) -> None:
+    """Probes every endpoint in the pool; startup only fails if none of them is reachable."""
+    unreachable: list[str] = []
+    last_error: Optional[ConnectionError] = None
+
+    for openai_base_url in openai_base_urls:
+        try:
+            ensure_llm_api_endpoint_is_alive(http_client=http_client, openai_base_url=openai_base_url)
+        except ConnectionError as e:
+            unreachable.append(openai_base_url)
+            last_error = e
+
+    if last_error is not None and len(unreachable) == len(openai_base_urls):
+        raise last_error
+
+    if unreachable:
+        rprint(f"[yellow]{PRINT_PREFIX} Unreachable LLM API endpoints, starting with the rest of the pool: {', '.join(unreachable)}[/yellow]")
+
+
 def main():
     setup_environment_variables(REQUIRED_SETUP_KEYS)
     
     dotenv.load_dotenv()
 
-    openai_base_url = os.environ.get("OPENAI_BASE_URL")
-    if not openai_base_url:
+    openai_base_urls = get_openai_base_urls()
+    if not openai_base_urls:
         raise ValueError(f"{PRINT_PREFIX} OPENAI_BASE_URL not set in .env")
 
+    # With OPENAI_BASE_URLS, requests are balanced over every endpoint in the pool (see utils/llm_pool.py)
+    openai_base_url = os.environ.get("OPENAI_BASE_URL") or ""
+    if openai_base_url not in openai_base_urls:
+        openai_base_url = openai_base_urls[0]
+
     rprint()    
     dprint(f"{PRINT_PREFIX} [connection-check] Checklist: initial LLM connectivity validation")
 
@@ -91,19 +120,13 @@ def main():
         TERM_WIDTH = int(os.environ.get("TERM_WIDTH", "160"))
         dprint(f"{PRINT_PREFIX} TERM_WIDTH (headless): {TERM_WIDTH}")
 
-    # Custom HTTP client configured to trust your shared DGX Spark CA certificate
-    ca_cert_path = os.environ.get("CUSTOM_SSL_CERT")
+    # Shared pooled HTTP client configured to trust your shared DGX Spark CA certificate
     dprint(f"{PRINT_PREFIX} [connection-check] Step 1/5 - Configure TLS verification")
-    cert_mode = "system-default"
-    if ca_cert_path:
-        cert_mode = f"custom:{ca_cert_path}" if os.path.exists(ca_cert_path) else f"missing-path:{ca_cert_path}"
     dprint(
-        f"{PRINT_PREFIX} [connection-check] Step 1/5 result: {cert_mode}"
+        f"{PRINT_PREFIX} [connection-check] Step 1/5 result: {get_cert_mode()}"
     )
     
-    http_client = httpx.Client(
-        verify=ca_cert_path if ca_cert_path and os.path.exists(ca_cert_path) else True
-    )
+    http_client = get_http_client()
     dprint(f"{PRINT_PREFIX} [connection-check] Step 2/5 - Build OpenAI client (PASS)")
 
     client = OpenAI(
@@ -112,7 +135,13 @@ def main():
         http_client=http_client,
     )
 
-    ensure_llm_api_endpoint_is_alive(http_client=http_client, openai_base_url=openai_base_url)
+    # Replay serves every response from a recorded trace, so it must work without the endpoint
+    if get_llm_backend() == "replay":
+        dprint(f"{PRINT_PREFIX} [connection-check] Skipped - LLM_BACKEND is replay")
+    else:
+        ensure_llm_api_pool_is_alive(http_client=http_client, openai_base_urls=openai_base_urls)
+
+    dprint(f"{PRINT_PREFIX} OPENAI_MAX_N in effect: {detect_openai_max_n(client)}")
 
     agent_manager = AgentManager(client=client, prefix=PRINT_PREFIX)
 
@@ -173,9 +202,9 @@ if __name__ == "__main__":
 
                     if user_approve:
                         try:
-                            response = requests.post(
+                            response = get_http_client().post(
                                 AGENTAI_API_URL + "/client_error",
-                                data=json.dumps(error),
+                                content=json.dumps(error),
                                 headers={
                                     'Authorization': AGENTAI_API_KEY,
                                     'Content-Type': 'application/json'
@@ -191,9 +220,9 @@ if __name__ == "__main__":
                         rprint("The details of this crash will not be shared.")
 
                         try:
-                            response = requests.post(
+                            response = get_http_client().post(
                                 AGENTAI_API_URL + "/client_error",
-                                data=json.dumps({"type": "USER_PRIVATE"}),
+                                content=json.dumps({"type": "USER_PRIVATE"}),
                                 headers={
                                     'Authorization': AGENTAI_API_KEY,
                                     'Content-Type': 'application/json'
@@ -3,7 +3,7 @@ import os
 import xml.etree.ElementTree as ET
 from datetime import datetime
 from typing import Optional
-import requests
+import httpx
 
 from rich import print
 from langchain_chroma import Chroma
@@ -11,12 +11,13 @@ from langchain_community.embeddings import FastEmbedEmbeddings
 from langchain_core.documents import Document
 
 from utils.console_io import debug_print as dprint
+from utils.http_transport import get_http_client
 from utils.parsing import dict2xml, xml2xmlstr, escape_xml
 
 PRINT_PREFIX = "[bold][FEEDBACK][/bold]"
 
 
-def stage_experience(log: dict) -> Optional[requests.Response]:
+def stage_experience(log: dict) -> Optional[httpx.Response]:
     now_str = log.get("timestamp") or datetime.now().strftime("%Y-%m-%d %H:%M:%S")
     if "timestamp" not in log:
         log["timestamp"] = now_str
@@ -87,9 +88,9 @@ def stage_experience(log: dict) -> Optional[requests.Response]:
             dprint(f"{PRINT_PREFIX} [DEBUG] Storing experience via remote API at {AGENTAI_API_URL}/experience:")
             dprint(f"{PRINT_PREFIX} [DEBUG] Payload:\n{log}")
 
-            response = requests.post(f"{AGENTAI_API_URL}/experience",
-                                     headers=headers,
-                                     json=log)
+            response = get_http_client().post(f"{AGENTAI_API_URL}/experience",
+                                              headers=headers,
+                                              json=log)
             
             return response
         else:
@@ -145,9 +146,11 @@ def get_experiences(target_vector_name: str, target_vector_query: str, limit: in
 
             dprint(f"{PRINT_PREFIX} [DEBUG] Querying remote API at {AGENTAI_API_URL}/experience with:\n{query}")
 
-            response = requests.get(f"{AGENTAI_API_URL}/experience",
-                                    headers=headers,
-                                    json=query)
+            # httpx.Client.get() does not take a body, and this endpoint reads the query from the JSON body
+            response = get_http_client().request("GET",
+                                                 f"{AGENTAI_API_URL}/experience",
+                                                 headers=headers,
+                                                 json=query)
 
             res_data = response.json()
             dprint(f"{PRINT_PREFIX} [DEBUG] Remote API response:\n{res_data}")
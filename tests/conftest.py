@@ -0,0 +1,19 @@
+import sys
+import os
+
+import pytest
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from utils.llm_telemetry import get_aggregator, reset_telemetry_logger
+
+
+@pytest.fixture(autouse=True)
+def isolated_output(monkeypatch, tmp_path):
+    """Keeps the telemetry (and anything else written to OUTPUT_DIR) of every test out of data/output/."""
+    monkeypatch.setenv("OUTPUT_DIR", str(tmp_path / "output"))
+
+    reset_telemetry_logger()
+    yield
+    reset_telemetry_logger()
+    get_aggregator().clear()
@@ -0,0 +1,31 @@
+import os
+import sys
+
+import pytest
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "..")))
+
+from agents.memory import Memory
+from utils.llm_tokens import reset_token_counter
+
+
+@pytest.fixture(autouse=True)
+def tokens_env(monkeypatch):
+    monkeypatch.setenv("LLM_TOKENIZER", "heuristic")
+    monkeypatch.setenv("LLM_CHARS_PER_TOKEN", "4")
+
+    reset_token_counter()
+    yield
+    reset_token_counter()
+
+
+def test_token_counts_are_cached_as_messages_are_added():
+    memory = Memory()
+    memory.system_prompt = "s" * 8
+    memory.add_msg({"role": "user", "content": "a" * 40})
+    memory.add_msg({"role": "assistant", "content": ""})
+    memory.store_llm_response("b" * 20)
+
+    # 4 tokens of overhead per message on top of its text
+    assert [message["tokens"][2] for message in memory.conversation_history] == [14, 9]
+    assert memory.count_tokens() == 2 + 14 + 9
@@ -0,0 +1,92 @@
+import os
+import sys
+import asyncio
+import threading
+import time
+
+import pytest
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "..")))
+
+from agents.stage_executor import ResultStream, Stage, StageExecutor
+from agents.state_management import ConversationStateMachine
+from utils.custom_exceptions import ConversationNodeError
+
+
+STATE_DATA = {"name": "root", "children": [{"name": "Draft"}, {"name": "Review"}, {"name": "Done"}]}
+TRANSITION_DATA = [
+    {"trigger": "Review", "source": "Draft", "dest": "Review"},
+    {"trigger": "Draft", "source": "Review", "dest": "Draft"},
+    {"trigger": "Done", "source": "Review", "dest": "Done"},
+]
+
+
+def make_csm() -> ConversationStateMachine:
+    return ConversationStateMachine(STATE_DATA, TRANSITION_DATA, init_state_path="Draft", prefix="", owner_class_name="Test")
+
+
+def test_runs_stages_until_the_final_state():
+    csm = make_csm()
+    visited = []
+    reviews = iter(["Draft", "Done"])
+
+    async def draft() -> str:
+        visited.append("Draft")
+        return "Review"
+
+    async def review() -> str:
+        visited.append("Review")
+        return next(reviews)
+
+    asyncio.run(StageExecutor(csm, {"Draft": Stage(draft), "Review": Stage(review)}, final_state="Done").run())
+
+    assert visited == ["Draft", "Review", "Draft", "Review"]
+    assert csm.current_state.get_hpath() == "Done"
+
+def test_every_state_needs_a_stage():
+    with pytest.raises(ConversationNodeError):
+        StageExecutor(make_csm(), {"Draft": Stage(lambda: asyncio.sleep(0, "Review"))}, final_state="Done")
+
+def test_successor_prefetch_overlaps_the_current_stage():
+    csm = make_csm()
+    prefetch_threads = []
+    drafting = threading.Event()
+
+    def prefetch_review() -> str:
+        # Only finishes if it runs while Draft is still waiting
+        assert drafting.wait(1)
+        prefetch_threads.append(threading.current_thread())
+        return "notes"
+
+    async def draft() -> str:
+        drafting.set()
+        await asyncio.sleep(0.05)
+        return "Review"
+
+    async def review() -> str:
+        assert await executor.prefetched() == "notes"
+        return "Done"
+
+    executor = StageExecutor(csm, {"Draft": Stage(draft), "Review": Stage(review, prefetch=prefetch_review)}, final_state="Done")
+    asyncio.run(executor.run())
+
+    assert len(prefetch_threads) == 1 and prefetch_threads[0] is not threading.main_thread()
+
+def test_result_stream_processes_results_as_they_arrive():
+    async def main() -> tuple[list[str], float]:
+        stream = ResultStream(lambda result: (time.sleep(0.05), result.upper())[1])
+
+        # Fed from another thread, like a quorum predicate on the LLM loop
+        feeder = threading.Thread(target=lambda: [stream.feed({i: result for i, result in enumerate("abc"[:n])}) for n in (1, 2, 3)])
+        feeder.start()
+        feeder.join()
+
+        started = time.monotonic()
+        results = await stream.collect({0: "a", 1: "b", 2: "c"})
+        return results, time.monotonic() - started
+
+    results, elapsed = asyncio.run(main())
+
+    assert results == ["A", "B", "C"]
+    # Processed side by side, not one after another
+    assert elapsed < 0.12
@@ -0,0 +1,64 @@
+import sys
+import os
+
+import pytest
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "..")))
+
+from agents.tot.dedup import MinHasher, canonicalize_python, cluster_candidates, get_cluster_prior
+from agents.tot.quorum import RankingVoteQuorum
+
+
+@pytest.fixture(autouse=True)
+def dedup_env(monkeypatch):
+    monkeypatch.setenv("TOT_DEDUP_THRESHOLD", "0.9")
+    monkeypatch.setenv("TOT_DEDUP_CODE_THRESHOLD", "0.98")
+    monkeypatch.setenv("TOT_DEDUP_PRIOR_VOTES", "0.5")
+    monkeypatch.setenv("VOTE_QUORUM", "True")
+
+
+LONG_PLAN = ("1. Open data.txt in read mode and read every line, stripping the trailing whitespace. "
+             "2. Count the words on each line and keep the counts in a list. "
+             "3. Print a table of the line numbers and their word counts, sorted by line number.")
+
+
+def test_whitespace_differences_collapse():
+    plans = ["1. Open the file\n2. Print it", "1. Open the file 2.   Print it\n", "Plot a histogram of the ages"]
+
+    assert cluster_candidates(plans) == [[0, 1], [2]]
+
+def test_proposals_are_compared_as_code():
+    formatted = "```python\nx = 1  # one\nprint(x)\n```"
+    reformatted = "```python\nx=1\n\nprint( x )\n```"
+    different = "```python\nx = 2\nprint(x)\n```"
+
+    assert canonicalize_python(formatted) == canonicalize_python(reformatted)
+    assert cluster_candidates([formatted, reformatted, different], code=True) == [[0, 1], [2]]
+
+def test_code_that_does_not_parse_falls_back_to_text():
+    assert canonicalize_python("```python\nif x\n```") == "if x"
+
+def test_near_duplicates_cluster_by_minhash():
+    reworded = LONG_PLAN.replace("sorted by line number.", "sorted by line number!")
+    hasher = MinHasher()
+
+    assert hasher.similarity(hasher.signature(LONG_PLAN), hasher.signature(reworded)) >= 0.9
+    assert cluster_candidates([LONG_PLAN, reworded, "Plot a histogram of the ages"]) == [[0, 1], [2]]
+    assert cluster_candidates([LONG_PLAN, reworded], threshold=1.0) == [[0], [1]]
+
+def test_cluster_prior(monkeypatch):
+    assert get_cluster_prior([3, 1, 2]) == [1.0, 0.0, 0.5]
+    assert get_cluster_prior([3, 1, 2], prior_votes=0.0) == [0.0, 0.0, 0.0]
+
+    monkeypatch.setenv("TOT_DEDUP_PRIOR_VOTES", "1")
+    assert get_cluster_prior([3, 1, 2]) == [2.0, 0.0, 1.0]
+
+def test_prior_breaks_ties_in_the_quorum():
+    quorum = RankingVoteQuorum(voter_count=2, candidate_count=2, index_maps=[[0, 1], [0, 1]], prior=[0.0, 0.5])
+
+    # One vote each way leaves the larger cluster, candidate 1, ahead
+    quorum({0: "<best_candidate>1</best_candidate><worst_candidate>2</worst_candidate>",
+            1: "<best_candidate>2</best_candidate><worst_candidate>1</worst_candidate>"})
+
+    assert quorum.get_scores(quorum.read_rankings()) == [0.0, 0.5]
+    assert quorum.is_decided()
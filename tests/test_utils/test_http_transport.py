@@ -0,0 +1,50 @@
+import sys
+import os
+
+import pytest
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "..")))
+
+import utils.http_transport as http_transport
+from utils.http_transport import get_http_client, get_ssl_verify, use_http2
+
+
+@pytest.fixture(autouse=True)
+def fresh_clients(monkeypatch):
+    monkeypatch.setattr(http_transport, "_http_client", None)
+    monkeypatch.setattr(http_transport, "_async_http_client", None)
+
+
+def test_http_client_is_shared():
+    assert get_http_client() is get_http_client()
+
+def test_closed_http_client_is_replaced():
+    client = get_http_client()
+    client.close()
+
+    assert get_http_client() is not client
+
+def test_ssl_verify_uses_existing_custom_cert(monkeypatch, tmp_path):
+    cert_path = tmp_path / "ca.pem"
+    cert_path.write_text("")
+
+    monkeypatch.setenv("CUSTOM_SSL_CERT", str(cert_path))
+    assert get_ssl_verify() == str(cert_path)
+
+    monkeypatch.setenv("CUSTOM_SSL_CERT", str(tmp_path / "missing.pem"))
+    assert get_ssl_verify() is True
+
+def test_http2_falls_back_without_h2(monkeypatch):
+    monkeypatch.setenv("HTTP2", "True")
+    monkeypatch.setattr(http_transport, "HTTP2_AVAILABLE", False)
+
+    assert use_http2() is False
+
+def test_timeouts_and_limits_come_from_env(monkeypatch):
+    monkeypatch.setenv("HTTP_CONNECT_TIMEOUT_SEC", "3")
+    monkeypatch.setenv("HTTP_MAX_KEEPALIVE_CONNECTIONS", "7")
+
+    client = get_http_client()
+
+    assert client.timeout.connect == 3.0
+    assert client._transport._pool._max_keepalive_connections == 7
@@ -0,0 +1,218 @@
+import sys
+import os
+import json
+import asyncio
+
+import httpx
+import pytest
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "..")))
+
+from openai import AsyncOpenAI
+
+import utils.llm as llm
+from utils.llm import detect_openai_max_n, llm_turn, llm_turns, llm_turns_async, stream_llm_turn, StopSequenceDetector
+
+
+def chat_completion(request_json: dict) -> dict:
+    n = request_json.get("n", 1)
+    last_content = request_json["messages"][-1]["content"]
+
+    return {
+        "id": "chatcmpl-stub",
+        "object": "chat.completion",
+        "created": 0,
+        "model": request_json["model"],
+        "choices": [{"index": i,
+                     "message": {"role": "assistant", "content": f"{last_content}-{i}"},
+                     "finish_reason": "stop"} for i in range(n)],
+        "usage": {"prompt_tokens": 1, "completion_tokens": 1, "total_tokens": 2},
+    }
+
+def stub_openai_client(handler=None) -> AsyncOpenAI:
+    def default_handler(request: httpx.Request) -> httpx.Response:
+        return httpx.Response(200, json=chat_completion(json.loads(request.content)))
+
+    return AsyncOpenAI(api_key="test",
+                       base_url="http://stub.local/v1",
+                       max_retries=0,
+                       http_client=httpx.AsyncClient(transport=httpx.MockTransport(handler or default_handler)))
+
+@pytest.fixture(autouse=True)
+def openai_env(monkeypatch):
+    monkeypatch.setenv("OPENAI_MODEL", "stub-model")
+    monkeypatch.setenv("LLM_TELEMETRY", "False")
+    monkeypatch.setenv("OPENAI_MAX_N", "1")
+    monkeypatch.setenv("LLM_RETRY_BASE_SEC", "0.001")
+    monkeypatch.setenv("LLM_RETRY_CAP_SEC", "0.01")
+
+
+def test_llm_turn():
+    client = stub_openai_client()
+    prompts = {"system": "sys", "messages": [{"role": "user", "content": "hi"}]}
+
+    assert llm_turn(client, prompts, stop_sequences=["</output>"], temperature=0.0) == "hi-0"
+
+def test_llm_turns_list_preserves_order():
+    client = stub_openai_client()
+    prompts = [{"system": "sys", "messages": [{"role": "user", "content": str(i)}]} for i in range(4)]
+
+    assert llm_turns(client, prompts, stop_sequences=[], temperature=0.7, n=None) == ["0-0", "1-0", "2-0", "3-0"]
+
+def test_llm_turns_async_from_foreign_loop():
+    client = stub_openai_client()
+    prompts = {"system": "sys", "messages": [{"role": "user", "content": "hi"}]}
+
+    texts = asyncio.run(llm_turns_async(client, prompts, stop_sequences=[], temperature=0.7, n=3))
+
+    assert len(texts) == 3
+
+def test_llm_turns_drops_failed_calls():
+    def handler(request: httpx.Request) -> httpx.Response:
+        request_json = json.loads(request.content)
+        if request_json["messages"][-1]["content"] == "fail":
+            return httpx.Response(400, json={"error": {"message": "bad request"}})
+        return httpx.Response(200, json=chat_completion(request_json))
+
+    client = stub_openai_client(handler)
+    prompts = [{"system": "sys", "messages": [{"role": "user", "content": content}]} for content in ["a", "fail", "b"]]
+
+    assert llm_turns(client, prompts, stop_sequences=[], temperature=0.7, n=None) == ["a-0", "b-0"]
+
+def test_openai_max_n_is_probed_once_and_cached(monkeypatch, tmp_path):
+    monkeypatch.setenv("OPENAI_MAX_N", "auto")
+    monkeypatch.setenv("OUTPUT_DIR", str(tmp_path))
+
+    requested_ns = []
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        request_json = json.loads(request.content)
+        requested_ns.append(request_json.get("n", 1))
+        # Emulate a server that silently caps n at 3
+        request_json["n"] = min(request_json.get("n", 1), 3)
+        return httpx.Response(200, json=chat_completion(request_json))
+
+    client = stub_openai_client(handler)
+    prompts = {"system": "sys", "messages": [{"role": "user", "content": "hi"}]}
+
+    texts = llm_turns(client, prompts, stop_sequences=[], temperature=0.7, n=5)
+
+    assert len(texts) == 5
+    assert sorted(requested_ns[1:]) == [2, 3]
+    assert json.loads((tmp_path / "openai_max_n.json").read_text()) == {"http://stub.local/v1/": 3}
+
+@pytest.mark.parametrize("status_code, expected_cache", [
+    (400, {"http://stub.local/v1/": 1}),
+    (503, None),
+])
+def test_openai_max_n_probe_only_caches_a_definite_answer(monkeypatch, tmp_path, status_code, expected_cache):
+    monkeypatch.setenv("OPENAI_MAX_N", "auto")
+    monkeypatch.setenv("OUTPUT_DIR", str(tmp_path))
+    monkeypatch.setenv("LLM_MAX_ATTEMPTS", "2")
+    monkeypatch.setattr(llm, "_openai_max_n", {})
+
+    temperatures = []
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        temperatures.append(json.loads(request.content)["temperature"])
+        return httpx.Response(status_code, json={"error": {"message": "n is not supported"}})
+
+    assert detect_openai_max_n(stub_openai_client(handler)) == 1
+    assert set(temperatures) == {1.0}
+
+    cache_path = tmp_path / "openai_max_n.json"
+    if expected_cache is None:
+        # A failure that says nothing about n is probed again next session
+        assert not cache_path.exists()
+    else:
+        assert json.loads(cache_path.read_text()) == expected_cache
+
+def test_openai_max_n_is_not_probed_in_replay(monkeypatch, tmp_path):
+    monkeypatch.setenv("OPENAI_MAX_N", "auto")
+    monkeypatch.setenv("OUTPUT_DIR", str(tmp_path))
+    monkeypatch.setenv("LLM_BACKEND", "replay")
+    monkeypatch.setattr(llm, "_openai_max_n", {})
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        raise AssertionError("replay must not reach the network")
+
+    assert detect_openai_max_n(stub_openai_client(handler)) == 1
+    assert not (tmp_path / "openai_max_n.json").exists()
+
+def stream_handler(deltas: list[str]):
+    """Emulates a server that ignores `stop` and streams every delta it was given."""
+    def handler(request: httpx.Request) -> httpx.Response:
+        events = ""
+        for delta in deltas:
+            chunk = {"id": "chatcmpl-stub", "object": "chat.completion.chunk", "created": 0, "model": "stub-model",
+                     "choices": [{"index": 0, "delta": {"content": delta}, "finish_reason": None}]}
+            events += f"data: {json.dumps(chunk)}\n\n"
+        events += "data: [DONE]\n\n"
+        return httpx.Response(200, headers={"content-type": "text/event-stream"}, content=events.encode())
+
+    return handler
+
+@pytest.mark.parametrize("deltas, stop_sequences, expected", [
+    (["<plan>do ", "it</pl", "an> and keep going"], ["</plan>"], "<plan>do it"),
+    (["no stop ", "here"], ["</plan>"], "no stop here"),
+    (["a```", "b"], ["```", "</evaluation>"], "a"),
+])
+def test_stop_sequence_detector(deltas, stop_sequences, expected):
+    detector = StopSequenceDetector(stop_sequences)
+    text = "".join(detector.feed(delta) for delta in deltas) + detector.flush()
+
+    assert text == expected
+
+def test_stream_llm_turn_cuts_at_stop_sequence():
+    client = stub_openai_client(stream_handler(["<plan>step", " one</pl", "an>", "runaway text"]))
+    prompts = {"system": "sys", "messages": [{"role": "user", "content": "hi"}]}
+
+    assert "".join(stream_llm_turn(client, prompts, stop_sequences=["</plan>"], temperature=0.7)) == "<plan>step one"
+
+def test_llm_turns_stream_mode():
+    client = stub_openai_client(stream_handler(["vote", "</evaluation>", "extra"]))
+    prompts = {"system": "sys", "messages": [{"role": "user", "content": "hi"}]}
+
+    assert llm_turns(client, prompts, stop_sequences=["</evaluation>"], temperature=0.7, n=3, stream=True) == ["vote"] * 3
+
+def test_llm_turns_retries_and_refills_to_n():
+    failures = {"503": 2, "empty": 1}
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        request_json = json.loads(request.content)
+        if failures["503"]:
+            failures["503"] -= 1
+            return httpx.Response(503, json={"error": {"message": "overloaded"}})
+
+        response = chat_completion(request_json)
+        if failures["empty"]:
+            failures["empty"] -= 1
+            response["choices"][0]["message"]["content"] = None
+        return httpx.Response(200, json=response)
+
+    client = stub_openai_client(handler)
+    prompts = {"system": "sys", "messages": [{"role": "user", "content": "hi"}]}
+
+    assert len(llm_turns(client, prompts, stop_sequences=[], temperature=0.7, n=4)) == 4
+
+def test_llm_turns_quorum_returns_early_and_cancels_the_rest():
+    cancelled = []
+
+    async def handler(request: httpx.Request) -> httpx.Response:
+        request_json = json.loads(request.content)
+        if request_json["messages"][-1]["content"] == "slow":
+            try:
+                await asyncio.sleep(30)
+            except asyncio.CancelledError:
+                cancelled.append(True)
+                raise
+        return httpx.Response(200, json=chat_completion(request_json))
+
+    client = stub_openai_client(handler)
+    prompts = [{"system": "sys", "messages": [{"role": "user", "content": content}]} for content in ["a", "slow", "b"]]
+
+    texts = llm_turns(client, prompts, stop_sequences=[], temperature=0.7, n=None, quorum=lambda results: len(results) >= 2)
+
+    assert texts == ["a-0", "b-0"]
+    # The straggler has been cancelled, and has finished unwinding, by the time llm_turns returns
+    assert cancelled == [True]
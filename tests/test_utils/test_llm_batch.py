@@ -0,0 +1,133 @@
+import sys
+import os
+import json
+
+import httpx
+import pytest
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "..")))
+
+from openai import AsyncOpenAI
+
+from utils.llm import llm_turns
+from utils.llm_batch import CHAT_TEMPLATES, reset_batch_support, supports_batching
+
+
+class StubServer:
+    """
+    Emulates a local OpenAI-compatible server: /v1/completions answers a list of prompts in one response
+    (unless batch is False, when it does not exist) and /v1/chat/completions answers one prompt at a time.
+    Each completion names the prompt it was for, so the tests can check the order.
+    """
+    def __init__(self, batch: bool = True, drop_choices: int = 0) -> None:
+        self.batch = batch
+        self.drop_choices = drop_choices
+        self.requests: list[tuple[str, dict]] = []
+
+    def __call__(self, request: httpx.Request) -> httpx.Response:
+        request_json = json.loads(request.content)
+        path = request.url.path
+        self.requests.append((path, request_json))
+
+        if path.endswith("/completions") and not path.endswith("/chat/completions"):
+            if not self.batch:
+                return httpx.Response(404, json={"error": {"message": "Not Found"}})
+
+            prompts = request_json["prompt"]
+            choices = [{"index": i, "text": f"answer to {prompt.split('question ')[-1].split('<')[0]}", "finish_reason": "stop", "logprobs": None}
+                       for i, prompt in enumerate(prompts)]
+
+            return httpx.Response(200, json={
+                "id": "cmpl-stub",
+                "object": "text_completion",
+                "created": 0,
+                "model": request_json["model"],
+                # Batched choices can come back in any order
+                "choices": list(reversed(choices))[self.drop_choices:],
+                "usage": {"prompt_tokens": len(prompts), "completion_tokens": len(prompts), "total_tokens": 2 * len(prompts)},
+            })
+
+        question = request_json["messages"][-1]["content"].split("question ")[-1]
+        return httpx.Response(200, json={
+            "id": "chatcmpl-stub",
+            "object": "chat.completion",
+            "created": 0,
+            "model": request_json["model"],
+            "choices": [{"index": 0, "message": {"role": "assistant", "content": f"answer to {question}"}, "finish_reason": "stop"}],
+            "usage": {"prompt_tokens": 1, "completion_tokens": 1, "total_tokens": 2},
+        })
+
+    def paths(self) -> list[str]:
+        return [path.removeprefix("/v1") for path, _ in self.requests]
+
+
+@pytest.fixture(autouse=True)
+def batch_env(monkeypatch):
+    monkeypatch.setenv("OPENAI_MODEL", "stub-model")
+    monkeypatch.setenv("OPENAI_MAX_N", "1")
+    monkeypatch.setenv("LLM_TELEMETRY", "False")
+    monkeypatch.setenv("LLM_BATCH", "True")
+    monkeypatch.setenv("LLM_BATCH_CHAT_TEMPLATE", "chatml")
+    monkeypatch.delenv("OPENAI_BASE_URLS", raising=False)
+
+    reset_batch_support()
+    yield
+    reset_batch_support()
+
+
+def stub_client(server: StubServer) -> AsyncOpenAI:
+    return AsyncOpenAI(api_key="test", base_url="http://local.stub/v1", max_retries=0,
+                       http_client=httpx.AsyncClient(transport=httpx.MockTransport(server)))
+
+def voter_prompts(count: int) -> list[dict]:
+    return [{"system": "sys", "messages": [{"role": "user", "content": f"question {i}"}]} for i in range(count)]
+
+
+def test_chatml_leaves_assistant_prefill_open():
+    rendered = CHAT_TEMPLATES["chatml"].render("sys", [{"role": "user", "content": "hi"}, {"role": "assistant", "content": "<evaluation>"}])
+
+    assert rendered == "<|im_start|>system\nsys<|im_end|>\n<|im_start|>user\nhi<|im_end|>\n<|im_start|>assistant\n<evaluation>"
+
+def test_llama3_adds_generation_prompt():
+    rendered = CHAT_TEMPLATES["llama3"].render("", [{"role": "user", "content": "hi"}])
+
+    assert rendered == "<|begin_of_text|><|start_header_id|>user<|end_header_id|>\n\nhi<|eot_id|><|start_header_id|>assistant<|end_header_id|>\n\n"
+
+def test_prompts_go_out_as_one_batch():
+    server = StubServer()
+
+    texts = llm_turns(stub_client(server), voter_prompts(5), stop_sequences=["</evaluation>"], temperature=0.7, n=None)
+
+    assert texts == [f"answer to {i}" for i in range(5)]
+    assert server.paths() == ["/completions"]
+
+    request_json = server.requests[0][1]
+    assert len(request_json["prompt"]) == 5
+    assert request_json["stop"] == ["</evaluation>", "<|im_end|>"]
+
+def test_falls_back_to_one_request_per_prompt_without_completions_endpoint():
+    server = StubServer(batch=False)
+    client = stub_client(server)
+
+    assert llm_turns(client, voter_prompts(3), stop_sequences=[], temperature=0.7, n=None) == [f"answer to {i}" for i in range(3)]
+    assert server.paths() == ["/completions"] + ["/chat/completions"] * 3
+    assert not supports_batching(str(client.base_url))
+
+    # The server is not asked for a batch again
+    server.requests.clear()
+    assert llm_turns(client, voter_prompts(2), stop_sequences=[], temperature=0.7, n=None) == ["answer to 0", "answer to 1"]
+    assert server.paths() == ["/chat/completions"] * 2
+
+def test_falls_back_when_server_ignores_the_prompt_list():
+    server = StubServer(drop_choices=2)
+
+    assert llm_turns(stub_client(server), voter_prompts(3), stop_sequences=[], temperature=0.7, n=None) == [f"answer to {i}" for i in range(3)]
+    assert server.paths() == ["/completions"] + ["/chat/completions"] * 3
+
+def test_batching_is_opt_in(monkeypatch):
+    monkeypatch.setenv("LLM_BATCH", "False")
+    server = StubServer()
+
+    llm_turns(stub_client(server), voter_prompts(2), stop_sequences=[], temperature=0.7, n=None)
+
+    assert server.paths() == ["/chat/completions"] * 2
@@ -0,0 +1,138 @@
+import sys
+import os
+import glob
+import json
+import threading
+import time
+
+import httpx
+import pytest
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "..")))
+
+from anthropic import AsyncAnthropic
+from openai import AsyncOpenAI
+
+from utils.custom_exceptions import LLMCancelledError
+from utils.llm import llm_turns
+from utils.llm_batch_api import ANTHROPIC_URL, OPENAI_URL, FileBatchServer, parse_openai_batch_output
+from utils.llm_cancel import CancelToken
+
+
+@pytest.fixture(autouse=True)
+def batch_api_env(monkeypatch, tmp_path):
+    monkeypatch.setenv("OPENAI_MODEL", "stub-model")
+    monkeypatch.setenv("ANTHROPIC_MODEL", "stub-claude")
+    monkeypatch.setenv("ANTHROPIC_PROMPT_CACHING", "False")
+    monkeypatch.setenv("LLM_TELEMETRY", "False")
+    monkeypatch.setenv("LLM_BATCH_API", "file")
+    monkeypatch.setenv("LLM_BATCH_API_DIR", str(tmp_path))
+    monkeypatch.setenv("LLM_BATCH_API_POLL_SEC", "0.01")
+
+
+def no_network(request: httpx.Request) -> httpx.Response:
+    raise AssertionError(f"unexpected request to {request.url}")
+
+def openai_client() -> AsyncOpenAI:
+    return AsyncOpenAI(api_key="test", base_url="http://stub.local/v1", max_retries=0,
+                       http_client=httpx.AsyncClient(transport=httpx.MockTransport(no_network)))
+
+def anthropic_client() -> AsyncAnthropic:
+    return AsyncAnthropic(api_key="test", base_url="http://stub.local", max_retries=0,
+                          http_client=httpx.AsyncClient(transport=httpx.MockTransport(no_network)))
+
+def respond(url: str, body: dict) -> dict:
+    question = body["messages"][-1]["content"]
+    if question == "fail":
+        raise ValueError("stub failure")
+
+    if url == ANTHROPIC_URL:
+        return {"id": "msg_stub", "type": "message", "role": "assistant", "model": body["model"],
+                "content": [{"type": "text", "text": f"answer to {question}"}],
+                "stop_reason": "end_turn", "stop_sequence": None,
+                "usage": {"input_tokens": 1, "output_tokens": 1}}
+
+    assert url == OPENAI_URL
+    return {"id": "chatcmpl-stub", "object": "chat.completion", "created": 0, "model": body["model"],
+            "choices": [{"index": 0, "message": {"role": "assistant", "content": f"answer to {question}"}, "finish_reason": "stop"}],
+            "usage": {"prompt_tokens": 1, "completion_tokens": 1, "total_tokens": 2}}
+
+@pytest.fixture
+def batch_server(tmp_path):
+    server = FileBatchServer(str(tmp_path), respond)
+    server.start(poll_sec=0.01)
+    yield server
+    server.stop()
+
+def prompts(*questions: str) -> list[dict]:
+    return [{"system": "sys", "messages": [{"role": "user", "content": question}]} for question in questions]
+
+
+@pytest.mark.parametrize("make_client", [openai_client, anthropic_client])
+def test_fan_out_runs_as_one_batch_job(batch_server, tmp_path, make_client):
+    texts = llm_turns(make_client(), prompts("a", "b", "c"), stop_sequences=[], temperature=0.7, n=None)
+
+    assert texts == ["answer to a", "answer to b", "answer to c"]
+    assert len(glob.glob(os.path.join(tmp_path, "*.input.jsonl"))) == 1
+
+def test_n_samples_of_one_prompt(batch_server):
+    texts = llm_turns(openai_client(), prompts("a")[0], stop_sequences=[], temperature=0.7, n=3)
+
+    assert texts == ["answer to a"] * 3
+
+def interactive_client(questions: list[str]) -> AsyncOpenAI:
+    def handler(request: httpx.Request) -> httpx.Response:
+        question = json.loads(request.content)["messages"][-1]["content"]
+        questions.append(question)
+        return httpx.Response(200, json=respond(OPENAI_URL, {"model": "stub-model", "messages": [{"role": "user", "content": f"{question} (interactive)"}]}))
+
+    return AsyncOpenAI(api_key="test", base_url="http://stub.local/v1", max_retries=0,
+                       http_client=httpx.AsyncClient(transport=httpx.MockTransport(handler)))
+
+def test_failed_requests_are_made_interactively(batch_server):
+    questions: list[str] = []
+    texts = llm_turns(interactive_client(questions), prompts("a", "fail", "c"), stop_sequences=[], temperature=0.7, n=None)
+
+    assert texts == ["answer to a", "answer to fail (interactive)", "answer to c"]
+    assert questions == ["fail"]
+
+def test_failed_job_is_made_interactively(monkeypatch, tmp_path):
+    monkeypatch.setenv("OPENAI_MAX_N", "1")
+
+    def fail_jobs() -> None:
+        deadline = time.monotonic() + 5
+        while not (inputs := glob.glob(os.path.join(tmp_path, "*.input.jsonl"))) and time.monotonic() < deadline:
+            time.sleep(0.01)
+
+        for path in inputs:
+            open(path.replace(".input.jsonl", ".cancelled.jsonl"), "w").close()
+
+    threading.Thread(target=fail_jobs, daemon=True).start()
+
+    questions: list[str] = []
+    texts = llm_turns(interactive_client(questions), prompts("a")[0], stop_sequences=[], temperature=0.7, n=2)
+
+    assert texts == ["answer to a (interactive)"] * 2
+
+def test_cancelling_the_stage_cancels_the_job(tmp_path):
+    token = CancelToken()
+    threading.Timer(0.1, token.cancel, args=("interrupted",)).start()
+
+    # No server is running, so the job never ends
+    with pytest.raises(LLMCancelledError):
+        llm_turns(openai_client(), prompts("a"), stop_sequences=[], temperature=0.7, n=None, cancel=token)
+
+    deadline = time.monotonic() + 1
+    while not glob.glob(os.path.join(tmp_path, "*.cancelled.jsonl")) and time.monotonic() < deadline:
+        time.sleep(0.01)
+
+    assert glob.glob(os.path.join(tmp_path, "*.cancelled.jsonl"))
+
+def test_parse_openai_batch_output():
+    output = "\n".join([
+        '{"custom_id": "slot-0", "response": {"status_code": 200, "body": {"ok": true}}, "error": null}',
+        '{"custom_id": "slot-1", "response": {"status_code": 500, "body": {}}, "error": null}',
+        '{"custom_id": "slot-2", "response": null, "error": {"message": "expired"}}',
+    ])
+
+    assert parse_openai_batch_output(output) == {"slot-0": {"ok": True}, "slot-1": None, "slot-2": None}
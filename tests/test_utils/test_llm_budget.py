@@ -0,0 +1,102 @@
+import sys
+import os
+import json
+
+import httpx
+import pytest
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "..")))
+
+from openai import AsyncOpenAI
+
+from utils.llm import llm_turns
+from utils.llm_budget import GenerationBudgets, get_generation_budgets, reset_generation_budgets
+from utils.llm_telemetry import use_llm_state
+
+
+def make_budgets(**kwargs) -> GenerationBudgets:
+    settings = dict(learn=True, percentile=99, multiplier=1.5, min_samples=5, window=100, min_tokens=16, max_tokens=1024, retry_multiplier=2)
+    settings.update(kwargs)
+    return GenerationBudgets(**settings)
+
+@pytest.fixture(autouse=True)
+def budget_env(monkeypatch, tmp_path):
+    monkeypatch.setenv("OPENAI_MODEL", "stub-model")
+    monkeypatch.setenv("OPENAI_MAX_N", "1")
+    monkeypatch.setenv("LLM_TELEMETRY", "False")
+    monkeypatch.setenv("OUTPUT_DIR", str(tmp_path))
+    monkeypatch.setenv("LLM_BUDGET_MIN_SAMPLES", "3")
+    monkeypatch.setenv("LLM_BUDGET_MIN_TOKENS", "16")
+
+    reset_generation_budgets()
+    yield
+    reset_generation_budgets()
+
+
+def test_no_cap_until_enough_samples():
+    budgets = make_budgets()
+
+    for _ in range(4):
+        budgets.add("ToT.PlanVote", 100)
+    assert budgets.get_max_tokens("ToT.PlanVote") is None
+
+    budgets.add("ToT.PlanVote", 100)
+    assert budgets.get_max_tokens("ToT.PlanVote") == 150
+
+def test_cap_is_clamped_and_ignores_truncated_lengths():
+    budgets = make_budgets(min_samples=1)
+
+    budgets.observe("UI.Start", [(4, False), (5000, True)])
+    assert budgets.get_max_tokens("UI.Start") == 16
+
+    budgets.observe("UI.Start", [(5000, False)])
+    assert budgets.get_max_tokens("UI.Start") == 1024
+
+def test_override_takes_precedence():
+    budgets = make_budgets(learn=False)
+    budgets.set_override("ToT.ExecVote", 300)
+
+    assert budgets.get_max_tokens("ToT.ExecVote") == 300
+    assert budgets.get_max_tokens("ToT.Plan") is None
+
+def test_extend_stops_at_max_tokens():
+    budgets = make_budgets()
+
+    assert budgets.extend(300) == 600
+    assert budgets.extend(600) == 1024
+    assert budgets.extend(1024) is None
+
+def test_truncated_response_is_retried_with_a_bigger_budget():
+    requested_max_tokens = []
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        request_json = json.loads(request.content)
+        max_tokens = request_json.get("max_tokens")
+        requested_max_tokens.append(max_tokens)
+
+        # Every completion wants 40 tokens
+        truncated = max_tokens is not None and max_tokens < 40
+        return httpx.Response(200, json={
+            "id": "chatcmpl-stub",
+            "object": "chat.completion",
+            "created": 0,
+            "model": request_json["model"],
+            "choices": [{"index": 0,
+                         "message": {"role": "assistant", "content": "short" if truncated else "complete"},
+                         "finish_reason": "length" if truncated else "stop"}],
+            "usage": {"prompt_tokens": 1, "completion_tokens": max_tokens if truncated else 40, "total_tokens": 41},
+        })
+
+    client = AsyncOpenAI(api_key="test", base_url="http://stub.local/v1", max_retries=0,
+                         http_client=httpx.AsyncClient(transport=httpx.MockTransport(handler)))
+    prompts = {"system": "sys", "messages": [{"role": "user", "content": "hi"}]}
+
+    use_llm_state("Test.Budget")
+    get_generation_budgets().set_override("Test.Budget", 20)
+
+    try:
+        assert llm_turns(client, prompts, stop_sequences=[], temperature=0.7, n=1) == ["complete"]
+    finally:
+        use_llm_state("unknown")
+
+    assert requested_max_tokens == [20, 40]
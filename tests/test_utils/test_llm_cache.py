@@ -0,0 +1,73 @@
+import sys
+import os
+import asyncio
+
+import pytest
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "..")))
+
+from pydantic import BaseModel
+
+from utils.llm_cache import LLMCache
+
+
+class StubResponse(BaseModel):
+    text: str
+
+
+@pytest.fixture
+def cache(tmp_path):
+    return LLMCache(path=str(tmp_path / "cache.sqlite"), max_bytes=1024 * 1024, ttl_sec=60, max_temperature=0.0)
+
+
+def test_make_key_ignores_timestamps():
+    messages_a = [{"role": "user", "content": "hi", "timestamp": "2024-01-01 00:00:00"}]
+    messages_b = [{"role": "user", "content": "hi", "timestamp": "2025-06-01 12:00:00"}]
+
+    assert LLMCache.make_key("p", "m", "sys", messages_a, ["</output>"], 0.0, None) == LLMCache.make_key("p", "m", "sys", messages_b, ["</output>"], 0.0, None)
+    assert LLMCache.make_key("p", "m", "sys", messages_a, ["</output>"], 0.0, None) != LLMCache.make_key("p", "m", "sys", messages_a, ["</root>"], 0.0, None)
+
+def test_is_cacheable(cache):
+    assert cache.is_cacheable(0.0)
+    assert not cache.is_cacheable(0.7)
+
+def test_lru_eviction(tmp_path):
+    cache = LLMCache(path=str(tmp_path / "cache.sqlite"), max_bytes=25, ttl_sec=0, max_temperature=0.0)
+
+    cache.put("a", "x" * 10)
+    cache.put("b", "x" * 10)
+    cache.get("a")
+    cache.put("c", "x" * 10)
+
+    assert cache.get("a") is not None
+    assert cache.get("b") is None
+    assert cache.get("c") is not None
+    assert cache.evictions == 1
+
+def test_ttl_expiry(tmp_path):
+    cache = LLMCache(path=str(tmp_path / "cache.sqlite"), max_bytes=1024, ttl_sec=1e-9, max_temperature=0.0)
+
+    cache.put("a", "value")
+
+    assert cache.get("a") is None
+
+def test_get_or_call_single_flight(cache):
+    calls = 0
+
+    async def call() -> StubResponse:
+        nonlocal calls
+        calls += 1
+        await asyncio.sleep(0.01)
+        return StubResponse(text="done")
+
+    async def run():
+        return await asyncio.gather(*[cache.get_or_call("key", StubResponse, call) for _ in range(4)])
+
+    responses = asyncio.run(run())
+    responses.append(asyncio.run(cache.get_or_call("key", StubResponse, call)))
+
+    assert [response.text for response in responses] == ["done"] * 5
+    assert calls == 1
+    assert cache.get_stats()["misses"] == 1
+    assert cache.get_stats()["coalesced"] == 3
+    assert cache.get_stats()["hits"] == 1
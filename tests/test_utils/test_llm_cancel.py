@@ -0,0 +1,111 @@
+import sys
+import os
+import gc
+import json
+import time
+import asyncio
+import threading
+
+import httpx
+import pytest
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "..")))
+
+from openai import AsyncOpenAI
+
+from utils.custom_exceptions import LLMCancelledError
+from utils.llm import llm_turns
+from utils.llm_cancel import CancelToken
+
+
+def slow_handler(slow_contents: set[str]):
+    async def handler(request: httpx.Request) -> httpx.Response:
+        request_json = json.loads(request.content)
+        content = request_json["messages"][-1]["content"]
+        if content in slow_contents:
+            await asyncio.sleep(30)
+
+        return httpx.Response(200, json={
+            "id": "chatcmpl-stub",
+            "object": "chat.completion",
+            "created": 0,
+            "model": request_json["model"],
+            "choices": [{"index": 0, "message": {"role": "assistant", "content": content}, "finish_reason": "stop"}],
+            "usage": {"prompt_tokens": 1, "completion_tokens": 1, "total_tokens": 2},
+        })
+
+    return handler
+
+def stub_openai_client(handler) -> AsyncOpenAI:
+    return AsyncOpenAI(api_key="test", base_url="http://stub.local/v1", max_retries=0,
+                       http_client=httpx.AsyncClient(transport=httpx.MockTransport(handler)))
+
+def prompts_for(contents: list[str]) -> list[dict]:
+    return [{"system": "sys", "messages": [{"role": "user", "content": content}]} for content in contents]
+
+@pytest.fixture(autouse=True)
+def cancel_env(monkeypatch):
+    monkeypatch.setenv("OPENAI_MODEL", "stub-model")
+    monkeypatch.setenv("LLM_TELEMETRY", "False")
+
+
+def test_child_inherits_cancellation_and_earliest_deadline():
+    parent = CancelToken(budget_sec=10)
+    child = parent.child(budget_sec=60)
+
+    assert child.deadline == parent.deadline
+
+    parent.cancel("interrupted")
+
+    assert child.cancelled
+    assert child.reason == "interrupted"
+    with pytest.raises(LLMCancelledError):
+        child.check()
+
+def test_finished_children_are_released_by_the_parent():
+    parent = CancelToken()
+
+    for _ in range(100):
+        child = parent.child()
+        assert not child.cancelled
+
+    del child
+    gc.collect()
+
+    assert parent._callbacks == []
+
+def test_cancel_from_another_thread_aborts_outstanding_calls():
+    token = CancelToken()
+    client = stub_openai_client(slow_handler({"slow"}))
+
+    threading.Timer(0.2, token.cancel, args=("interrupted",)).start()
+
+    started_at = time.monotonic()
+    with pytest.raises(LLMCancelledError):
+        llm_turns(client, prompts_for(["a", "slow"]), stop_sequences=[], temperature=0.7, n=None, cancel=token)
+
+    assert time.monotonic() - started_at < 5
+
+def test_deadline_returns_results_received_so_far():
+    client = stub_openai_client(slow_handler({"slow"}))
+
+    started_at = time.monotonic()
+    texts = llm_turns(client, prompts_for(["a", "slow", "b"]), stop_sequences=[], temperature=0.7, n=None, cancel=CancelToken(budget_sec=0.5))
+
+    assert texts == ["a", "b"]
+    assert time.monotonic() - started_at < 5
+
+def test_already_cancelled_token_makes_no_calls():
+    requests = []
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        requests.append(request)
+        return httpx.Response(500)
+
+    token = CancelToken()
+    token.cancel()
+
+    with pytest.raises(LLMCancelledError):
+        llm_turns(stub_openai_client(handler), prompts_for(["a"]), stop_sequences=[], temperature=0.7, n=None, cancel=token)
+
+    assert requests == []
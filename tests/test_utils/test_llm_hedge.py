@@ -0,0 +1,146 @@
+import sys
+import os
+import json
+import time
+import asyncio
+
+import httpx
+import pytest
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "..")))
+
+from openai import AsyncOpenAI
+
+import utils.llm_hedge as llm_hedge
+from utils.llm import llm_turns
+from utils.llm_hedge import HedgeBudget, Hedger, LatencyTracker
+from utils.llm_telemetry import get_llm_state
+
+
+def warm_hedger(key, latency_sec: float = 0.01, ratio: float = 1.0) -> Hedger:
+    tracker = LatencyTracker(window=50, min_samples=5)
+    for _ in range(10):
+        tracker.add(key, latency_sec)
+
+    return Hedger(percentile=95, tracker=tracker, budget=HedgeBudget(ratio=ratio, reserve=10))
+
+
+def test_hedge_budget_caps_extra_requests():
+    budget = HedgeBudget(ratio=0.1, reserve=2)
+
+    hedges = 0
+    for _ in range(100):
+        budget.on_request()
+        hedges += budget.try_spend()
+
+    assert hedges == 10
+
+def test_straggler_is_hedged_and_cancelled():
+    hedger = warm_hedger("key")
+    calls = []
+
+    async def call() -> str:
+        calls.append(len(calls))
+        try:
+            await asyncio.sleep(5 if len(calls) == 1 else 0.01)
+        except asyncio.CancelledError:
+            calls.append("cancelled")
+            raise
+        return f"call-{len(calls)}"
+
+    async def run() -> str:
+        result = await hedger.run("key", call)
+        await asyncio.sleep(0)
+        return result
+
+    started_at = time.perf_counter()
+    assert asyncio.run(run()) == "call-2"
+    assert time.perf_counter() - started_at < 1
+    assert "cancelled" in calls
+    assert hedger.get_stats()["hedge_wins"] == 1
+
+def test_multi_request_calls_are_charged_per_request():
+    # Five single requests buy one hedge, which a call standing for two requests cannot afford
+    hedger = warm_hedger("key", ratio=0.2)
+    calls = []
+
+    def slow_call(sec: float):
+        async def call() -> str:
+            calls.append(sec)
+            await asyncio.sleep(sec)
+            return "slow"
+
+        return call
+
+    async def run() -> None:
+        for _ in range(2):
+            await hedger.run("key", slow_call(0.1), request_count=2)
+
+    asyncio.run(run())
+
+    assert len(calls) == 2
+    assert hedger.get_stats()["requests"] == 4
+    assert hedger.get_stats()["hedges"] == 0
+
+    # Slower than every latency seen so far, which now include the two above
+    asyncio.run(hedger.run("key", slow_call(0.3)))
+
+    assert hedger.get_stats()["hedges"] == 1
+
+def test_fast_call_is_not_hedged():
+    hedger = warm_hedger("key", latency_sec=1.0)
+
+    async def call() -> str:
+        return "fast"
+
+    assert asyncio.run(hedger.run("key", call)) == "fast"
+    assert hedger.get_stats()["hedges"] == 0
+
+def test_no_hedge_without_latency_history():
+    hedger = Hedger(percentile=95, tracker=LatencyTracker(window=50, min_samples=5), budget=HedgeBudget(ratio=1.0, reserve=10))
+
+    async def call() -> str:
+        await asyncio.sleep(0.05)
+        return "only"
+
+    assert asyncio.run(hedger.run("key", call)) == "only"
+    assert hedger.get_stats()["hedges"] == 0
+
+def test_llm_turns_hedges_slow_fan_out_member(monkeypatch):
+    monkeypatch.setenv("OPENAI_MODEL", "stub-model")
+    monkeypatch.setenv("OPENAI_MAX_N", "1")
+    monkeypatch.setenv("LLM_TELEMETRY", "False")
+    monkeypatch.setenv("LLM_HEDGE", "True")
+
+    hedger = warm_hedger((get_llm_state(), "http://hedge.local/v1/"))
+    monkeypatch.setattr(llm_hedge, "_hedger", hedger)
+
+    request_count = {"count": 0}
+
+    async def handler(request: httpx.Request) -> httpx.Response:
+        request_count["count"] += 1
+        request_json = json.loads(request.content)
+        content = request_json["messages"][-1]["content"]
+
+        # The first request for "slow" stalls, its hedge does not
+        if content == "slow" and request_count["count"] <= 4:
+            await asyncio.sleep(5)
+
+        return httpx.Response(200, json={
+            "id": "chatcmpl-stub", "object": "chat.completion", "created": 0, "model": request_json["model"],
+            "choices": [{"index": 0, "message": {"role": "assistant", "content": content}, "finish_reason": "stop"}],
+        })
+
+    client = AsyncOpenAI(api_key="test", base_url="http://hedge.local/v1", max_retries=0,
+                         http_client=httpx.AsyncClient(transport=httpx.MockTransport(handler)))
+    prompts = [{"system": "sys", "messages": [{"role": "user", "content": content}]} for content in ["a", "slow", "b"]]
+
+    # The client's first call is slow to set up, and would outlast the warmed p95 - make it before hedging is on
+    monkeypatch.setenv("LLM_HEDGE", "False")
+    llm_turns(client, {"system": "sys", "messages": [{"role": "user", "content": "warm"}]}, stop_sequences=[], temperature=0.7, n=1)
+    monkeypatch.setenv("LLM_HEDGE", "True")
+
+    started_at = time.perf_counter()
+    assert llm_turns(client, prompts, stop_sequences=[], temperature=0.7, n=None) == ["a", "slow", "b"]
+    assert time.perf_counter() - started_at < 2
+    assert hedger.get_stats()["hedges"] == 1
@@ -0,0 +1,115 @@
+import sys
+import os
+import json
+import asyncio
+
+import httpx
+import pytest
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "..")))
+
+from openai import AsyncOpenAI
+
+import utils.llm_retry
+from utils.llm import llm_turns
+from utils.llm_limiter import AdaptiveLimiter, get_limiter_metrics, reset_limiters
+
+
+class OverloadError(Exception):
+    status_code = 429
+
+
+@pytest.fixture(autouse=True)
+def limiter_env(monkeypatch):
+    monkeypatch.setenv("OPENAI_MODEL", "stub-model")
+    monkeypatch.setenv("LLM_TELEMETRY", "False")
+    monkeypatch.setenv("OPENAI_MAX_N", "1")
+    monkeypatch.setenv("LLM_LIMIT_INITIAL", "8")
+    monkeypatch.setenv("LLM_RETRY_BASE_SEC", "0.001")
+    monkeypatch.setenv("LLM_RETRY_CAP_SEC", "0.01")
+    monkeypatch.setenv("LLM_RETRY_BUDGET_RESERVE", "1000")
+    monkeypatch.setattr(utils.llm_retry, "_retry_budget", None)
+
+    reset_limiters()
+    yield
+    reset_limiters()
+
+
+def test_limit_grows_additively_and_shrinks_multiplicatively():
+    limiter = AdaptiveLimiter("http://stub.local", "stub-model", initial_limit=4, min_limit=1, max_limit=5, decrease=0.5)
+
+    for _ in range(5):
+        limiter.in_flight += 1
+        limiter.release(0.0)
+
+    assert limiter.limit == pytest.approx(5, abs=0.01)
+
+    limiter.in_flight += 2
+    limiter.release(1e12, OverloadError())
+    # The second overload started before the cut, so it must not cut the limit again
+    limiter.release(0.0, OverloadError())
+
+    assert limiter.limit == pytest.approx(2.5, abs=0.01)
+    assert limiter.overloads == 2
+
+def test_requests_over_the_limit_queue_in_order():
+    async def run() -> None:
+        limiter = AdaptiveLimiter("http://stub.local", "stub-model", initial_limit=2, min_limit=1, max_limit=2, decrease=0.5)
+        order = []
+
+        async def request(i: int) -> None:
+            async with limiter.slot():
+                order.append(i)
+                await asyncio.sleep(0.01)
+
+        tasks = [asyncio.ensure_future(request(i)) for i in range(5)]
+        await asyncio.sleep(0)
+
+        assert limiter.in_flight == 2
+        assert limiter.queue_depth == 3
+
+        # A cancelled waiter gives up its place in the queue
+        tasks[3].cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+        assert order == [0, 1, 2, 4]
+        assert limiter.in_flight == 0
+        assert limiter.queue_depth == 0
+
+    asyncio.run(run())
+
+def test_limiter_converges_on_stub_server_capacity():
+    capacity = 3
+    concurrency = {"current": 0}
+
+    async def handler(request: httpx.Request) -> httpx.Response:
+        request_json = json.loads(request.content)
+
+        if concurrency["current"] >= capacity:
+            return httpx.Response(429, json={"error": {"message": "too many requests"}})
+
+        concurrency["current"] += 1
+        try:
+            await asyncio.sleep(0.005)
+        finally:
+            concurrency["current"] -= 1
+
+        content = request_json["messages"][-1]["content"]
+        return httpx.Response(200, json={
+            "id": "chatcmpl-stub", "object": "chat.completion", "created": 0, "model": request_json["model"],
+            "choices": [{"index": 0, "message": {"role": "assistant", "content": content}, "finish_reason": "stop"}],
+        })
+
+    client = AsyncOpenAI(api_key="test", base_url="http://capacity.local/v1", max_retries=0,
+                         http_client=httpx.AsyncClient(transport=httpx.MockTransport(handler)))
+    prompts = [{"system": "sys", "messages": [{"role": "user", "content": str(i)}]} for i in range(40)]
+
+    texts = llm_turns(client, prompts, stop_sequences=[], temperature=0.7, n=None)
+
+    assert texts == [str(i) for i in range(40)]
+
+    [metrics] = [metrics for metrics in get_limiter_metrics() if metrics["endpoint"] == "http://capacity.local/v1/"]
+    assert metrics["overloads"] > 0
+    assert metrics["successes"] == 40
+    assert metrics["limit"] < 8
+    assert metrics["in_flight"] == 0 and metrics["queue_depth"] == 0
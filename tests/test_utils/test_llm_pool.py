@@ -0,0 +1,92 @@
+import sys
+import os
+import json
+import asyncio
+from collections import Counter
+
+import httpx
+import pytest
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "..")))
+
+from openai import AsyncOpenAI
+
+from utils.llm import llm_turns
+from utils.llm_pool import EndpointPool, Endpoint, get_endpoint_pool
+
+
+def chat_completion(request_json: dict) -> dict:
+    return {
+        "id": "chatcmpl-stub",
+        "object": "chat.completion",
+        "created": 0,
+        "model": request_json["model"],
+        "choices": [{"index": 0, "message": {"role": "assistant", "content": "ok"}, "finish_reason": "stop"}],
+        "usage": {"prompt_tokens": 1, "completion_tokens": 1, "total_tokens": 2},
+    }
+
+def stub_openai_client(handler, base_url: str = "http://box-a.local/v1") -> AsyncOpenAI:
+    return AsyncOpenAI(api_key="test", base_url=base_url, max_retries=0,
+                       http_client=httpx.AsyncClient(transport=httpx.MockTransport(handler)))
+
+@pytest.fixture(autouse=True)
+def pool_env(monkeypatch):
+    monkeypatch.setenv("OPENAI_MODEL", "stub-model")
+    monkeypatch.setenv("OPENAI_MAX_N", "1")
+    monkeypatch.setenv("LLM_TELEMETRY", "False")
+    monkeypatch.setenv("OPENAI_BASE_URLS", "http://box-a.local/v1,http://box-b.local/v1")
+
+
+def test_fan_out_is_spread_across_endpoints():
+    hosts = Counter()
+
+    async def handler(request: httpx.Request) -> httpx.Response:
+        hosts[request.url.host] += 1
+        await asyncio.sleep(0.05)
+        return httpx.Response(200, json=chat_completion(json.loads(request.content)))
+
+    prompts = {"system": "sys", "messages": [{"role": "user", "content": "hi"}]}
+
+    assert len(llm_turns(stub_openai_client(handler), prompts, stop_sequences=[], temperature=0.7, n=6)) == 6
+    assert hosts == {"box-a.local": 3, "box-b.local": 3}
+
+def test_no_pool_for_clients_outside_the_list():
+    client = stub_openai_client(lambda request: httpx.Response(200), base_url="http://elsewhere.local/v1")
+
+    assert get_endpoint_pool(client) is None
+
+def test_eject_after_consecutive_failures_and_readmit_on_probe():
+    box_b_down = {"down": True}
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        if request.url.host == "box-b.local" and box_b_down["down"]:
+            return httpx.Response(500, json={"error": {"message": "down"}})
+        if request.url.path.endswith("/models"):
+            return httpx.Response(200, json={"object": "list", "data": []})
+        return httpx.Response(200, json=chat_completion(json.loads(request.content)))
+
+    async def scenario() -> None:
+        client = stub_openai_client(handler)
+        pool = EndpointPool([Endpoint(client), Endpoint(client.with_options(base_url="http://box-b.local/v1"))],
+                            eject_after=2, probe_interval_sec=0.01)
+        box_b = pool.endpoints[1]
+
+        for _ in range(2):
+            box_b.outstanding += 1
+            try:
+                await box_b.client.chat.completions.create(model="stub-model", messages=[{"role": "user", "content": "hi"}])
+            except Exception as e:
+                pool.release(box_b, e)
+
+        assert not box_b.healthy
+        assert all(pool.pick() is pool.endpoints[0] for _ in range(10))
+
+        box_b_down["down"] = False
+        for _ in range(100):
+            if box_b.healthy:
+                break
+            await asyncio.sleep(0.01)
+
+        assert box_b.healthy
+
+    asyncio.run(scenario())
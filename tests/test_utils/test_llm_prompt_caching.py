@@ -0,0 +1,100 @@
+import sys
+import os
+import json
+import asyncio
+
+import httpx
+import pytest
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "..")))
+
+from anthropic import AsyncAnthropic
+
+from utils.llm import cast_messages_anthropic, get_cache_breakpoint, llm_turns
+
+
+def sse(events: list[dict]) -> bytes:
+    return "".join(f"event: {event['type']}\ndata: {json.dumps(event)}\n\n" for event in events).encode()
+
+def anthropic_message(text: str, usage: dict) -> dict:
+    return {"id": "msg_stub", "type": "message", "role": "assistant", "model": "stub-model",
+            "content": [{"type": "text", "text": text}], "stop_reason": "end_turn", "stop_sequence": None, "usage": usage}
+
+def anthropic_stream(text: str, usage: dict) -> bytes:
+    message = anthropic_message("", usage)
+    message["content"] = []
+    message["stop_reason"] = None
+
+    return sse([
+        {"type": "message_start", "message": message},
+        {"type": "content_block_start", "index": 0, "content_block": {"type": "text", "text": ""}},
+        {"type": "content_block_delta", "index": 0, "delta": {"type": "text_delta", "text": text}},
+        {"type": "content_block_stop", "index": 0},
+        {"type": "message_delta", "delta": {"stop_reason": "end_turn", "stop_sequence": None}, "usage": {"output_tokens": 1}},
+        {"type": "message_stop"},
+    ])
+
+@pytest.fixture(autouse=True)
+def anthropic_env(monkeypatch):
+    monkeypatch.setenv("ANTHROPIC_MODEL", "stub-model")
+    monkeypatch.setenv("ANTHROPIC_PROMPT_CACHING", "True")
+    monkeypatch.setenv("LLM_TELEMETRY", "False")
+
+
+def test_cache_breakpoint_is_last_message_before_final_user_turn():
+    history = [{"role": "user", "content": "task"}, {"role": "assistant", "content": "step 1 done"}]
+    messages = history + [{"role": "user", "content": "plan step 2"}, {"role": "assistant", "content": "<plan>"}]
+
+    breakpoint_index = get_cache_breakpoint(messages)
+    casted = cast_messages_anthropic(messages, breakpoint_index)
+
+    assert breakpoint_index == 1
+    assert casted[1]["content"] == [{"type": "text", "text": "step 1 done", "cache_control": {"type": "ephemeral"}}]
+    assert casted[2]["content"] == "plan step 2"
+    assert get_cache_breakpoint([{"role": "user", "content": "first turn"}]) is None
+
+def test_fan_out_waits_for_leader_to_cache_prefix():
+    requests = []
+
+    async def handler(request: httpx.Request) -> httpx.Response:
+        request_json = json.loads(request.content)
+        requests.append(request_json)
+
+        if request_json.get("stream"):
+            # The leader - give followers a chance to (wrongly) start before it does
+            await asyncio.sleep(0.05)
+            return httpx.Response(200, headers={"content-type": "text/event-stream"},
+                                  content=anthropic_stream("leader", {"input_tokens": 5, "output_tokens": 1, "cache_creation_input_tokens": 2000}))
+
+        return httpx.Response(200, json=anthropic_message("follower", {"input_tokens": 5, "output_tokens": 1, "cache_read_input_tokens": 2000}))
+
+    client = AsyncAnthropic(api_key="test", base_url="http://anthropic.local", max_retries=0,
+                            http_client=httpx.AsyncClient(transport=httpx.MockTransport(handler)))
+    prompts = {"system": "long shared system prompt",
+               "messages": [{"role": "user", "content": "task"}, {"role": "assistant", "content": "history"}, {"role": "user", "content": "vote"}]}
+
+    texts = llm_turns(client, prompts, stop_sequences=[], temperature=0.7, n=4)
+
+    assert sorted(texts) == ["follower"] * 3 + ["leader"]
+    assert requests[0].get("stream") is True
+    assert not any(request.get("stream") for request in requests[1:])
+
+    for request in requests:
+        assert request["system"] == [{"type": "text", "text": "long shared system prompt", "cache_control": {"type": "ephemeral"}}]
+        assert request["messages"][1]["content"][0]["cache_control"] == {"type": "ephemeral"}
+
+def test_prompt_caching_can_be_disabled(monkeypatch):
+    monkeypatch.setenv("ANTHROPIC_PROMPT_CACHING", "False")
+    requests = []
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        requests.append(json.loads(request.content))
+        return httpx.Response(200, json=anthropic_message("ok", {"input_tokens": 5, "output_tokens": 1}))
+
+    client = AsyncAnthropic(api_key="test", base_url="http://anthropic-nocache.local", max_retries=0,
+                            http_client=httpx.AsyncClient(transport=httpx.MockTransport(handler)))
+
+    llm_turns(client, {"system": "sys", "messages": [{"role": "user", "content": "hi"}]}, stop_sequences=[], temperature=0.7, n=2)
+
+    assert [request["system"] for request in requests] == ["sys", "sys"]
+    assert not any(request.get("stream") for request in requests)
@@ -0,0 +1,84 @@
+import sys
+import os
+import asyncio
+
+import httpx
+import pytest
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "..")))
+
+import anthropic
+
+from utils.custom_exceptions import LLMAPIRateLimitError
+from utils.llm_retry import RetryBudget, RetryPolicy, call_with_retries, get_retry_after, is_retryable
+
+
+def status_error(status_code: int, headers: dict = {}) -> anthropic.APIStatusError:
+    request = httpx.Request("POST", "http://stub.local/v1/messages")
+    response = httpx.Response(status_code, headers=headers, request=request)
+    return anthropic.APIStatusError("stub error", response=response, body=None)
+
+def fast_policy(max_attempts: int = 5, budget: RetryBudget = None) -> RetryPolicy:
+    return RetryPolicy(max_attempts=max_attempts, base_sec=0.001, cap_sec=0.01, deadline_sec=5, budget=budget)
+
+
+@pytest.mark.parametrize("status_code, expected", [(429, True), (500, True), (529, True), (408, True), (400, False), (401, False)])
+def test_is_retryable(status_code, expected):
+    assert is_retryable(status_error(status_code)) == expected
+
+@pytest.mark.parametrize("headers, expected", [({"retry-after": "3"}, 3.0), ({"retry-after-ms": "250"}, 0.25), ({}, None)])
+def test_get_retry_after(headers, expected):
+    assert get_retry_after(status_error(429, headers)) == expected
+
+def test_decorrelated_jitter_is_bounded():
+    policy = RetryPolicy(max_attempts=10, base_sec=1, cap_sec=20, deadline_sec=None, budget=None)
+
+    sleep_sec = policy.base_sec
+    for _ in range(50):
+        next_sleep = policy.next_sleep(sleep_sec)
+        assert policy.base_sec <= next_sleep <= min(policy.cap_sec, sleep_sec * 3)
+        sleep_sec = next_sleep
+
+def test_call_with_retries_recovers_from_rate_limit():
+    errors = [status_error(429), status_error(503)]
+
+    async def call():
+        if errors:
+            raise errors.pop(0)
+        return "ok"
+
+    assert asyncio.run(call_with_retries(call, "stub", fast_policy())) == "ok"
+
+def test_call_with_retries_raises_llm_api_error_when_exhausted():
+    async def call():
+        raise status_error(429)
+
+    with pytest.raises(LLMAPIRateLimitError):
+        asyncio.run(call_with_retries(call, "stub", fast_policy(max_attempts=3)))
+
+def test_call_with_retries_does_not_retry_bad_request():
+    calls = 0
+
+    async def call():
+        nonlocal calls
+        calls += 1
+        raise status_error(400)
+
+    with pytest.raises(anthropic.APIStatusError):
+        asyncio.run(call_with_retries(call, "stub", fast_policy()))
+
+    assert calls == 1
+
+def test_retry_budget_limits_retries():
+    budget = RetryBudget(ratio=0.0, reserve=1)
+    calls = 0
+
+    async def call():
+        nonlocal calls
+        calls += 1
+        raise status_error(500)
+
+    with pytest.raises(Exception):
+        asyncio.run(call_with_retries(call, "stub", fast_policy(budget=budget)))
+
+    assert calls == 2
@@ -0,0 +1,86 @@
+import sys
+import os
+import json
+
+import httpx
+import pytest
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "..")))
+
+from openai import AsyncOpenAI
+
+from utils.llm import llm_turns
+from utils.llm_routing import clear_state_routes, has_small_model, resolve_model, set_state_route
+from utils.llm_telemetry import format_llm_state, set_llm_state
+
+
+@pytest.fixture(autouse=True)
+def routing_env(monkeypatch):
+    monkeypatch.setenv("OPENAI_MODEL", "stub-large")
+    monkeypatch.setenv("OPENAI_SMALL_MODEL", "stub-small")
+    monkeypatch.setenv("OPENAI_MAX_N", "1")
+    monkeypatch.setenv("LLM_TELEMETRY", "False")
+    monkeypatch.delenv("OPENAI_BASE_URLS", raising=False)
+
+    clear_state_routes()
+    yield
+    clear_state_routes()
+    set_llm_state("Test", "RoutingDone")
+
+
+def recording_client(requests: list[dict]) -> AsyncOpenAI:
+    def handler(request: httpx.Request) -> httpx.Response:
+        request_json = json.loads(request.content)
+        requests.append(request_json)
+        return httpx.Response(200, json={
+            "id": "chatcmpl-stub",
+            "object": "chat.completion",
+            "created": 0,
+            "model": request_json["model"],
+            "choices": [{"index": 0, "message": {"role": "assistant", "content": "ok"}, "finish_reason": "stop"}],
+            "usage": {"prompt_tokens": 1, "completion_tokens": 1, "total_tokens": 2},
+        })
+
+    return AsyncOpenAI(api_key="test", base_url="http://stub.local/v1", max_retries=0,
+                       http_client=httpx.AsyncClient(transport=httpx.MockTransport(handler)))
+
+PROMPTS = {"system": "sys", "messages": [{"role": "user", "content": "hi"}]}
+
+
+@pytest.mark.parametrize("model, expected", [
+    (None, "stub-large"),
+    ("large", "stub-large"),
+    ("small", "stub-small"),
+    ("custom-model", "custom-model"),
+    ({"openai": "small", "anthropic": "claude-small"}, "stub-small"),
+    ({"anthropic": "claude-small"}, "stub-large"),
+])
+def test_resolve_model(model, expected):
+    assert resolve_model("openai", model) == expected
+
+def test_small_tier_falls_back_to_default_model(monkeypatch):
+    monkeypatch.setenv("OPENAI_SMALL_MODEL", "")
+
+    assert resolve_model("openai", "small") == "stub-large"
+    assert not has_small_model("openai")
+
+def test_state_route_sets_model_and_temperature():
+    requests: list[dict] = []
+    set_state_route(format_llm_state("Test", "Routed"), model="small", temperature=0.1)
+
+    set_llm_state("Test", "Routed")
+    llm_turns(recording_client(requests), PROMPTS, stop_sequences=[], temperature=0.7, n=1)
+
+    set_llm_state("Test", "Unrouted")
+    llm_turns(recording_client(requests), PROMPTS, stop_sequences=[], temperature=0.7, n=1)
+
+    assert [(request["model"], request["temperature"]) for request in requests] == [("stub-small", 0.1), ("stub-large", 0.7)]
+
+def test_explicit_model_overrides_state_route():
+    requests: list[dict] = []
+    set_state_route(format_llm_state("Test", "Routed"), model="small")
+
+    set_llm_state("Test", "Routed")
+    llm_turns(recording_client(requests), PROMPTS, stop_sequences=[], temperature=0.7, n=1, model="large")
+
+    assert requests[0]["model"] == "stub-large"
@@ -0,0 +1,172 @@
+import sys
+import os
+import asyncio
+
+import pytest
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "..")))
+
+from utils.llm_limiter import AdaptiveLimiter
+from utils.llm_scheduler import DEFAULT_SHARES, Priority, PriorityScheduler, parse_shares, run_with_llm_priority
+
+
+async def take_slot(scheduler: PriorityScheduler, priority: Priority, order: list[Priority]) -> None:
+    await scheduler.acquire(priority)
+    order.append(priority)
+
+async def settle() -> None:
+    for _ in range(5):
+        await asyncio.sleep(0)
+
+
+def test_interactive_preempts_queued_background_work():
+    async def scenario() -> list[Priority]:
+        scheduler = PriorityScheduler(capacity=1, shares=DEFAULT_SHARES, aging_sec=0)
+        order: list[Priority] = []
+
+        await scheduler.acquire(Priority.PLANNING)
+
+        tasks = [asyncio.ensure_future(take_slot(scheduler, priority, order)) for priority in (Priority.VOTING, Priority.REPAIR, Priority.VOTING, Priority.INTERACTIVE)]
+        await settle()
+
+        release = [Priority.PLANNING, Priority.INTERACTIVE, Priority.VOTING, Priority.VOTING]
+        for priority in release:
+            scheduler.release(priority)
+            await settle()
+
+        await asyncio.gather(*tasks)
+        return order
+
+    assert asyncio.run(scenario()) == [Priority.INTERACTIVE, Priority.VOTING, Priority.VOTING, Priority.REPAIR]
+
+def test_speculative_work_waits_for_the_votes():
+    async def scenario() -> list[Priority]:
+        scheduler = PriorityScheduler(capacity=1, shares=DEFAULT_SHARES, aging_sec=0)
+        order: list[Priority] = []
+
+        await scheduler.acquire(Priority.VOTING)
+
+        # Plans for the next step are requested before the votes that decide whether it happens
+        tasks = [asyncio.ensure_future(take_slot(scheduler, priority, order)) for priority in (Priority.SPECULATIVE, Priority.REPAIR, Priority.VOTING)]
+        await settle()
+
+        for priority in [Priority.VOTING, Priority.VOTING, Priority.REPAIR]:
+            scheduler.release(priority)
+            await settle()
+
+        await asyncio.gather(*tasks)
+        return order
+
+    assert asyncio.run(scenario()) == [Priority.VOTING, Priority.REPAIR, Priority.SPECULATIVE]
+
+def test_class_share_leaves_headroom():
+    async def scenario() -> None:
+        scheduler = PriorityScheduler(capacity=4, shares=DEFAULT_SHARES, aging_sec=0)
+        order: list[Priority] = []
+
+        tasks = [asyncio.ensure_future(take_slot(scheduler, Priority.VOTING, order)) for _ in range(4)]
+        await settle()
+
+        # Voting may only hold half of the slots
+        assert order == [Priority.VOTING] * 2
+        assert scheduler.get_metrics()[Priority.VOTING]["queued"] == 2
+
+        await asyncio.wait_for(scheduler.acquire(Priority.INTERACTIVE), timeout=1)
+
+        for task in tasks:
+            task.cancel()
+
+    asyncio.run(scenario())
+
+def test_aging_keeps_low_priority_work_moving():
+    async def scenario() -> list[Priority]:
+        scheduler = PriorityScheduler(capacity=1, shares=DEFAULT_SHARES, aging_sec=0.01)
+        order: list[Priority] = []
+
+        await scheduler.acquire(Priority.PLANNING)
+
+        repair = asyncio.ensure_future(take_slot(scheduler, Priority.REPAIR, order))
+        await asyncio.sleep(0.1)
+        interactive = asyncio.ensure_future(take_slot(scheduler, Priority.INTERACTIVE, order))
+        await settle()
+
+        scheduler.release(Priority.PLANNING)
+        await settle()
+        scheduler.release(order[0])
+        await asyncio.gather(repair, interactive)
+
+        return order
+
+    assert asyncio.run(scenario()) == [Priority.REPAIR, Priority.INTERACTIVE]
+
+def test_cancelled_waiter_gives_up_its_place():
+    async def scenario() -> None:
+        scheduler = PriorityScheduler(capacity=1, shares=DEFAULT_SHARES, aging_sec=0)
+        order: list[Priority] = []
+
+        await scheduler.acquire(Priority.PLANNING)
+
+        cancelled = asyncio.ensure_future(take_slot(scheduler, Priority.INTERACTIVE, order))
+        waiting = asyncio.ensure_future(take_slot(scheduler, Priority.VOTING, order))
+        await settle()
+
+        cancelled.cancel()
+        await settle()
+        scheduler.release(Priority.PLANNING)
+        await waiting
+
+        assert order == [Priority.VOTING]
+        assert scheduler.in_flight == 1
+
+    asyncio.run(scenario())
+
+def test_queue_wait_metrics():
+    async def scenario() -> list[dict]:
+        scheduler = PriorityScheduler(capacity=1, shares=DEFAULT_SHARES, aging_sec=0)
+
+        async with scheduler.slot(Priority.PLANNING):
+            waiter = asyncio.ensure_future(scheduler.acquire(Priority.VOTING))
+            await asyncio.sleep(0.05)
+
+        assert await waiter >= 0.04
+        return scheduler.get_metrics()
+
+    metrics = {row["priority"]: row for row in asyncio.run(scenario())}
+
+    assert metrics["voting"]["requests"] == 1
+    assert metrics["voting"]["wait_max_ms"] >= 40
+    assert metrics["interactive"]["wait_avg_ms"] is None
+
+def test_limiter_serves_waiters_by_priority():
+    async def acquire(limiter: AdaptiveLimiter, priority: Priority, order: list[Priority]) -> None:
+        await run_with_llm_priority(priority, limiter.acquire())
+        order.append(priority)
+
+    async def scenario() -> list[Priority]:
+        limiter = AdaptiveLimiter("http://stub.local", "stub-model", initial_limit=1, min_limit=1, max_limit=1, decrease=0.5)
+        order: list[Priority] = []
+
+        started_at = await limiter.acquire()
+        tasks = [asyncio.ensure_future(acquire(limiter, priority, order)) for priority in (Priority.REPAIR, Priority.INTERACTIVE)]
+        await settle()
+
+        limiter.release(started_at)
+        await settle()
+        limiter.release(started_at)
+        await asyncio.gather(*tasks)
+
+        return order
+
+    assert asyncio.run(scenario()) == [Priority.INTERACTIVE, Priority.REPAIR]
+
+@pytest.mark.parametrize("shares_str, voting_share, repair_share", [
+    ("", 0.5, 0.25),
+    ("voting=0.3", 0.3, 0.25),
+    ("voting=0.3, repair=2, bogus=1, planning=x", 0.3, 1.0),
+])
+def test_parse_shares(shares_str, voting_share, repair_share):
+    shares = parse_shares(shares_str)
+
+    assert shares[Priority.VOTING] == voting_share
+    assert shares[Priority.REPAIR] == repair_share
+    assert shares[Priority.PLANNING] == 0.75
@@ -0,0 +1,89 @@
+import sys
+import os
+import json
+
+import httpx
+import pytest
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "..")))
+
+from openai import AsyncOpenAI
+
+from utils.llm import llm_turns
+from utils.llm_telemetry import TelemetryAggregator, get_aggregator, load_events, set_llm_state
+
+
+@pytest.fixture(autouse=True)
+def telemetry_env(monkeypatch, tmp_path):
+    monkeypatch.setenv("OPENAI_MODEL", "stub-model")
+    monkeypatch.setenv("OPENAI_MAX_N", "1")
+    monkeypatch.setenv("LLM_TELEMETRY", "True")
+    monkeypatch.setenv("LLM_RETRY_BASE_SEC", "0.001")
+    monkeypatch.setenv("LLM_RETRY_CAP_SEC", "0.01")
+    monkeypatch.setenv("OUTPUT_DIR", str(tmp_path))
+
+    get_aggregator().clear()
+
+
+def test_aggregator_percentiles_per_state():
+    aggregator = TelemetryAggregator()
+
+    for i in range(1, 101):
+        aggregator.add({"state": "ToT.PlanVote", "latency_sec": float(i), "prompt_tokens": 10, "completion_tokens": 2})
+    aggregator.add({"state": "UI.Start", "latency_sec": 1.0, "error": "APIConnectionError"})
+
+    plan_vote, ui_start = aggregator.summary()
+
+    assert plan_vote["state"] == "ToT.PlanVote"
+    assert plan_vote["calls"] == 100
+    assert plan_vote["prompt_tokens"] == 1000
+    assert plan_vote["latency_p50"] == pytest.approx(50.5)
+    assert plan_vote["latency_p99"] == pytest.approx(99.01)
+    assert plan_vote["ttft_p50"] is None
+    assert ui_start["errors"] == 1
+
+def test_llm_calls_are_recorded_with_caller_state(tmp_path):
+    attempts = {"count": 0}
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        attempts["count"] += 1
+        if attempts["count"] == 1:
+            return httpx.Response(429, json={"error": {"message": "slow down"}})
+
+        request_json = json.loads(request.content)
+        return httpx.Response(200, json={
+            "id": "chatcmpl-stub", "object": "chat.completion", "created": 0, "model": request_json["model"],
+            "choices": [{"index": 0, "message": {"role": "assistant", "content": "ok"}, "finish_reason": "stop"}],
+            "usage": {"prompt_tokens": 12, "completion_tokens": 3, "total_tokens": 15},
+        })
+
+    client = AsyncOpenAI(api_key="test", base_url="http://telemetry.local/v1", max_retries=0,
+                         http_client=httpx.AsyncClient(transport=httpx.MockTransport(handler)))
+
+    set_llm_state("ToT", "PlanVote")
+    llm_turns(client, {"system": "sys", "messages": [{"role": "user", "content": "hi"}]}, stop_sequences=[], temperature=0.7, n=1)
+
+    [event] = list(load_events(str(tmp_path / "llm_telemetry.jsonl")))
+
+    assert event["state"] == "ToT.PlanVote"
+    assert event["model"] == "stub-model"
+    assert event["prompt_tokens"] == 12
+    assert event["completion_tokens"] == 3
+    assert event["retries"] == 1
+    assert event["finish_reasons"] == ["stop"]
+    assert event["latency_sec"] > 0
+    assert event["error"] is None
+
+    [row] = get_aggregator().summary()
+    assert row["state"] == "ToT.PlanVote" and row["calls"] == 1
+
+def test_vote_events_count_voters_not_calls():
+    aggregator = TelemetryAggregator()
+
+    aggregator.add({"event": "vote", "state": "ToT.PlanVote", "voters": 3, "voters_saved": 2})
+    aggregator.add({"event": "vote", "state": "ToT.PlanVote", "voters": 5, "voters_saved": 0})
+
+    [plan_vote] = aggregator.summary()
+
+    assert plan_vote["calls"] == 0
+    assert (plan_vote["voters"], plan_vote["voters_saved"]) == (8, 2)
@@ -0,0 +1,125 @@
+import sys
+import os
+import json
+
+import httpx
+import pytest
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "..")))
+
+from openai import AsyncOpenAI
+
+from utils.custom_exceptions import LLMContextOverflowError
+from utils.llm import llm_turns
+from utils.llm_tokens import get_context_window, get_token_counter, reset_token_counter, trim_longest_messages
+
+
+@pytest.fixture(autouse=True)
+def tokens_env(monkeypatch):
+    monkeypatch.setenv("OPENAI_MODEL", "stub-model")
+    monkeypatch.setenv("OPENAI_MAX_N", "1")
+    monkeypatch.setenv("LLM_TELEMETRY", "False")
+    monkeypatch.setenv("LLM_BUDGET", "False")
+    monkeypatch.setenv("LLM_TOKENIZER", "heuristic")
+    monkeypatch.setenv("LLM_CHARS_PER_TOKEN", "4")
+    monkeypatch.setenv("LLM_CONTEXT_WINDOW", "200")
+    monkeypatch.setenv("LLM_CONTEXT_RESERVE_TOKENS", "50")
+    monkeypatch.delenv("OPENAI_BASE_URLS", raising=False)
+
+    reset_token_counter()
+    yield
+    reset_token_counter()
+
+
+class StubServer:
+    """Answers every chat completion with "ok" and reports prompt_tokens as the given multiple of the prompt's characters."""
+    def __init__(self, tokens_per_char: float = 0.25) -> None:
+        self.tokens_per_char = tokens_per_char
+        self.requests: list[dict] = []
+
+    def __call__(self, request: httpx.Request) -> httpx.Response:
+        request_json = json.loads(request.content)
+        self.requests.append(request_json)
+
+        prompt_tokens = round(sum(len(message["content"]) for message in request_json["messages"]) * self.tokens_per_char)
+        return httpx.Response(200, json={
+            "id": "chatcmpl-stub",
+            "object": "chat.completion",
+            "created": 0,
+            "model": request_json["model"],
+            "choices": [{"index": 0, "message": {"role": "assistant", "content": "ok"}, "finish_reason": "stop"}],
+            "usage": {"prompt_tokens": prompt_tokens, "completion_tokens": 1, "total_tokens": prompt_tokens + 1},
+        })
+
+
+def stub_client(server: StubServer) -> AsyncOpenAI:
+    return AsyncOpenAI(api_key="test", base_url="http://stub.local/v1", max_retries=0,
+                       http_client=httpx.AsyncClient(transport=httpx.MockTransport(server)))
+
+def long_prompts() -> dict:
+    # About 300 tokens of history ahead of the current request and its prefill
+    return {"system": "sys", "messages": [{"role": "user", "content": "x" * 800},
+                                          {"role": "user", "content": "question"},
+                                          {"role": "assistant", "content": "y" * 400}]}
+
+
+def test_message_counts_are_cached_until_the_content_changes():
+    message = {"role": "user", "content": "a" * 40}
+    counter = get_token_counter()
+
+    assert counter.count_message(message) == 14
+    assert message["tokens"][2] == 14
+
+    message["tokens"][2] = 99
+    assert counter.count_message(message) == 99
+
+    message["content"] = "a" * 80
+    assert counter.count_message(message) == 24
+
+def test_calibration_follows_the_reported_prompt_tokens():
+    server = StubServer(tokens_per_char=0.5)
+    prompts = {"system": "", "messages": [{"role": "user", "content": "a" * 100}]}
+
+    llm_turns(stub_client(server), prompts, stop_sequences=[], temperature=0.7, n=1)
+
+    # 29 raw tokens (25 of text and 4 of overhead) were reported as 50
+    assert get_token_counter().get_scale("stub-model") == pytest.approx(50 / 29)
+
+def test_overflowing_prompt_fails_before_it_is_sent():
+    server = StubServer()
+
+    with pytest.raises(LLMContextOverflowError):
+        llm_turns(stub_client(server), long_prompts(), stop_sequences=[], temperature=0.7, n=3)
+
+    assert server.requests == []
+
+def test_trim_hook_cuts_the_history_down_to_fit():
+    server = StubServer()
+    prompts = long_prompts()
+
+    assert llm_turns(stub_client(server), prompts, stop_sequences=[], temperature=0.7, n=2, trim=trim_longest_messages) == ["ok", "ok"]
+
+    sent = server.requests[0]["messages"]
+    assert sum(len(message["content"]) for message in sent) / 4 <= 150
+    assert "[... truncated ...]" in sent[1]["content"]
+    # The last two messages, the request and its prefill in a ToT prompt, are never cut
+    assert sent[3]["content"] == "y" * 400
+
+    # The caller's messages are left as they were
+    assert prompts["messages"][0]["content"] == "x" * 800
+
+def test_trim_hook_that_cannot_cut_enough_still_fails():
+    server = StubServer()
+    prompts = {"system": "s" * 1000, "messages": [{"role": "user", "content": "question"}]}
+
+    with pytest.raises(LLMContextOverflowError):
+        llm_turns(stub_client(server), prompts, stop_sequences=[], temperature=0.7, n=1, trim=trim_longest_messages)
+
+    assert server.requests == []
+
+def test_context_window_defaults(monkeypatch):
+    monkeypatch.delenv("LLM_CONTEXT_WINDOW")
+
+    assert get_context_window("claude-3-5-sonnet-20241022") == 200000
+    assert get_context_window("gpt-4o-mini") == 128000
+    assert get_context_window("local-model") is None
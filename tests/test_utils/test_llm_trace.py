@@ -0,0 +1,116 @@
+import sys
+import os
+import json
+
+import httpx
+import pytest
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "..")))
+
+from openai import AsyncOpenAI
+
+from utils.llm import llm_turns, stream_llm_turn
+from utils.llm_budget import reset_generation_budgets
+from utils.llm_trace import reset_llm_trace
+
+
+def chat_completion(request_json: dict, counter: list[int]) -> dict:
+    counter[0] += 1
+
+    return {
+        "id": "chatcmpl-stub",
+        "object": "chat.completion",
+        "created": 0,
+        "model": request_json["model"],
+        "choices": [{"index": 0,
+                     "message": {"role": "assistant", "content": f"{request_json['messages'][-1]['content']}-{counter[0]}"},
+                     "finish_reason": "stop"}],
+        "usage": {"prompt_tokens": 1, "completion_tokens": 1, "total_tokens": 2},
+    }
+
+def stub_openai_client(handler) -> AsyncOpenAI:
+    return AsyncOpenAI(api_key="test",
+                       base_url="http://stub.local/v1",
+                       max_retries=0,
+                       http_client=httpx.AsyncClient(transport=httpx.MockTransport(handler)))
+
+def offline_handler(request: httpx.Request) -> httpx.Response:
+    raise AssertionError("replay must not reach the network")
+
+@pytest.fixture(autouse=True)
+def trace_env(monkeypatch, tmp_path):
+    monkeypatch.setenv("OPENAI_MODEL", "stub-model")
+    monkeypatch.setenv("OPENAI_MAX_N", "1")
+    monkeypatch.setenv("LLM_TELEMETRY", "False")
+    monkeypatch.setenv("LLM_TRACE_PATH", str(tmp_path / "trace.jsonl"))
+    monkeypatch.setenv("LLM_REPLAY_LATENCY_SEC", "0")
+    monkeypatch.setenv("LLM_REFILL_ATTEMPTS", "0")
+
+    reset_llm_trace()
+    reset_generation_budgets()
+    yield
+    reset_llm_trace()
+    reset_generation_budgets()
+
+
+def test_record_then_replay_offline(monkeypatch, tmp_path):
+    counter = [0]
+    prompts = {"system": "sys", "messages": [{"role": "user", "content": "hi"}]}
+
+    monkeypatch.setenv("LLM_BACKEND", "record")
+    client = stub_openai_client(lambda request: httpx.Response(200, json=chat_completion(json.loads(request.content), counter)))
+    recorded = llm_turns(client, prompts, stop_sequences=[], temperature=0.7, n=3)
+
+    assert sorted(recorded) == ["hi-1", "hi-2", "hi-3"]
+    assert len((tmp_path / "trace.jsonl").read_text().splitlines()) == 3
+
+    monkeypatch.setenv("LLM_BACKEND", "replay")
+    replayed = llm_turns(stub_openai_client(offline_handler), prompts, stop_sequences=[], temperature=0.7, n=3)
+
+    # Identical requests get the recorded responses back, each one once
+    assert sorted(replayed) == sorted(recorded)
+
+def test_record_then_replay_with_generation_budgets(monkeypatch):
+    monkeypatch.setenv("LLM_BUDGET", "True")
+    monkeypatch.setenv("LLM_BUDGET_MIN_SAMPLES", "1")
+
+    counter = [0]
+    prompts = {"system": "sys", "messages": [{"role": "user", "content": "hi"}]}
+
+    monkeypatch.setenv("LLM_BACKEND", "record")
+    client = stub_openai_client(lambda request: httpx.Response(200, json=chat_completion(json.loads(request.content), counter)))
+    recorded = [llm_turns(client, prompts, stop_sequences=[], temperature=0.0, n=1) for _ in range(3)]
+
+    # A cap learned from the recorded calls would change the key of every replayed one
+    monkeypatch.setenv("LLM_BACKEND", "replay")
+    replayed = [llm_turns(stub_openai_client(offline_handler), prompts, stop_sequences=[], temperature=0.0, n=1) for _ in range(3)]
+
+    assert replayed == recorded == [["hi-1"], ["hi-2"], ["hi-3"]]
+
+def test_replay_miss_drops_the_call(monkeypatch, tmp_path):
+    (tmp_path / "trace.jsonl").write_text("")
+    monkeypatch.setenv("LLM_BACKEND", "replay")
+
+    prompts = {"system": "sys", "messages": [{"role": "user", "content": "never recorded"}]}
+
+    assert llm_turns(stub_openai_client(offline_handler), prompts, stop_sequences=[], temperature=0.7, n=1) == []
+
+def test_stream_record_then_replay(monkeypatch):
+    def handler(request: httpx.Request) -> httpx.Response:
+        events = ""
+        for delta in ["<plan>step", " one</pl", "an>", "runaway"]:
+            chunk = {"id": "chatcmpl-stub", "object": "chat.completion.chunk", "created": 0, "model": "stub-model",
+                     "choices": [{"index": 0, "delta": {"content": delta}, "finish_reason": None}]}
+            events += f"data: {json.dumps(chunk)}\n\n"
+        events += "data: [DONE]\n\n"
+        return httpx.Response(200, headers={"content-type": "text/event-stream"}, content=events.encode())
+
+    prompts = {"system": "sys", "messages": [{"role": "user", "content": "hi"}]}
+
+    monkeypatch.setenv("LLM_BACKEND", "record")
+    recorded = "".join(stream_llm_turn(stub_openai_client(handler), prompts, stop_sequences=["</plan>"], temperature=0.7))
+
+    monkeypatch.setenv("LLM_BACKEND", "replay")
+    replayed = "".join(stream_llm_turn(stub_openai_client(offline_handler), prompts, stop_sequences=["</plan>"], temperature=0.7))
+
+    assert recorded == replayed == "<plan>step one"
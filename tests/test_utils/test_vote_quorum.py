@@ -0,0 +1,128 @@
+import sys
+import os
+
+import pytest
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "..")))
+
+from agents.tot.quorum import ExecVoteQuorum, RankingVoteQuorum, get_vote_waves, prob_better
+
+
+@pytest.fixture(autouse=True)
+def quorum_env(monkeypatch):
+    monkeypatch.setenv("VOTE_QUORUM", "True")
+
+
+def exec_vote(complete: str, error: str) -> str:
+    return f"<complete>{complete}</complete>\n<error>{error}</error>\n"
+
+def ranking_vote(best: int, worst: int) -> str:
+    return f"<best_candidate>{best}</best_candidate>\n<worst_candidate>{worst}</worst_candidate>\n"
+
+
+@pytest.mark.parametrize("votes, decided", [
+    ([("yes", "no")] * 2, False),
+    ([("yes", "no")] * 3, True),
+    # Complete can no longer win and error already has its majority
+    ([("no", "yes")] * 3, True),
+    # Complete can no longer win but error still could
+    ([("no", "no"), ("no", "no"), ("no", "yes")], False),
+    ([("no", "no")] * 3, True),
+])
+def test_exec_vote_quorum(votes, decided):
+    quorum = ExecVoteQuorum(voter_count=5)
+
+    assert quorum({i: exec_vote(*vote) for i, vote in enumerate(votes)}) == decided
+
+def test_exec_vote_quorum_ignores_unreadable_votes():
+    quorum = ExecVoteQuorum(voter_count=3)
+
+    assert not quorum({0: exec_vote("yes", "no"), 1: "<complete>maybe"})
+    assert quorum({0: exec_vote("yes", "no"), 1: "<complete>maybe", 2: exec_vote("yes", "no")})
+
+def test_ranking_vote_quorum_maps_shuffled_indices():
+    # Every voter saw the candidates in a different order, but all picked absolute candidate 2 as best and 0 as worst
+    index_maps = [[2, 0, 1], [0, 1, 2], [1, 2, 0], [2, 1, 0]]
+    votes = {0: ranking_vote(1, 2), 1: ranking_vote(3, 1), 2: ranking_vote(2, 3)}
+
+    quorum = RankingVoteQuorum(voter_count=4, candidate_count=3, index_maps=index_maps)
+
+    # After three votes candidate 2 leads the runner-up by 3, and the one outstanding vote can close that by at most 2
+    assert not quorum({i: votes[i] for i in (0, 1)})
+    assert quorum(votes)
+    assert quorum.voter_indices() == [0, 1, 2]
+
+def test_ranking_vote_quorum_can_be_disabled(monkeypatch):
+    monkeypatch.setenv("VOTE_QUORUM", "False")
+
+    quorum = RankingVoteQuorum(voter_count=1, candidate_count=2, index_maps=[[0, 1]])
+
+    assert not quorum({0: ranking_vote(1, 2)})
+    assert quorum.ordered_votes() == [ranking_vote(1, 2)]
+
+def test_exec_vote_agreement():
+    quorum = ExecVoteQuorum(voter_count=5)
+    quorum({0: exec_vote("yes", "no"), 1: exec_vote("yes", "no"), 2: exec_vote("no", "yes"), 3: "unreadable"})
+
+    assert quorum.agreement() == pytest.approx(2 / 3)
+
+def test_ranking_vote_agreement_is_on_original_candidate_indices():
+    # Both voters pick the same candidate, shown to them at different positions
+    quorum = RankingVoteQuorum(voter_count=2, candidate_count=3, index_maps=[[0, 1, 2], [2, 0, 1]])
+    quorum({0: ranking_vote(best=1, worst=2), 1: ranking_vote(best=2, worst=3)})
+
+    assert quorum.agreement() == 1.0
+
+def test_agreement_without_readable_votes():
+    quorum = ExecVoteQuorum(voter_count=3)
+    quorum({0: "unreadable"})
+
+    assert quorum.agreement() == 0.0
+
+def test_listener_sees_every_vote_even_without_quorum(monkeypatch):
+    monkeypatch.setenv("VOTE_QUORUM", "False")
+    quorum = ExecVoteQuorum(voter_count=3)
+    seen = []
+    quorum.listener = lambda votes: seen.append(sorted(votes))
+
+    assert not quorum({0: exec_vote("yes", "no")})
+    assert not quorum({0: exec_vote("yes", "no"), 2: exec_vote("yes", "no")})
+    assert seen == [[0], [0, 2]]
+
+def test_vote_waves(monkeypatch):
+    monkeypatch.setenv("VOTE_ADAPTIVE_MIN_VOTERS", "2")
+    monkeypatch.setenv("VOTE_ADAPTIVE_WAVE_SIZE", "2")
+
+    assert get_vote_waves(5) == [2, 2, 1]
+    assert get_vote_waves(1) == [1]
+
+def test_prob_better():
+    assert prob_better(0, 0) == pytest.approx(0.5)
+    assert prob_better(2, 0) == pytest.approx(0.875)
+    assert prob_better(3, 0) == pytest.approx(0.9375)
+    assert prob_better(2, 2) == pytest.approx(0.5)
+
+def test_clear_leader_is_separated_after_two_or_three_votes():
+    # Between two candidates every vote is two comparisons, so two unanimous ones are four wins and enough
+    quorum = RankingVoteQuorum(voter_count=5, candidate_count=2, index_maps=[[0, 1]] * 5)
+    quorum({0: ranking_vote(1, 2), 1: ranking_vote(1, 2)})
+
+    assert not quorum.is_decided()
+    assert quorum.is_separated(0.9)
+
+    # With a third candidate taking the worst votes only the best votes compare the leader with the runner-up
+    quorum = RankingVoteQuorum(voter_count=5, candidate_count=3, index_maps=[[0, 1, 2]] * 5)
+    quorum({0: ranking_vote(1, 3), 1: ranking_vote(1, 3)})
+
+    assert not quorum.is_separated(0.9)
+    quorum({0: ranking_vote(1, 3), 1: ranking_vote(1, 3), 2: ranking_vote(1, 3)})
+    assert quorum.is_separated(0.9)
+
+def test_split_vote_is_not_separated():
+    index_maps = [[0, 1, 2]] * 5
+    quorum = RankingVoteQuorum(voter_count=5, candidate_count=3, index_maps=index_maps)
+
+    quorum({0: ranking_vote(1, 3), 1: ranking_vote(2, 3), 2: "unreadable"})
+
+    assert not quorum.is_separated(0.9)
+    assert not ExecVoteQuorum(voter_count=3).is_separated(0.9)
@@ -0,0 +1,85 @@
+import sys
+import os
+
+import numpy as np
+import pytest
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "..")))
+
+from agents.tot.quorum import FullRankingVoteQuorum
+from agents.tot.ranking import aggregate, borda_scores, bradley_terry, get_positions, leader_confidence, pairwise_wins, parse_ranking
+
+
+@pytest.fixture(autouse=True)
+def ranking_env(monkeypatch):
+    monkeypatch.setenv("VOTE_QUORUM", "True")
+
+
+def ranking_vote(*numbers: int) -> str:
+    return f"<ranking>{', '.join(map(str, numbers))}</ranking>\n"
+
+
+@pytest.mark.parametrize("ranking, parsed", [
+    ("3, 1, 2", [2, 0, 1]),
+    ("3 > 1 > 2", [2, 0, 1]),
+    # Out of range and repeated numbers are dropped
+    ("3, 3, 7, 1", [2, 0]),
+    ("1", None),
+    (None, None),
+])
+def test_parse_ranking(ranking, parsed):
+    assert parse_ranking(ranking, 3) == parsed
+
+def test_positions_map_shuffled_rankings_to_original_candidates():
+    # Both voters rank original candidate 2 first and 0 last, shown to them in different orders
+    positions = get_positions([[0, 1, 2], [1, 0, 2]], [[2, 1, 0], [1, 2, 0]], 3)
+
+    assert positions.tolist() == [[2, 1, 0], [2, 1, 0]]
+
+def test_unranked_candidates_share_the_last_positions():
+    positions = get_positions([[1, 0]], [[0, 1, 2, 3]], 4)
+
+    assert positions.tolist() == [[1, 0, 2.5, 2.5]]
+
+def test_borda_and_pairwise_wins():
+    positions = get_positions([[0, 1, 2], [0, 2, 1], [1, 0, 2]], [[0, 1, 2]] * 3, 3)
+
+    assert borda_scores(positions).tolist() == [5, 3, 1]
+    assert pairwise_wins(positions).tolist() == [[0, 2, 3], [1, 0, 2], [0, 1, 0]]
+
+def test_bradley_terry_orders_candidates_by_wins():
+    positions = get_positions([[0, 1, 2], [0, 2, 1], [1, 0, 2]], [[0, 1, 2]] * 3, 3)
+    log_strengths = bradley_terry(pairwise_wins(positions))
+
+    assert np.argsort(-log_strengths).tolist() == [0, 1, 2]
+    assert log_strengths.mean() == pytest.approx(0.0)
+
+def test_confidence_grows_with_agreeing_voters():
+    confidences = []
+    for voter_count in (1, 2, 3):
+        positions = get_positions([[0, 1, 2, 3, 4]] * voter_count, [[0, 1, 2, 3, 4]] * voter_count, 5)
+        confidences.append(leader_confidence(pairwise_wins(positions), aggregate(positions, "bradley_terry")))
+
+    assert confidences == sorted(confidences)
+    assert confidences[-1] > 0.85
+
+def test_split_voters_leave_the_leader_uncertain():
+    positions = get_positions([[0, 1, 2], [1, 0, 2]], [[0, 1, 2]] * 2, 3)
+
+    assert leader_confidence(pairwise_wins(positions), aggregate(positions, "bradley_terry")) == pytest.approx(0.5)
+
+def test_borda_quorum_stops_once_the_leader_cannot_be_overtaken():
+    quorum = FullRankingVoteQuorum(voter_count=3, candidate_count=3, index_maps=[[0, 1, 2]] * 3, method="borda")
+
+    # After two votes candidate 0 leads by 2, and the last vote can swing the lead by 2
+    assert not quorum({0: ranking_vote(1, 2, 3), 1: ranking_vote(1, 2, 3)})
+
+    quorum = FullRankingVoteQuorum(voter_count=3, candidate_count=3, index_maps=[[0, 1, 2]] * 3, method="borda")
+    assert quorum({0: ranking_vote(1, 2, 3), 1: ranking_vote(1, 3, 2)})
+
+def test_bradley_terry_quorum_ends_only_through_the_sequential_test():
+    quorum = FullRankingVoteQuorum(voter_count=5, candidate_count=2, index_maps=[[0, 1]] * 5, method="bradley_terry")
+
+    assert not quorum({i: ranking_vote(1, 2) for i in range(4)})
+    assert quorum.is_separated(0.9)
+    assert quorum.agreement() == 1.0
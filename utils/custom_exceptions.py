@@ -47,4 +47,19 @@ class APIKeyError(Exception):
 class TestError(Exception):
     def __init__(self, message):
         self.message = message
-        super().__init__(self.message)
\ No newline at end of file
+        super().__init__(self.message)
+
+class LLMReplayMissError(Exception):
+    def __init__(self, message):
+        self.message = message
+        super().__init__(self.message)
+
+class LLMCancelledError(Exception):
+    def __init__(self, message):
+        self.message = message
+        super().__init__(self.message)
+
+class LLMContextOverflowError(Exception):
+    def __init__(self, message):
+        self.message = message
+        super().__init__(self.message)
@@ -2,7 +2,8 @@ from typing import Literal, Any, Dict, Union
 
 NestedStrDict = Dict[str, Union[str, 'NestedStrDict', None]]
 
-Message = dict[Literal['role', 'content', 'timestamp'], str]
+# 'tokens' caches the message's token count - see utils.llm_tokens
+Message = dict[Literal['role', 'content', 'timestamp', 'tokens'], Any]
 PromptsDict = dict[Literal['system', 'messages'], str | list[Message]]
 
 StrScoresDict = dict[str, dict[str, str]]
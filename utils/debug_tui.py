@@ -17,6 +17,10 @@ from utils.files import (
     read_persistent_notes,
     write_persistent_note,
 )
+from utils.llm_limiter import get_limiter_metrics
+from utils.llm_pool import get_pool_metrics
+from utils.llm_scheduler import get_scheduler_metrics
+from utils.llm_telemetry import print_llm_telemetry_summary
 
 
 class DebugTUI:
@@ -43,13 +47,14 @@ class DebugTUI:
             table.add_row("2", "Vector Store", "Display, modify, or clear Chroma vector store contents")
             table.add_row("3", "Agent Registry", "Display, modify, or clear registered agents and tasks")
             table.add_row("4", "Conversation History", "Display, modify, or clear agent conversation histories")
-            table.add_row("5", "Exit Debugger", "Return to APEX prompt")
+            table.add_row("5", "LLM Traffic", "Display concurrency limits and per-state latency percentiles")
+            table.add_row("6", "Exit Debugger", "Return to APEX prompt")
 
             self.console.print(table)
             choice = Prompt.ask(
                 "\n[bold green]Select an option[/bold green]",
-                choices=["1", "2", "3", "4", "5"],
-                default="5",
+                choices=["1", "2", "3", "4", "5", "6"],
+                default="6",
             )
 
             if choice == "1":
@@ -61,9 +66,56 @@ class DebugTUI:
             elif choice == "4":
                 self.manage_conversation_history()
             elif choice == "5":
+                self.show_llm_traffic()
+            elif choice == "6":
                 self.console.print("[yellow]Exiting Debug TUI...[/yellow]\n")
                 break
 
+    def show_llm_traffic(self) -> None:
+        self.console.clear()
+
+        metrics = get_limiter_metrics()
+        if not metrics:
+            self.console.print(Panel("[italic yellow]No LLM requests have been made yet.[/italic yellow]", border_style="yellow"))
+        else:
+            table = Table(title="LLM Concurrency Limits", show_header=True, header_style="bold magenta")
+            for column in ["Endpoint", "Model", "Limit", "In Flight", "Queued", "Successes", "Overloads", "Errors"]:
+                table.add_column(column)
+
+            for row in metrics:
+                table.add_row(row["endpoint"], row["model"], f"{row['limit']:.2f}", str(row["in_flight"]), str(row["queue_depth"]),
+                              str(row["successes"]), str(row["overloads"]), str(row["errors"]))
+
+            self.console.print(table)
+
+        pool_metrics = get_pool_metrics()
+        if pool_metrics:
+            table = Table(title="LLM Endpoint Pool", show_header=True, header_style="bold magenta")
+            for column in ["Endpoint", "Healthy", "Outstanding", "Requests", "Failures", "Ejections"]:
+                table.add_column(column)
+
+            for row in pool_metrics:
+                table.add_row(row["endpoint"], "[green]yes[/green]" if row["healthy"] else "[red]no[/red]", str(row["outstanding"]),
+                              str(row["requests"]), str(row["failures"]), str(row["ejections"]))
+
+            self.console.print(table)
+
+        scheduler_metrics = get_scheduler_metrics()
+        if scheduler_metrics:
+            table = Table(title="LLM Priority Classes", show_header=True, header_style="bold magenta")
+            for column in ["Priority", "Limit", "In Flight", "Queued", "Requests", "Avg Wait (ms)", "p95 Wait (ms)", "Max Wait (ms)"]:
+                table.add_column(column)
+
+            for row in scheduler_metrics:
+                table.add_row(row["priority"], str(row["limit"]), str(row["in_flight"]), str(row["queued"]), str(row["requests"]),
+                              *(f"{row[key]:.1f}" if row[key] is not None else "-" for key in ("wait_avg_ms", "wait_p95_ms", "wait_max_ms")))
+
+            self.console.print(table)
+
+        print_llm_telemetry_summary()
+
+        Prompt.ask("\nPress Enter to continue")
+
     def manage_persistent_notes(self) -> None:
         while True:
             self.console.clear()
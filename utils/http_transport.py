@@ -0,0 +1,91 @@
+import os
+import atexit
+import threading
+from typing import Optional
+
+import httpx
+
+from utils.console_io import debug_print as dprint
+
+try:
+    import h2  # noqa: F401 - httpx only needs it to be importable
+    HTTP2_AVAILABLE = True
+except ImportError:
+    HTTP2_AVAILABLE = False
+
+
+PRINT_PREFIX = "[bold][HTTP][/bold]"
+
+
+# One pooled client per process (and one async client for the LLM event loop), so every outbound call
+# reuses warm TCP/TLS connections instead of paying for a fresh handshake
+_http_client: Optional[httpx.Client] = None
+_async_http_client: Optional[httpx.AsyncClient] = None
+_http_clients_lock = threading.Lock()
+
+
+def get_ssl_verify() -> str | bool:
+    """Returns the CUSTOM_SSL_CERT CA bundle path if it exists, otherwise the system default."""
+    ca_cert_path = os.environ.get("CUSTOM_SSL_CERT")
+    return ca_cert_path if ca_cert_path and os.path.exists(ca_cert_path) else True
+
+def get_cert_mode() -> str:
+    ca_cert_path = os.environ.get("CUSTOM_SSL_CERT")
+    if not ca_cert_path:
+        return "system-default"
+
+    return f"custom:{ca_cert_path}" if os.path.exists(ca_cert_path) else f"missing-path:{ca_cert_path}"
+
+def use_http2() -> bool:
+    if os.environ.get("HTTP2", "True").lower() != "true":
+        return False
+
+    if not HTTP2_AVAILABLE:
+        dprint(f"{PRINT_PREFIX} HTTP2 is enabled but the h2 package is not installed - falling back to HTTP/1.1")
+        return False
+
+    return True
+
+def get_timeout() -> httpx.Timeout:
+    return httpx.Timeout(connect=float(os.environ.get("HTTP_CONNECT_TIMEOUT_SEC", "10")),
+                         read=float(os.environ.get("HTTP_READ_TIMEOUT_SEC", "600")),
+                         write=float(os.environ.get("HTTP_WRITE_TIMEOUT_SEC", "60")),
+                         pool=float(os.environ.get("HTTP_POOL_TIMEOUT_SEC", "600")))
+
+def get_limits() -> httpx.Limits:
+    return httpx.Limits(max_connections=int(os.environ.get("HTTP_MAX_CONNECTIONS", "64")),
+                        max_keepalive_connections=int(os.environ.get("HTTP_MAX_KEEPALIVE_CONNECTIONS", "32")),
+                        keepalive_expiry=float(os.environ.get("HTTP_KEEPALIVE_EXPIRY_SEC", "60")))
+
+def get_http_client() -> httpx.Client:
+    """Returns the process-wide pooled client for synchronous calls. httpx.Client is safe to share across threads."""
+    global _http_client
+
+    with _http_clients_lock:
+        if _http_client is None or _http_client.is_closed:
+            http2 = use_http2()
+            _http_client = httpx.Client(verify=get_ssl_verify(), http2=http2, timeout=get_timeout(), limits=get_limits())
+            dprint(f"{PRINT_PREFIX} created pooled HTTP client (http2: {http2}, cert: {get_cert_mode()})")
+
+    return _http_client
+
+def get_async_http_client() -> httpx.AsyncClient:
+    """
+    Returns the process-wide pooled client for asynchronous calls.
+    Its connections belong to the event loop that first uses them, so it must only be used from the LLM event loop.
+    """
+    global _async_http_client
+
+    with _http_clients_lock:
+        if _async_http_client is None or _async_http_client.is_closed:
+            http2 = use_http2()
+            _async_http_client = httpx.AsyncClient(verify=get_ssl_verify(), http2=http2, timeout=get_timeout(), limits=get_limits())
+            dprint(f"{PRINT_PREFIX} created pooled async HTTP client (http2: {http2}, cert: {get_cert_mode()})")
+
+    return _async_http_client
+
+@atexit.register
+def close_http_client() -> None:
+    with _http_clients_lock:
+        if _http_client is not None and not _http_client.is_closed:
+            _http_client.close()
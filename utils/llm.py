@@ -1,23 +1,41 @@
 import time
-from typing import Iterable, Optional
+from typing import Any, AsyncIterator, Awaitable, Callable, Coroutine, Iterable, Iterator, Optional, TypeVar
 
 import os
-import backoff
+import json
 
-import concurrent.futures
+import asyncio
+import threading
+from contextlib import aclosing
+from queue import Queue
 
 from utils.constants import CLIENT_VERSION
-from utils.custom_exceptions import LLMAPIInternalServerError, LLMAPIRateLimitError
 from utils.custom_types import Message, PromptsDict
+from utils.http_transport import get_async_http_client
+from utils.llm_batch import get_chat_template, is_unsupported, mark_unsupported, supports_batching, use_batching
+from utils.llm_batch_api import get_batch_api, run_batch, use_batch_api
+from utils.llm_budget import TRUNCATED_FINISH_REASONS, Completions, call_with_generation_budget, get_generation_budgets
+from utils.llm_cache import LLMCache, get_llm_cache
+from utils.llm_cancel import CancelToken
+from utils.llm_hedge import get_hedger
+from utils.llm_limiter import AdaptiveLimiter, get_limiter, get_limiter_metrics
+from utils.llm_pool import use_endpoint
+from utils.llm_retry import call_with_retries, get_status_code, is_retryable
+from utils.llm_routing import ModelSpec, get_provider, get_state_route, resolve_model
+from utils.llm_scheduler import Priority, get_llm_priority, get_scheduler, run_with_llm_priority, use_llm_priority
+from utils.llm_telemetry import CallTelemetry, get_llm_state, use_llm_state
+from utils.llm_tokens import TrimHook, check_context, get_token_counter
+from utils.llm_trace import get_llm_backend, get_llm_trace
 
-from anthropic import Anthropic
+from anthropic import Anthropic, AsyncAnthropic
 from anthropic.types import Message as AnthropicMessage
 from anthropic.types import ContentBlock as AnthropicContentBlock
 from anthropic.types import TextBlock as AnthropicTextBlock
 from anthropic.types import MessageParam as AnthropicMessageParam
-from anthropic import RateLimitError, InternalServerError
+from anthropic.types import TextBlockParam as AnthropicTextBlockParam
+from anthropic.types import CacheControlEphemeralParam
 
-from openai import OpenAI
+from openai import OpenAI, AsyncOpenAI
 from openai.types.chat.chat_completion import ChatCompletion as OpenAIChatCompletion
 from openai.types.chat.chat_completion_message import ChatCompletionMessage as OpenAIChatCompletionMessage
 from openai.types.chat.chat_completion_message_param import ChatCompletionMessageParam
@@ -25,6 +43,7 @@ from openai.types.chat.chat_completion_user_message_param import ChatCompletionU
 from openai.types.chat.chat_completion_assistant_message_param import ChatCompletionAssistantMessageParam
 from openai.types.chat.chat_completion_system_message_param import ChatCompletionSystemMessageParam
 from openai.types.chat.chat_completion import Choice
+from openai.types.completion import Completion as OpenAICompletion
 
 from rich import print as rprint
 from utils.console_io import debug_print as dprint
@@ -34,12 +53,146 @@ from utils.enums import Role
 
 PRINT_PREFIX = "[bold][LLM][/bold]"
 
+LLM_MAX_IN_FLIGHT = int(os.environ.get("LLM_MAX_IN_FLIGHT", "16"))
 
-def cast_messages_anthropic(messages: Iterable[Message]) -> list[AnthropicMessageParam]:
+LLM_REFILL_ATTEMPTS = int(os.environ.get("LLM_REFILL_ATTEMPTS", "2"))
+
+OPENAI_CHUNK_CONCURRENCY = int(os.environ.get("OPENAI_CHUNK_CONCURRENCY", "8"))
+OPENAI_MAX_N_PROBE = int(os.environ.get("OPENAI_MAX_N_PROBE", "8"))
+
+MAX_N_CACHE_FILENAME = "openai_max_n.json"
+
+T = TypeVar("T")
+
+SyncClient = Anthropic | OpenAI
+AsyncClient = AsyncAnthropic | AsyncOpenAI
+
+# Called with the {index: text} results received so far; returning True ends the fan-out early
+Quorum = Callable[[dict[int, str]], bool]
+
+
+# All LLM traffic runs on one long-lived event loop in a daemon thread, so fan-out
+# stages share a bounded pool of in-flight requests instead of building a thread
+# pool per call
+_llm_loop: Optional[asyncio.AbstractEventLoop] = None
+_llm_loop_thread: Optional[threading.Thread] = None
+_llm_loop_lock = threading.Lock()
+
+_async_clients: dict[int, tuple[SyncClient, AsyncClient]] = {}
+_async_clients_lock = threading.Lock()
+
+_openai_max_n: dict[str, int] = {}
+_openai_max_n_lock: Optional[asyncio.Lock] = None
+
+
+def get_llm_loop() -> asyncio.AbstractEventLoop:
+    global _llm_loop, _llm_loop_thread
+
+    with _llm_loop_lock:
+        if _llm_loop is None or _llm_loop.is_closed():
+            _llm_loop = asyncio.new_event_loop()
+            _llm_loop_thread = threading.Thread(target=_llm_loop.run_forever, name="llm-loop", daemon=True)
+            _llm_loop_thread.start()
+            dprint(f"{PRINT_PREFIX} started LLM event loop (max in flight: {LLM_MAX_IN_FLIGHT})")
+
+    return _llm_loop
+
+def run_on_llm_loop(coro: Coroutine[Any, Any, T]) -> T:
+    """Blocks the calling thread until coro has completed on the LLM event loop."""
+    loop = get_llm_loop()
+
+    if threading.current_thread() is _llm_loop_thread:
+        coro.close()
+        error_message = f"{PRINT_PREFIX} synchronous LLM call made from the LLM event loop - use the async variant instead"
+        rprint(f"[red][bold]{error_message}[/bold][/red]")
+        raise RuntimeError(error_message)
+
+    future = asyncio.run_coroutine_threadsafe(run_in_llm_state(get_llm_state(), coro), loop)
+
+    try:
+        return future.result()
+    except BaseException:
+        # e.g. a KeyboardInterrupt in the waiting thread - the calls must not keep running without a caller
+        future.cancel()
+        raise
+
+async def await_on_llm_loop(coro: Coroutine[Any, Any, T]) -> T:
+    """Awaits coro on the LLM event loop from any other event loop. Cancelling the caller cancels coro."""
+    loop = get_llm_loop()
+
+    if asyncio.get_running_loop() is loop:
+        return await coro
+
+    return await asyncio.wrap_future(asyncio.run_coroutine_threadsafe(run_in_llm_state(get_llm_state(), coro), loop))
+
+async def run_in_llm_state(state: str, coro: Coroutine[Any, Any, T]) -> T:
+    # Context variables do not follow a coroutine onto another thread's loop, so the caller's
+    # agent state is carried over explicitly for telemetry
+    use_llm_state(state)
+    return await coro
+
+def get_async_client(client: SyncClient | AsyncClient) -> AsyncClient:
+    if isinstance(client, (AsyncAnthropic, AsyncOpenAI)):
+        return client
+
+    with _async_clients_lock:
+        cached = _async_clients.get(id(client))
+        if cached is not None and cached[0] is client:
+            return cached[1]
+
+        # Retries are owned by utils.llm_retry, so the SDKs' own retries are turned off
+        if isinstance(client, Anthropic):
+            async_client: AsyncClient = AsyncAnthropic(api_key=client.api_key,
+                                                       base_url=client.base_url,
+                                                       timeout=client.timeout,
+                                                       max_retries=0,
+                                                       http_client=get_async_http_client())
+        elif isinstance(client, OpenAI):
+            async_client = AsyncOpenAI(api_key=client.api_key,
+                                       organization=client.organization,
+                                       base_url=client.base_url,
+                                       timeout=client.timeout,
+                                       max_retries=0,
+                                       http_client=get_async_http_client())
+        else:
+            error_message = f"{PRINT_PREFIX} expected client to be Anthropic or OpenAI, got {type(client)} instead"
+            rprint(f"[red][bold]{error_message}[/bold][/red]")
+            raise TypeError(error_message)
+
+        _async_clients[id(client)] = (client, async_client)
+
+    return async_client
+
+
+def use_prompt_caching() -> bool:
+    return os.environ.get("ANTHROPIC_PROMPT_CACHING", "True").lower() == "true"
+
+def get_cache_breakpoint(messages: list[Message]) -> Optional[int]:
+    """
+    Returns the index of the last stable history message - the one just before the final user turn.
+    Everything up to it is shared by every candidate of a stage and by the next stage, so it is worth caching.
+    """
+    user_indices = [i for i, message in enumerate(messages) if message['role'] == 'user']
+    if not user_indices or user_indices[-1] == 0:
+        return None
+
+    return user_indices[-1] - 1
+
+def cast_system_anthropic(system: str) -> str | list[AnthropicTextBlockParam]:
+    if not use_prompt_caching() or not system:
+        return system
+
+    return [AnthropicTextBlockParam(type="text", text=system, cache_control=CacheControlEphemeralParam(type="ephemeral"))]
+
+def cast_messages_anthropic(messages: Iterable[Message], cache_breakpoint: Optional[int] = None) -> list[AnthropicMessageParam]:
     casted_messages = []
-    for message in messages:
+    for i, message in enumerate(messages):
         if message['role'] == 'user' or message['role'] == 'assistant':
-            casted_messages.append(AnthropicMessageParam(role=message['role'], content=message['content']))
+            if i == cache_breakpoint and message['content']:
+                content = [AnthropicTextBlockParam(type="text", text=message['content'], cache_control=CacheControlEphemeralParam(type="ephemeral"))]
+                casted_messages.append(AnthropicMessageParam(role=message['role'], content=content))
+            else:
+                casted_messages.append(AnthropicMessageParam(role=message['role'], content=message['content']))
         else:
             error_message = f"{PRINT_PREFIX} invalid message role: {message['role']}"
             rprint(f"[red][bold]{error_message}[/bold][/red]")
@@ -47,60 +200,192 @@ def cast_messages_anthropic(messages: Iterable[Message]) -> list[AnthropicMessag
 
     return casted_messages
 
-def on_backoff_anthropic(details):
-    rprint(f"[red][bold]{PRINT_PREFIX} Anthropic API error - backing off {details['wait']:0.1f} seconds after {details['tries']} tries\n{details['exception']}[/bold][/red]")
-
-@backoff.on_exception(backoff.expo,
-                      (RateLimitError, InternalServerError),
-                      max_tries=10,
-                      on_backoff=on_backoff_anthropic)
-def llm_call_anthropic(client: Anthropic, system: str, messages: list[Message], stop_sequences: list[str], temperature: float, max_tokens: Optional[int] = 8192) -> AnthropicMessage:
-    model = os.environ.get("ANTHROPIC_MODEL")
-    if model is None:
-        error_message = f"{PRINT_PREFIX} ANTHROPIC_MODEL not set"
-        rprint(f"[red][bold]{error_message}[/bold][/red]")
-        raise KeyError(error_message)
-    
-    anthropic_messages = cast_messages_anthropic(messages)
-    
+async def llm_call_anthropic(client: AsyncAnthropic, system: str, messages: list[Message], stop_sequences: list[str], temperature: float, max_tokens: Optional[int] = None, on_started: Optional[Callable[[], None]] = None, model: Optional[ModelSpec] = None) -> AnthropicMessage:
+    """
+    on_started, if given, is called once the server has begun its response - by then the prompt prefix
+    has been written to the prompt cache, so identical requests sent afterwards can read it.
+    Without max_tokens the current state's generation budget is used (see utils.llm_budget).
+    """
+    async def call(budget_max_tokens: Optional[int]) -> AnthropicMessage:
+        return await _llm_call_anthropic(client, system, messages, stop_sequences, temperature, max_tokens=budget_max_tokens, on_started=on_started, model=model)
+
+    return await call_with_generation_budget(call, max_tokens, anthropic_completions)
+
+def anthropic_completions(llm_response: AnthropicMessage) -> Completions:
+    return [(llm_response.usage.output_tokens, llm_response.stop_reason in TRUNCATED_FINISH_REASONS)]
+
+async def _llm_call_anthropic(client: AsyncAnthropic, system: str, messages: list[Message], stop_sequences: list[str], temperature: float, max_tokens: Optional[int] = 8192, on_started: Optional[Callable[[], None]] = None, model: Optional[ModelSpec] = None) -> AnthropicMessage:
+    model = resolve_model("anthropic", model)
+
+    anthropic_system = cast_system_anthropic(system)
+    anthropic_messages = cast_messages_anthropic(messages, get_cache_breakpoint(messages) if use_prompt_caching() else None)
+
     effective_max_tokens = max_tokens if max_tokens is not None else 8192
 
+    limiter = get_limiter(str(client.base_url), model)
+    telemetry = CallTelemetry("anthropic", model, str(client.base_url), n=1, stream=False)
+    trace = get_llm_trace()
+
+    kwargs = {
+        "model": model,
+        "max_tokens": effective_max_tokens,
+        "temperature": temperature,
+        "system": anthropic_system,
+        "messages": anthropic_messages,
+        "stop_sequences": stop_sequences,
+    }
+
+    async def request() -> AnthropicMessage:
+        if on_started is None:
+            return await client.messages.create(**kwargs)
+
+        # Streamed internally only to learn when the response has started
+        async with client.messages.stream(**kwargs) as stream:
+            async for event in stream:
+                if event.type == "message_start":
+                    on_started()
+
+            return await stream.get_final_message()
+
+    async def create() -> AnthropicMessage:
+        async with get_scheduler().slot() as queue_wait_sec, limiter.slot():
+            telemetry.queue_wait_sec += queue_wait_sec
+            telemetry.attempts += 1
+
+            if trace is None:
+                return await request()
+
+            key = LLMCache.make_key("anthropic", model, system, messages, stop_sequences, temperature, effective_max_tokens)
+            return await trace.call(key, AnthropicMessage, request)
+
+    async def create_with_retries() -> AnthropicMessage:
+        return await call_with_retries(create, "Anthropic")
+
     try:
-        message = client.messages.create(
+        # A trace has to see every request, so the response cache is bypassed while recording or replaying
+        cache = get_llm_cache() if trace is None else None
+        if cache is not None and cache.is_cacheable(temperature):
+            key = cache.make_key(f"anthropic:{client.base_url}", model, system, messages, stop_sequences, temperature, effective_max_tokens)
+            llm_response = await cache.get_or_call(key, AnthropicMessage, create_with_retries)
+        else:
+            llm_response = await create_with_retries()
+    except BaseException as e:
+        telemetry.finish(e)
+        raise
+
+    telemetry.prompt_tokens = llm_response.usage.input_tokens
+    telemetry.completion_tokens = llm_response.usage.output_tokens
+    telemetry.cache_read_tokens = llm_response.usage.cache_read_input_tokens
+    telemetry.cache_write_tokens = llm_response.usage.cache_creation_input_tokens
+    telemetry.finish_reasons = [llm_response.stop_reason]
+    telemetry.finish()
+
+    # input_tokens leaves out the part of the prompt that was read from or written to the cache
+    get_token_counter().calibrate(model, system, messages, llm_response.usage.input_tokens + (llm_response.usage.cache_read_input_tokens or 0) + (llm_response.usage.cache_creation_input_tokens or 0))
+
+    return llm_response
+
+async def open_stream_with_retries(open_stream: Callable[[], Awaitable[T]], description: str, limiter: AdaptiveLimiter, telemetry: CallTelemetry) -> tuple[T, Callable[[Optional[BaseException]], None]]:
+    """
+    Opens a stream with retries. The caller owns the returned request slot until the stream is closed,
+    and must then call release() with the exception that ended the stream, if any.
+    """
+    scheduler = get_scheduler()
+    priority = get_llm_priority()
+    started_at = 0.0
+
+    async def acquire_and_open() -> T:
+        nonlocal started_at
+
+        telemetry.queue_wait_sec += await scheduler.acquire(priority)
+        try:
+            started_at = await limiter.acquire()
+        except BaseException:
+            scheduler.release(priority)
+            raise
+
+        try:
+            return await open_stream()
+        except BaseException as e:
+            limiter.release(started_at, e)
+            scheduler.release(priority)
+            raise
+
+    def release(exc: Optional[BaseException] = None) -> None:
+        limiter.release(started_at, exc)
+        scheduler.release(priority)
+
+    return await call_with_retries(acquire_and_open, description), release
+
+def anthropic_response_texts(llm_response: AnthropicMessage) -> list[Optional[str]]:
+    anthropic_content: AnthropicContentBlock = llm_response.content[0]
+    if isinstance(anthropic_content, AnthropicTextBlock):
+        return [anthropic_content.text]
+    else:
+        return [None]
+
+async def llm_stream_anthropic(client: AsyncAnthropic, system: str, messages: list[Message], stop_sequences: list[str], temperature: float, max_tokens: Optional[int] = None, model: Optional[ModelSpec] = None) -> AsyncIterator[str]:
+    model = resolve_model("anthropic", model)
+
+    anthropic_system = cast_system_anthropic(system)
+    anthropic_messages = cast_messages_anthropic(messages, get_cache_breakpoint(messages) if use_prompt_caching() else None)
+
+    # A streamed response cannot be retried once it has been yielded, so a budget here is only a cap
+    if max_tokens is None:
+        max_tokens = get_generation_budgets().get_max_tokens(get_llm_state())
+
+    telemetry = CallTelemetry("anthropic", model, str(client.base_url), n=1, stream=True)
+
+    async def open_stream():
+        telemetry.attempts += 1
+        return await client.messages.create(
             model=model,
-            max_tokens=effective_max_tokens,
+            max_tokens=max_tokens if max_tokens is not None else 8192,
             temperature=temperature,
-            system=system,
+            system=anthropic_system,
             messages=anthropic_messages,
             stop_sequences=stop_sequences,
+            stream=True,
         )
-    except RateLimitError as e:
-        error_message = f"{PRINT_PREFIX} Anthropic RateLimitError: {e}"
-        rprint(f"[red][bold]{error_message}[/bold][/red]")
-        raise LLMAPIRateLimitError(error_message)
-    except InternalServerError as e:
-        error_message = f"{PRINT_PREFIX} Anthropic InternalServerError: {e}"
-        rprint(f"[red][bold]{error_message}[/bold][/red]")
-        raise LLMAPIInternalServerError(error_message)
-    
-    return message
 
-def llm_call_anthropic_futures_to_texts(texts, futures):
-    for i, future in enumerate(futures):
-        try:
-            llm_response = future.result()
-            dprint(f"{PRINT_PREFIX} llm_response[{i}]: {llm_response}")
+    try:
+        stream, release = await open_stream_with_retries(open_stream, "Anthropic", get_limiter(str(client.base_url), model), telemetry)
+    except BaseException as e:
+        telemetry.finish(e)
+        raise
 
-            anthropic_content: AnthropicContentBlock = llm_response.content[0]
-            if isinstance(anthropic_content, AnthropicTextBlock):
-                text: str = anthropic_content.text
-                texts[i] = text
-            else:
-                texts[i] = None
-                                
-        except Exception as exc:
-            rprint(f"{PRINT_PREFIX} [red][bold]Error obtaining future result: {exc}[/bold][/red]")
-            texts[i] = None
+    stream_error: Optional[BaseException] = None
+
+    try:
+        async for event in stream:
+            if event.type == "message_start":
+                telemetry.prompt_tokens = event.message.usage.input_tokens
+                telemetry.cache_read_tokens = event.message.usage.cache_read_input_tokens
+                telemetry.cache_write_tokens = event.message.usage.cache_creation_input_tokens
+            elif event.type == "message_delta":
+                telemetry.completion_tokens = event.usage.output_tokens
+                telemetry.finish_reasons = [event.delta.stop_reason]
+            elif event.type == "content_block_delta" and event.delta.type == "text_delta":
+                telemetry.on_first_token()
+                yield event.delta.text
+    except Exception as e:
+        stream_error = e
+        raise
+    finally:
+        await stream.close()
+        release(stream_error)
+        finish_stream_telemetry(telemetry, stream_error)
+
+def finish_stream_telemetry(telemetry: CallTelemetry, stream_error: Optional[BaseException]) -> None:
+    # A stream closed before the server finished was cut short by the caller (e.g. at a stop sequence)
+    if stream_error is None and not telemetry.finish_reasons:
+        telemetry.finish_reasons = ["closed"]
+
+    telemetry.finish(stream_error)
+
+    # Only a stream the server finished itself shows how long the completion wanted to be
+    if stream_error is None and telemetry.finish_reasons != ["closed"]:
+        get_generation_budgets().observe(telemetry.state, [(telemetry.completion_tokens, telemetry.finish_reasons[0] in TRUNCATED_FINISH_REASONS)])
 
 def cast_messages_openai(messages: Iterable[Message]) -> list[ChatCompletionMessageParam]:
     casted_messages = []
@@ -118,13 +403,28 @@ def cast_messages_openai(messages: Iterable[Message]) -> list[ChatCompletionMess
 
     return casted_messages
 
-def llm_call_openai(client: OpenAI, system: str, messages: list[Message], stop_sequences: list[str], temperature: float, n: int, max_tokens: Optional[int] = None) -> OpenAIChatCompletion:
-    model = os.environ.get("OPENAI_MODEL")
-    if model is None:
-        error_message = f"{PRINT_PREFIX} OPENAI_MODEL not set"
-        rprint(f"[red][bold]{error_message}[/bold][/red]")
-        raise KeyError(error_message)
-    
+async def llm_call_openai(client: AsyncOpenAI, system: str, messages: list[Message], stop_sequences: list[str], temperature: float, n: int, max_tokens: Optional[int] = None, model: Optional[ModelSpec] = None) -> OpenAIChatCompletion:
+    """Without max_tokens the current state's generation budget is used (see utils.llm_budget)."""
+    async def call(budget_max_tokens: Optional[int]) -> OpenAIChatCompletion:
+        return await _llm_call_openai(client, system, messages, stop_sequences, temperature, n, max_tokens=budget_max_tokens, model=model)
+
+    return await call_with_generation_budget(call, max_tokens, openai_completions)
+
+def openai_completions(llm_response: OpenAIChatCompletion) -> Completions:
+    total_tokens = llm_response.usage.completion_tokens if llm_response.usage is not None else None
+    lengths = [len(choice.message.content or "") for choice in llm_response.choices]
+
+    completions: Completions = []
+    for choice, length in zip(llm_response.choices, lengths):
+        # Usage only covers all choices together, so it is split between them in proportion to their length
+        tokens = round(total_tokens * length / sum(lengths)) if total_tokens is not None and sum(lengths) else None
+        completions.append((tokens, choice.finish_reason in TRUNCATED_FINISH_REASONS))
+
+    return completions
+
+async def _llm_call_openai(client: AsyncOpenAI, system: str, messages: list[Message], stop_sequences: list[str], temperature: float, n: int, max_tokens: Optional[int] = None, model: Optional[ModelSpec] = None) -> OpenAIChatCompletion:
+    model = resolve_model("openai", model)
+
     openai_system: Message = {'role': Role.SYSTEM.value, 'content': system}
     openai_messages: list[Message] = [openai_system] + messages
 
@@ -141,158 +441,826 @@ def llm_call_openai(client: OpenAI, system: str, messages: list[Message], stop_s
     if max_tokens is not None:
         kwargs["max_tokens"] = max_tokens
 
-    response = client.chat.completions.create(**kwargs)
+    telemetry = CallTelemetry("openai", model, str(client.base_url), n=n, stream=False)
+    trace = get_llm_trace()
+
+    async def create() -> OpenAIChatCompletion:
+        # Each attempt goes to the least loaded endpoint, so a retry can land on a different one
+        async with use_endpoint(client) as endpoint_client:
+            telemetry.endpoint = str(endpoint_client.base_url)
+
+            async def request() -> OpenAIChatCompletion:
+                return await endpoint_client.chat.completions.create(**kwargs)
+
+            async with get_scheduler().slot() as queue_wait_sec, get_limiter(str(endpoint_client.base_url), model).slot():
+                telemetry.queue_wait_sec += queue_wait_sec
+                telemetry.attempts += 1
+
+                if trace is None:
+                    return await request()
+
+                key = LLMCache.make_key("openai", model, system, messages, stop_sequences, temperature, max_tokens, n)
+                return await trace.call(key, OpenAIChatCompletion, request)
+
+    async def create_with_retries() -> OpenAIChatCompletion:
+        return await call_with_retries(create, "OpenAI")
+
+    try:
+        cache = get_llm_cache() if trace is None else None
+        if cache is not None and cache.is_cacheable(temperature):
+            key = cache.make_key(f"openai:{client.base_url}", model, system, messages, stop_sequences, temperature, max_tokens, n)
+            llm_response = await cache.get_or_call(key, OpenAIChatCompletion, create_with_retries)
+        else:
+            llm_response = await create_with_retries()
+    except BaseException as e:
+        telemetry.finish(e)
+        raise
+
+    if llm_response.usage is not None:
+        telemetry.prompt_tokens = llm_response.usage.prompt_tokens
+        telemetry.completion_tokens = llm_response.usage.completion_tokens
+
+        # Reported by endpoints with automatic prefix caching
+        if llm_response.usage.prompt_tokens_details is not None:
+            telemetry.cache_read_tokens = llm_response.usage.prompt_tokens_details.cached_tokens
+
+        get_token_counter().calibrate(model, system, messages, llm_response.usage.prompt_tokens)
+    telemetry.finish_reasons = [choice.finish_reason for choice in llm_response.choices]
+    telemetry.finish()
+
+    return llm_response
+
+async def llm_call_openai_batch(client: AsyncOpenAI, prompts: list[PromptsDict], stop_sequences: list[str], temperature: float, max_tokens: Optional[int] = None, model: Optional[ModelSpec] = None) -> OpenAICompletion:
+    """
+    Sends prompts as a single /v1/completions request with a list of prompts, which local servers such as vLLM
+    run as one batch. Without max_tokens the current state's generation budget is used (see utils.llm_budget).
+    """
+    async def call(budget_max_tokens: Optional[int]) -> OpenAICompletion:
+        return await _llm_call_openai_batch(client, prompts, stop_sequences, temperature, max_tokens=budget_max_tokens, model=model)
+
+    return await call_with_generation_budget(call, max_tokens, openai_batch_completions)
+
+def openai_batch_completions(llm_response: OpenAICompletion) -> Completions:
+    total_tokens = llm_response.usage.completion_tokens if llm_response.usage is not None else None
+    lengths = [len(choice.text) for choice in llm_response.choices]
+
+    return [(round(total_tokens * length / sum(lengths)) if total_tokens is not None and sum(lengths) else None,
+             choice.finish_reason in TRUNCATED_FINISH_REASONS) for choice, length in zip(llm_response.choices, lengths)]
+
+async def _llm_call_openai_batch(client: AsyncOpenAI, prompts: list[PromptsDict], stop_sequences: list[str], temperature: float, max_tokens: Optional[int] = None, model: Optional[ModelSpec] = None) -> OpenAICompletion:
+    model = resolve_model("openai", model)
+
+    # The server only sees raw text, so the chat template is applied here
+    template = get_chat_template()
+    rendered_prompts = [template.render(prompt['system'], prompt['messages']) for prompt in prompts]  # type: ignore
+
+    kwargs = {
+        "model": model,
+        "prompt": rendered_prompts,
+        "stop": stop_sequences + template.stop_sequences,
+        "temperature": temperature,
+    }
+
+    if max_tokens is not None:
+        kwargs["max_tokens"] = max_tokens
+
+    telemetry = CallTelemetry("openai", model, str(client.base_url), n=len(prompts), stream=False)
+    trace = get_llm_trace()
+
+    async def create() -> OpenAICompletion:
+        async with use_endpoint(client) as endpoint_client:
+            telemetry.endpoint = str(endpoint_client.base_url)
+
+            async def request() -> OpenAICompletion:
+                return await endpoint_client.completions.create(**kwargs)
+
+            async with get_scheduler().slot() as queue_wait_sec, get_limiter(str(endpoint_client.base_url), model).slot():
+                telemetry.queue_wait_sec += queue_wait_sec
+                telemetry.attempts += 1
+
+                if trace is None:
+                    return await request()
+
+                key = LLMCache.make_key("openai-batch", model, "", [{"role": Role.USER.value, "content": prompt} for prompt in rendered_prompts],
+                                        stop_sequences, temperature, max_tokens, len(prompts))
+                return await trace.call(key, OpenAICompletion, request)
+
+    try:
+        llm_response = await call_with_retries(create, "OpenAI batch")
+    except BaseException as e:
+        telemetry.finish(e)
+        raise
+
+    if llm_response.usage is not None:
+        telemetry.prompt_tokens = llm_response.usage.prompt_tokens
+        telemetry.completion_tokens = llm_response.usage.completion_tokens
+    telemetry.finish_reasons = [choice.finish_reason for choice in llm_response.choices]
+    telemetry.finish()
+
+    return llm_response
+
+def openai_batch_texts(llm_response: OpenAICompletion, expected_n: int) -> Optional[list[Optional[str]]]:
+    """The completion of each prompt, in prompt order - None if the server did not answer every prompt of the batch."""
+    if len(llm_response.choices) != expected_n or sorted(choice.index for choice in llm_response.choices) != list(range(expected_n)):
+        return None
+
+    return [choice.text for choice in sorted(llm_response.choices, key=lambda choice: choice.index)]
+
+async def llm_call_batch_api(client: AsyncClient, prompts: list[PromptsDict], stop_sequences: list[str], temperature: float, max_tokens: Optional[int] = None, model: Optional[ModelSpec] = None) -> list[Optional[str]]:
+    """
+    Runs prompts as one provider batch job (see utils.llm_batch_api) and returns the text for each prompt, or None
+    for those that failed. Batch jobs can take hours to end, but do not count against the interactive rate limits.
+    """
+    provider = "anthropic" if isinstance(client, AsyncAnthropic) else "openai"
+    model = resolve_model(provider, model)
+
+    if max_tokens is None:
+        max_tokens = get_generation_budgets().get_max_tokens(get_llm_state())
+
+    requests: dict[str, dict[str, Any]] = {}
+    for i, prompt in enumerate(prompts):
+        if isinstance(client, AsyncAnthropic):
+            requests[f"slot-{i}"] = {"model": model,
+                                     "max_tokens": max_tokens if max_tokens is not None else 8192,
+                                     "temperature": temperature,
+                                     "system": cast_system_anthropic(prompt['system']),  # type: ignore
+                                     "messages": cast_messages_anthropic(prompt['messages']),  # type: ignore
+                                     "stop_sequences": stop_sequences}
+        else:
+            requests[f"slot-{i}"] = {"model": model,
+                                     "messages": cast_messages_openai([{'role': Role.SYSTEM.value, 'content': prompt['system']}] + prompt['messages']),  # type: ignore
+                                     "stop": stop_sequences,
+                                     "temperature": temperature}
+            if max_tokens is not None:
+                requests[f"slot-{i}"]["max_tokens"] = max_tokens
+
+    telemetry = CallTelemetry(provider, model, str(client.base_url), n=len(prompts), stream=False)
+    telemetry.attempts = 1
+
+    try:
+        responses = await run_batch(get_batch_api(client), requests)
+    except BaseException as e:
+        telemetry.finish(e)
+        raise
+
+    texts: list[Optional[str]] = []
+    telemetry.prompt_tokens = telemetry.completion_tokens = 0
+
+    for i in range(len(prompts)):
+        response = responses.get(f"slot-{i}")
+
+        if response is None:
+            texts.append(None)
+        elif isinstance(client, AsyncAnthropic):
+            anthropic_response = AnthropicMessage.model_validate(response)
+            texts.append(anthropic_response_texts(anthropic_response)[0])
+            telemetry.prompt_tokens += anthropic_response.usage.input_tokens
+            telemetry.completion_tokens += anthropic_response.usage.output_tokens
+            telemetry.finish_reasons.append(anthropic_response.stop_reason)
+        else:
+            openai_response = OpenAIChatCompletion.model_validate(response)
+            texts.append(openai_response_texts(openai_response, 1)[0])
+            if openai_response.usage is not None:
+                telemetry.prompt_tokens += openai_response.usage.prompt_tokens
+                telemetry.completion_tokens += openai_response.usage.completion_tokens
+            telemetry.finish_reasons.extend(choice.finish_reason for choice in openai_response.choices)
+
+    telemetry.finish()
+
+    return texts
+
+def openai_response_texts(llm_response: OpenAIChatCompletion, expected_n: int) -> list[Optional[str]]:
+    texts: list[Optional[str]] = [None] * expected_n
+
+    if not llm_response.choices:
+        error_message = f"{PRINT_PREFIX} empty openai choices: {llm_response}"
+        rprint(f"[red][bold]{error_message}[/bold][/red]")
+        return texts
+
+    for i, choice in enumerate(llm_response.choices[:expected_n]):
+        if choice.message.content is not None:
+            texts[i] = choice.message.content
+        else:
+            error_message = f"{PRINT_PREFIX} empty openai_content: {llm_response}"
+            rprint(f"[red][bold]{error_message}[/bold][/red]")
+
+    return texts
+
+async def llm_stream_openai(client: AsyncOpenAI, system: str, messages: list[Message], stop_sequences: list[str], temperature: float, max_tokens: Optional[int] = None, model: Optional[ModelSpec] = None) -> AsyncIterator[str]:
+    model = resolve_model("openai", model)
+
+    openai_system: Message = {'role': Role.SYSTEM.value, 'content': system}
+    casted_messages = cast_messages_openai([openai_system] + messages)
+
+    if max_tokens is None:
+        max_tokens = get_generation_budgets().get_max_tokens(get_llm_state())
+
+    kwargs = {
+        "model": model,
+        "messages": casted_messages,
+        "stop": stop_sequences,
+        "temperature": temperature,
+        "stream": True,
+    }
+
+    if max_tokens is not None:
+        kwargs["max_tokens"] = max_tokens
+
+    telemetry = CallTelemetry("openai", model, str(client.base_url), n=1, stream=True)
+
+    # A stream stays on the endpoint it was opened on, so it holds that endpoint until it is closed
+    async with use_endpoint(client) as endpoint_client:
+        telemetry.endpoint = str(endpoint_client.base_url)
+
+        async def open_stream():
+            telemetry.attempts += 1
+            return await endpoint_client.chat.completions.create(**kwargs)
+
+        try:
+            stream, release = await open_stream_with_retries(open_stream, "OpenAI", get_limiter(str(endpoint_client.base_url), model), telemetry)
+        except BaseException as e:
+            telemetry.finish(e)
+            raise
+
+        stream_error: Optional[BaseException] = None
+
+        try:
+            async for chunk in stream:
+                # Only sent by servers that report usage on streams
+                if chunk.usage is not None:
+                    telemetry.prompt_tokens = chunk.usage.prompt_tokens
+                    telemetry.completion_tokens = chunk.usage.completion_tokens
+
+                if chunk.choices and chunk.choices[0].finish_reason is not None:
+                    telemetry.finish_reasons = [chunk.choices[0].finish_reason]
+
+                if chunk.choices and chunk.choices[0].delta.content:
+                    telemetry.on_first_token()
+                    yield chunk.choices[0].delta.content
+        except Exception as e:
+            stream_error = e
+            raise
+        finally:
+            await stream.close()
+            release(stream_error)
+            finish_stream_telemetry(telemetry, stream_error)
+
+
+class StopSequenceDetector:
+    """
+    Finds stop sequences in streamed text, since some OpenAI-compatible servers ignore `stop`.
+    Holds back just enough trailing text to catch a stop sequence split across deltas.
+    """
+    def __init__(self, stop_sequences: list[str]) -> None:
+        self.stop_sequences = [stop_sequence for stop_sequence in stop_sequences if stop_sequence]
+        self.holdback = max((len(stop_sequence) for stop_sequence in self.stop_sequences), default=1) - 1
+        self.buffer = ""
+        self.stopped = False
+
+    def feed(self, delta: str) -> str:
+        if self.stopped:
+            return ""
+
+        self.buffer += delta
+
+        stop_indices = [self.buffer.find(stop_sequence) for stop_sequence in self.stop_sequences if stop_sequence in self.buffer]
+        if stop_indices:
+            text = self.buffer[:min(stop_indices)]
+            self.buffer = ""
+            self.stopped = True
+            return text
+
+        emit_len = max(0, len(self.buffer) - self.holdback)
+        text, self.buffer = self.buffer[:emit_len], self.buffer[emit_len:]
+        return text
+
+    def flush(self) -> str:
+        text, self.buffer = self.buffer, ""
+        return text
+
+async def llm_stream(client: AsyncClient, system: str, messages: list[Message], stop_sequences: list[str], temperature: float, max_tokens: Optional[int] = None, model: Optional[ModelSpec] = None) -> AsyncIterator[str]:
+    """Yields text as it is generated, closing the HTTP stream as soon as a stop sequence appears."""
+    def open_raw_stream() -> AsyncIterator[str]:
+        if isinstance(client, AsyncAnthropic):
+            return llm_stream_anthropic(client, system, messages, stop_sequences, temperature, max_tokens=max_tokens, model=model)
+        else:
+            return llm_stream_openai(client, system, messages, stop_sequences, temperature, max_tokens=max_tokens, model=model)
+
+    trace = get_llm_trace()
+    if trace is None:
+        raw_stream = open_raw_stream()
+    else:
+        # Replayed streams never reach the server, so they bypass the limiter and are not in the telemetry
+        provider = "anthropic" if isinstance(client, AsyncAnthropic) else "openai"
+        key = LLMCache.make_key(f"{provider}-stream", resolve_model(provider, model), system, messages, stop_sequences, temperature, max_tokens)
+        raw_stream = trace.stream(key, open_raw_stream)
+
+    detector = StopSequenceDetector(stop_sequences)
+
+    try:
+        async for delta in raw_stream:
+            text = detector.feed(delta)
+            if text:
+                yield text
+
+            if detector.stopped:
+                dprint(f"{PRINT_PREFIX} stop sequence reached - closing stream")
+                break
+
+        text = detector.flush()
+        if text:
+            yield text
+    finally:
+        await raw_stream.aclose()
+
+async def llm_stream_text(client: AsyncClient, system: str, messages: list[Message], stop_sequences: list[str], temperature: float, max_tokens: Optional[int] = None, model: Optional[ModelSpec] = None) -> str:
+    return "".join([text async for text in llm_stream(client, system, messages, stop_sequences, temperature, max_tokens=max_tokens, model=model)])
+
+async def iterate_on_llm_loop(agen: AsyncIterator[T]) -> AsyncIterator[T]:
+    """Iterates agen on the LLM event loop on behalf of any other event loop. Closing the iterator cancels agen."""
+    loop = get_llm_loop()
+    caller_loop = asyncio.get_running_loop()
+
+    if caller_loop is loop:
+        async for item in agen:
+            yield item
+        return
+
+    items: asyncio.Queue = asyncio.Queue()
+
+    def post(item: tuple[bool, Any]) -> None:
+        try:
+            caller_loop.call_soon_threadsafe(items.put_nowait, item)
+        except RuntimeError:
+            pass  # caller loop already closed
+
+    state = get_llm_state()
+
+    async def produce() -> None:
+        use_llm_state(state)
+
+        try:
+            async for item in agen:
+                post((False, item))
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            post((True, e))
+        else:
+            post((True, None))
+
+    future = asyncio.run_coroutine_threadsafe(produce(), loop)
+
+    try:
+        while True:
+            done, item = await items.get()
+            if done:
+                if item is not None:
+                    raise item
+                return
+            yield item
+    finally:
+        future.cancel()
+
+def iterate_on_llm_loop_sync(agen: AsyncIterator[T]) -> Iterator[T]:
+    """Blocking counterpart of iterate_on_llm_loop for synchronous callers."""
+    loop = get_llm_loop()
+
+    if threading.current_thread() is _llm_loop_thread:
+        error_message = f"{PRINT_PREFIX} synchronous LLM stream made from the LLM event loop - use the async variant instead"
+        rprint(f"[red][bold]{error_message}[/bold][/red]")
+        raise RuntimeError(error_message)
+
+    items: Queue = Queue()
+    state = get_llm_state()
+
+    async def produce() -> None:
+        use_llm_state(state)
+
+        try:
+            async for item in agen:
+                items.put((False, item))
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            items.put((True, e))
+        else:
+            items.put((True, None))
+
+    future = asyncio.run_coroutine_threadsafe(produce(), loop)
+
+    try:
+        while True:
+            done, item = items.get()
+            if done:
+                if item is not None:
+                    raise item
+                return
+            yield item
+    finally:
+        future.cancel()
+
+def get_max_n_cache_path() -> str:
+    output_dir = os.environ.get("OUTPUT_DIR", "data/output/")
+    os.makedirs(output_dir, exist_ok=True)
+    return os.path.join(output_dir, MAX_N_CACHE_FILENAME)
+
+def load_max_n_cache() -> dict[str, int]:
+    try:
+        with open(get_max_n_cache_path(), "r", encoding="utf-8") as f:
+            return {base_url: int(max_n) for base_url, max_n in json.load(f).items()}
+    except (FileNotFoundError, json.JSONDecodeError, ValueError, AttributeError):
+        return {}
+
+def save_max_n_cache(cache: dict[str, int]) -> None:
+    try:
+        with open(get_max_n_cache_path(), "w", encoding="utf-8") as f:
+            json.dump(cache, f, indent=2)
+    except OSError as e:
+        rprint(f"[yellow]{PRINT_PREFIX} Unable to save {MAX_N_CACHE_FILENAME}: {e}[/yellow]")
+
+async def probe_openai_max_n(client: AsyncOpenAI, probe_n: int = OPENAI_MAX_N_PROBE) -> Optional[int]:
+    """
+    Asks for probe_n one-token choices and returns how many the endpoint actually honors - 1 if it rejects the
+    request outright (a non-retryable 4xx), and None if the probe failed in a way that says nothing about n.
+    """
+    try:
+        # Sampled, as some servers reject n > 1 at temperature 0
+        response = await llm_call_openai(client,
+                                         "Reply with a single word.",
+                                         [{'role': Role.USER.value, 'content': "ping"}],
+                                         [],
+                                         1.0,
+                                         probe_n,
+                                         max_tokens=1)
+    except Exception as e:
+        status_code = get_status_code(e)
+        if status_code is not None and 400 <= status_code < 500 and not is_retryable(e):
+            dprint(f"{PRINT_PREFIX} n={probe_n} probe rejected by {client.base_url}: {e}")
+            return 1
+
+        rprint(f"[yellow]{PRINT_PREFIX} n={probe_n} probe of {client.base_url} failed, using n=1 for this session: {e}[/yellow]")
+        return None
+
+    return max(1, min(probe_n, len(response.choices)))
+
+async def get_openai_max_n(client: AsyncOpenAI) -> int:
+    global _openai_max_n_lock
+
+    max_n_str = os.environ.get("OPENAI_MAX_N", "auto").strip().lower()
+    if max_n_str != "auto":
+        return max(1, int(max_n_str))
+
+    base_url = str(client.base_url)
+    if base_url in _openai_max_n:
+        return _openai_max_n[base_url]
+
+    if _openai_max_n_lock is None:
+        _openai_max_n_lock = asyncio.Lock()
+
+    async with _openai_max_n_lock:
+        if base_url not in _openai_max_n:
+            cache = load_max_n_cache()
+
+            if base_url in cache:
+                _openai_max_n[base_url] = cache[base_url]
+            elif get_llm_backend() == "replay":
+                # Replay must not reach the endpoint, and a probe it cannot make says nothing for later runs
+                _openai_max_n[base_url] = 1
+            else:
+                max_n = await probe_openai_max_n(client)
+                _openai_max_n[base_url] = max_n if max_n is not None else 1
+
+                # Only a definite answer is kept - a probe that failed is made again next session
+                if max_n is not None:
+                    cache[base_url] = max_n
+                    save_max_n_cache(cache)
+
+            dprint(f"{PRINT_PREFIX} OPENAI_MAX_N for {base_url}: {_openai_max_n[base_url]}")
+
+    return _openai_max_n[base_url]
+
+def detect_openai_max_n(client: OpenAI | AsyncOpenAI) -> int:
+    async_client = get_async_client(client)
+    if not isinstance(async_client, AsyncOpenAI):
+        error_message = f"{PRINT_PREFIX} OPENAI_MAX_N detection requires an OpenAI client, got {type(client)} instead"
+        rprint(f"[red][bold]{error_message}[/bold][/red]")
+        raise TypeError(error_message)
+
+    return run_on_llm_loop(get_openai_max_n(async_client))
+
+def use_streaming(stream: Optional[bool]) -> bool:
+    return stream if stream is not None else os.environ.get("LLM_STREAM", "False").lower() == "true"
+
+def stream_llm_turn(client: SyncClient | AsyncClient, prompts: PromptsDict, stop_sequences: list[str], temperature: float, max_tokens: Optional[int] = None, model: Optional[ModelSpec] = None, priority: Optional[Priority] = None) -> Iterator[str]:
+    return iterate_on_llm_loop_sync(_stream_llm_turn(client, prompts, stop_sequences, temperature, max_tokens, model, priority))
+
+def stream_llm_turn_async(client: SyncClient | AsyncClient, prompts: PromptsDict, stop_sequences: list[str], temperature: float, max_tokens: Optional[int] = None, model: Optional[ModelSpec] = None, priority: Optional[Priority] = None) -> AsyncIterator[str]:
+    return iterate_on_llm_loop(_stream_llm_turn(client, prompts, stop_sequences, temperature, max_tokens, model, priority))
+
+async def _stream_llm_turn(client: SyncClient | AsyncClient, prompts: PromptsDict, stop_sequences: list[str], temperature: float, max_tokens: Optional[int] = None, model: Optional[ModelSpec] = None, priority: Optional[Priority] = None) -> AsyncIterator[str]:
+    check_prompts(prompts)
+
+    route = get_state_route(get_llm_state())
+    model = model if model is not None else route["model"]
+    temperature = route["temperature"] if route["temperature"] is not None else temperature
+
+    # Streams are iterated in a task of their own on the LLM loop, so this does not leak to the caller
+    if priority is not None:
+        use_llm_priority(priority)
+
+    async_client = get_async_client(client)
+    prompts = preflight_prompts(async_client, [prompts], max_tokens, model)[0]
 
-    return response
+    async for text in llm_stream(async_client, prompts['system'], prompts['messages'], stop_sequences, temperature, max_tokens=max_tokens, model=model):  # type: ignore
+        yield text
 
-def llm_turn(client: Anthropic | OpenAI, prompts: PromptsDict, stop_sequences: list[str], temperature: float, max_tokens: Optional[int] = None) -> str:
-    return llm_turns(client, prompts, stop_sequences, temperature, n=1, max_tokens=max_tokens)[0]
+def llm_turn(client: SyncClient | AsyncClient, prompts: PromptsDict, stop_sequences: list[str], temperature: float, max_tokens: Optional[int] = None, stream: Optional[bool] = None, cancel: Optional[CancelToken] = None, model: Optional[ModelSpec] = None, priority: Optional[Priority] = None, trim: Optional[TrimHook] = None) -> str:
+    return llm_turns(client, prompts, stop_sequences, temperature, n=1, max_tokens=max_tokens, stream=stream, cancel=cancel, model=model, priority=priority, trim=trim)[0]
 
-def llm_turns(client: Anthropic | OpenAI, prompts: PromptsDict | list[PromptsDict], stop_sequences: list[str], temperature: float, n: Optional[int], max_tokens: Optional[int] = None) -> list[str]:    
+def llm_turns(client: SyncClient | AsyncClient, prompts: PromptsDict | list[PromptsDict], stop_sequences: list[str], temperature: float, n: Optional[int], max_tokens: Optional[int] = None, stream: Optional[bool] = None, quorum: Optional[Quorum] = None, cancel: Optional[CancelToken] = None, model: Optional[ModelSpec] = None, priority: Optional[Priority] = None, trim: Optional[TrimHook] = None) -> list[str]:
+    return run_on_llm_loop(_llm_turns(client, prompts, stop_sequences, temperature, n, max_tokens, stream, quorum, cancel, model, priority, trim))
+
+async def llm_turn_async(client: SyncClient | AsyncClient, prompts: PromptsDict, stop_sequences: list[str], temperature: float, max_tokens: Optional[int] = None, stream: Optional[bool] = None, cancel: Optional[CancelToken] = None, model: Optional[ModelSpec] = None, priority: Optional[Priority] = None, trim: Optional[TrimHook] = None) -> str:
+    return (await llm_turns_async(client, prompts, stop_sequences, temperature, n=1, max_tokens=max_tokens, stream=stream, cancel=cancel, model=model, priority=priority, trim=trim))[0]
+
+async def llm_turns_async(client: SyncClient | AsyncClient, prompts: PromptsDict | list[PromptsDict], stop_sequences: list[str], temperature: float, n: Optional[int], max_tokens: Optional[int] = None, stream: Optional[bool] = None, quorum: Optional[Quorum] = None, cancel: Optional[CancelToken] = None, model: Optional[ModelSpec] = None, priority: Optional[Priority] = None, trim: Optional[TrimHook] = None) -> list[str]:
+    return await await_on_llm_loop(_llm_turns(client, prompts, stop_sequences, temperature, n, max_tokens, stream, quorum, cancel, model, priority, trim))
+
+def llm_turns_as_completed_async(client: SyncClient | AsyncClient, prompts: PromptsDict | list[PromptsDict], stop_sequences: list[str], temperature: float, n: Optional[int], max_tokens: Optional[int] = None, stream: Optional[bool] = None, model: Optional[ModelSpec] = None, priority: Optional[Priority] = None, trim: Optional[TrimHook] = None) -> AsyncIterator[tuple[int, str]]:
+    """
+    Yields (index, text) for each candidate as soon as it has finished, in completion order.
+    Closing the iterator early cancels the calls that are still outstanding.
+
+    Prompts that would not fit the model's context window raise LLMContextOverflowError before anything is
+    sent, unless trim, if given, can cut them down far enough (see utils.llm_tokens.trim_longest_messages).
+    """
+    return iterate_on_llm_loop(_llm_turns_as_completed(client, prompts, stop_sequences, temperature, n, max_tokens, stream, model, priority, trim))
+
+async def _llm_turns(client: SyncClient | AsyncClient, prompts: PromptsDict | list[PromptsDict], stop_sequences: list[str], temperature: float, n: Optional[int], max_tokens: Optional[int] = None, stream: Optional[bool] = None, quorum: Optional[Quorum] = None, cancel: Optional[CancelToken] = None, model: Optional[ModelSpec] = None, priority: Optional[Priority] = None, trim: Optional[TrimHook] = None) -> list[str]:
+    """
+    quorum, if given, is checked as each result arrives. Once it returns True the outstanding calls are cancelled
+    and only the results received so far are returned. It runs on the LLM event loop, so it must not make LLM calls.
+
+    cancel, if given, aborts the outstanding calls as soon as it is cancelled (raising LLMCancelledError), or
+    once its deadline passes (returning the results received so far).
+    """
+    texts: dict[int, str] = {}
+
+    async def collect() -> None:
+        async with aclosing(_llm_turns_as_completed(client, prompts, stop_sequences, temperature, n, max_tokens, stream, model, priority, trim)) as results:
+            async for i, text in results:
+                texts[i] = text
+
+                if quorum is not None and quorum(dict(texts)):
+                    dprint(f"{PRINT_PREFIX} quorum reached after {len(texts)} result(s) - cancelling the rest")
+                    break
+
+    if cancel is None:
+        await collect()
+    elif not await cancel.run(collect()):
+        dprint(f"{PRINT_PREFIX} deadline reached after {len(texts)} result(s)")
+
+    return [texts[i] for i in sorted(texts)]
+
+def preflight_prompts(client: AsyncClient, slot_prompts: list[PromptsDict], max_tokens: Optional[int], model: Optional[ModelSpec], trim: Optional[TrimHook] = None) -> list[PromptsDict]:
+    """
+    Checks each distinct prompt against the context window of the model it is going to (see utils.llm_tokens),
+    leaving room for max_tokens - or, without it, the current state's generation budget - of completion.
+    """
+    model_name = resolve_model(get_provider(client), model)
+
+    if max_tokens is None:
+        max_tokens = get_generation_budgets().get_max_tokens(get_llm_state())
+    if max_tokens is None:
+        max_tokens = 8192 if isinstance(client, AsyncAnthropic) else int(os.environ.get("LLM_CONTEXT_RESERVE_TOKENS", "1024"))
+
+    checked: dict[int, PromptsDict] = {}
+    for prompt in slot_prompts:
+        if id(prompt) not in checked:
+            checked[id(prompt)] = check_context(model_name, prompt, max_tokens, trim)
+
+    return [checked[id(prompt)] for prompt in slot_prompts]
+
+def check_prompts(prompts: PromptsDict) -> None:
+    if not (isinstance(prompts['system'], str) and isinstance(prompts['messages'], list)):
+        error_message = f"""
+{PRINT_PREFIX} expected prompts['system'] to be str and prompts['messages'] to be list,
+got {type(prompts['system'])} and {type(prompts['messages'])} respectively instead
+""".strip()
+        rprint(f"[red][bold]{error_message}[/bold][/red]")
+        raise TypeError(error_message)
+
+async def _llm_turns_as_completed(client: SyncClient | AsyncClient, prompts: PromptsDict | list[PromptsDict], stop_sequences: list[str], temperature: float, n: Optional[int], max_tokens: Optional[int] = None, stream: Optional[bool] = None, model: Optional[ModelSpec] = None, priority: Optional[Priority] = None, trim: Optional[TrimHook] = None) -> AsyncIterator[tuple[int, str]]:
     if isinstance(prompts, dict):
         if not isinstance(n, int) or n < 1:
             error_message = f"{PRINT_PREFIX} n must be a positive integer if prompts is a dictionary"
             rprint(f"[red][bold]{error_message}[/bold][/red]")
             raise ValueError(error_message)
-        
-        if isinstance(prompts['system'], str) and isinstance(prompts['messages'], list):
-            texts: list[Optional[str]] = []
-
-            if isinstance(client, Anthropic):
-                texts = [None] * n
-                with concurrent.futures.ThreadPoolExecutor(max_workers=n) as executor:
-                    futures = []
-
-                    for i in range(n):
-                        futures.append(
-                            executor.submit(
-                                llm_call_anthropic, 
-                                client, 
-                                prompts['system'], 
-                                prompts['messages'], 
-                                stop_sequences, 
-                                temperature,
-                                max_tokens=max_tokens
-                            )
-                        )
-
-                    concurrent.futures.wait(futures)
-
-                    llm_call_anthropic_futures_to_texts(texts, futures)
-
-            elif isinstance(client, OpenAI):
-                max_n = int(os.environ.get("OPENAI_MAX_N", "1"))
-
-                # Split N into sequential chunks of size <= MAX_N (e.g. N=5, MAX_N=4 -> [4, 1])
-                chunks = []
-                remaining = n
-                while remaining > 0:
-                    current_chunk = min(remaining, max_n)
-                    chunks.append(current_chunk)
-                    remaining -= current_chunk
-
-                # Sequentially make requests for each chunk size
-                for chunk_n in chunks:
-                    try:
-                        llm_response = llm_call_openai(
-                            client,
-                            prompts['system'],  # type: ignore
-                            prompts['messages'],  # type: ignore
-                            stop_sequences,
-                            temperature,
-                            chunk_n,
-                            max_tokens
-                        )
-                        dprint(f"{PRINT_PREFIX} llm_response (n={chunk_n}): {llm_response}")
-                        if llm_response.choices:
-                            for choice in llm_response.choices:
-                                if choice.message.content is not None:
-                                    texts.append(choice.message.content)
-                                else:
-                                    error_message = f"{PRINT_PREFIX} empty openai_content: {llm_response}"
-                                    rprint(f"[red][bold]{error_message}[/bold][/red]")
-                        else:
-                            error_message = f"{PRINT_PREFIX} empty openai choices: {llm_response}"
-                            rprint(f"[red][bold]{error_message}[/bold][/red]")
-                    except Exception as exc:
-                        rprint(f"{PRINT_PREFIX} [red][bold]Error during API call for chunk n={chunk_n}: {exc}[/bold][/red]")
 
-            result = [text for text in texts if text is not None]
-            return result
-            
-        else:
-            error_message = f"""
-    {PRINT_PREFIX} expected prompts['system'] to be str and prompts['messages'] to be list,
-    got {type(prompts['system'])} and {type(prompts['messages'])} respectively instead
-    """.strip()
+        check_prompts(prompts)
+        slot_prompts = [prompts] * n
 
-            rprint(f"[red][bold]{error_message}[/bold][/red]")
-            raise TypeError(error_message)
-        
     elif isinstance(prompts, list):
-        n = len(prompts)
-
         for prompt in prompts:
-            if not (isinstance(prompt['system'], str) and isinstance(prompt['messages'], list)):
-                error_message = f"""
-{PRINT_PREFIX} expected prompt['system'] to be str and prompt['messages'] to be list,
-got {type(prompt['system'])} and {type(prompt['messages'])} respectively instead
-""".strip()
-                rprint(f"[red][bold]{error_message}[/bold][/red]")
-                raise TypeError(error_message)
-            
-        texts: list[Optional[str]] = [None] * n
+            check_prompts(prompt)
+        slot_prompts = prompts
 
-        if isinstance(client, Anthropic):
-            with concurrent.futures.ThreadPoolExecutor(max_workers=n) as executor:
-
-                futures = []
-                for i in range(n):
-                    future = executor.submit(
-                        llm_call_anthropic,
-                        client,
-                        prompts[i]['system'],  # type: ignore
-                        prompts[i]['messages'],  # type: ignore
-                        stop_sequences,
-                        temperature,
-                        max_tokens=max_tokens
-                    )
-                    futures.append(future)
-                    
-                concurrent.futures.wait(futures)
-                llm_call_anthropic_futures_to_texts(texts, futures)
+    else:
+        error_message = f"{PRINT_PREFIX} expected prompts to be dict or list, got {type(prompts)} instead"
+        rprint(f"[red][bold]{error_message}[/bold][/red]")
+        raise TypeError(error_message)
 
-        elif isinstance(client, OpenAI):
-            with concurrent.futures.ThreadPoolExecutor(max_workers=n) as executor:
-                futures = []
-                for i in range(n):
-                    future = executor.submit(
-                        llm_call_openai,
-                        client,
-                        prompts[i]['system'],  # type: ignore
-                        prompts[i]['messages'],  # type: ignore
-                        stop_sequences,
-                        temperature,
-                        1,
-                        max_tokens
-                    )
-                    futures.append(future)
-
-                concurrent.futures.wait(futures)
-
-                for i, future in enumerate(futures):
+    # states.json can route a state's calls to another model and temperature - an explicit model still wins
+    route = get_state_route(get_llm_state())
+    model = model if model is not None else route["model"]
+    temperature = route["temperature"] if route["temperature"] is not None else temperature
+
+    async_client = get_async_client(client)
+
+    slot_prompts = preflight_prompts(async_client, slot_prompts, max_tokens, model, trim)
+    if isinstance(prompts, dict):
+        prompts = slot_prompts[0]
+
+    # The index each slot below is yielded under - all of them, unless the batch API has already answered some
+    slot_indices = list(range(len(slot_prompts)))
+
+    # In batch API mode the whole fan-out is one batch job, and the results arrive together once it has ended
+    if use_batch_api() and not use_streaming(stream):
+        try:
+            batch_texts = await llm_call_batch_api(async_client, slot_prompts, stop_sequences, temperature, max_tokens, model=model)  # type: ignore
+        except Exception as exc:
+            rprint(f"{PRINT_PREFIX} [red][bold]Error during batch API call: {exc}[/bold][/red]")
+            batch_texts = [None] * len(slot_prompts)
+
+        for i, text in enumerate(batch_texts):
+            if text is not None:
+                yield i, text
+
+        slot_indices = [i for i, text in enumerate(batch_texts) if text is None]
+        if not slot_indices:
+            return
+
+        # A failed job (or request) is not worth another wait of hours, so its slots go out as interactive calls
+        rprint(f"[yellow]{PRINT_PREFIX} batch API returned nothing for slot(s) {', '.join(map(str, slot_indices))} - making them as interactive calls[/yellow]")
+        slot_prompts = [slot_prompts[i] for i in slot_indices]
+        if isinstance(prompts, dict):
+            n = len(slot_prompts)
+
+    # Each job fills a contiguous run of result slots starting at its offset. A job's call takes the
+    # slots still missing (relative to the offset), so failed or empty slots can be refilled with a fresh call
+    jobs: list[tuple[int, int, Callable[[list[int]], Awaitable[list[Optional[str]]]]]] = []
+
+    def add_job(offset: int, slot_count: int, call: Callable[[list[int]], Awaitable[list[Optional[str]]]]) -> None:
+        jobs.append((offset, slot_count, call))
+
+    if use_streaming(stream):
+        for i, prompt in enumerate(slot_prompts):
+            async def call_stream(slots: list[int], prompt: PromptsDict = prompt) -> list[Optional[str]]:
+                return [await llm_stream_text(async_client, prompt['system'], prompt['messages'], stop_sequences, temperature, max_tokens=max_tokens, model=model)]  # type: ignore
+
+            add_job(i, 1, call_stream)
+
+    elif isinstance(async_client, AsyncAnthropic):
+        # Identical requests sent together would all miss the prompt cache, so the first one goes
+        # out alone and the rest follow as soon as the server has started on it (and cached the prefix)
+        prefix_cached = asyncio.Event() if use_prompt_caching() and isinstance(prompts, dict) and len(slot_prompts) > 1 else None
+
+        for i, prompt in enumerate(slot_prompts):
+            async def call_anthropic(slots: list[int], prompt: PromptsDict = prompt, leader: bool = i == 0) -> list[Optional[str]]:
+                if prefix_cached is not None and not leader:
+                    await prefix_cached.wait()
+
+                try:
+                    llm_response = await llm_call_anthropic(async_client, prompt['system'], prompt['messages'], stop_sequences, temperature, max_tokens=max_tokens, model=model,  # type: ignore
+                                                            on_started=prefix_cached.set if prefix_cached is not None and leader else None)
+                finally:
+                    if prefix_cached is not None and leader:
+                        prefix_cached.set()
+
+                dprint(f"{PRINT_PREFIX} llm_response: {llm_response}")
+                return anthropic_response_texts(llm_response)
+
+            add_job(i, 1, call_anthropic)
+
+    elif isinstance(prompts, dict):
+        max_n = await get_openai_max_n(async_client)
+
+        # Split N into chunks of size <= MAX_N (e.g. N=5, MAX_N=4 -> [4, 1]), made concurrently
+        # but at most OPENAI_CHUNK_CONCURRENCY at a time
+        chunk_semaphore = asyncio.Semaphore(max(1, OPENAI_CHUNK_CONCURRENCY))
+
+        async def call_chunk(slots: list[int]) -> list[Optional[str]]:
+            chunk_n = len(slots)
+
+            async with chunk_semaphore:
+                llm_response = await llm_call_openai(async_client, prompts['system'], prompts['messages'], stop_sequences, temperature, chunk_n, max_tokens, model=model)  # type: ignore
+            dprint(f"{PRINT_PREFIX} llm_response (n={chunk_n}): {llm_response}")
+            return openai_response_texts(llm_response, chunk_n)
+
+        offset = 0
+        while offset < n:  # type: ignore
+            chunk_n = min(n - offset, max_n)  # type: ignore
+            add_job(offset, chunk_n, call_chunk)
+            offset += chunk_n
+
+    else:
+        async def call_openai(prompt: PromptsDict) -> Optional[str]:
+            llm_response = await llm_call_openai(async_client, prompt['system'], prompt['messages'], stop_sequences, temperature, 1, max_tokens, model=model)  # type: ignore
+            dprint(f"{PRINT_PREFIX} llm_response: {llm_response}")
+            return openai_response_texts(llm_response, 1)[0]
+
+        base_url = str(async_client.base_url)
+
+        if use_batching() and len(slot_prompts) > 1 and supports_batching(base_url):
+            # One /v1/completions request for all prompts. Once a server turns that down, this batch and
+            # every later one go out one request per prompt
+            async def call_batch(slots: list[int]) -> list[Optional[str]]:
+                batch_prompts = [slot_prompts[i] for i in slots]
+
+                if supports_batching(base_url):
                     try:
-                        llm_response = future.result()
-                        dprint(f"{PRINT_PREFIX} llm_response[{i}]: {llm_response}")
-                        texts[i] = llm_response.choices[0].message.content
+                        llm_response = await llm_call_openai_batch(async_client, batch_prompts, stop_sequences, temperature, max_tokens, model=model)  # type: ignore
+                        dprint(f"{PRINT_PREFIX} llm_response (batch of {len(batch_prompts)}): {llm_response}")
+
+                        texts = openai_batch_texts(llm_response, len(batch_prompts))
+                        if texts is not None:
+                            return texts
+
+                        mark_unsupported(base_url, f"{len(llm_response.choices)} completions for {len(batch_prompts)} prompts")
                     except Exception as exc:
-                        rprint(f"{PRINT_PREFIX} [red][bold]Error obtaining future result: {exc}[/bold][/red]")
-                        texts[i] = None
+                        if not is_unsupported(exc.__cause__ or exc):
+                            raise
+                        mark_unsupported(base_url, str(exc))
 
-        result = [text for text in texts if text is not None]
-        return result
-            
-    else:
-        error_message = f"{PRINT_PREFIX} expected prompts to be dict or list, got {type(prompts)} instead"
-        rprint(f"[red][bold]{error_message}[/bold][/red]")
-        raise TypeError(error_message)
\ No newline at end of file
+                results = await asyncio.gather(*(call_openai(prompt) for prompt in batch_prompts), return_exceptions=True)
+                for result in results:
+                    if isinstance(result, asyncio.CancelledError):
+                        raise result
+                    if isinstance(result, Exception):
+                        rprint(f"{PRINT_PREFIX} [red][bold]Error during API call: {result}[/bold][/red]")
+
+                return [result if isinstance(result, str) else None for result in results]
+
+            add_job(0, len(slot_prompts), call_batch)
+
+        else:
+            for i, prompt in enumerate(slot_prompts):
+                async def call_single(slots: list[int], prompt: PromptsDict = prompt) -> list[Optional[str]]:
+                    return [await call_openai(prompt)]
+
+                add_job(i, 1, call_single)
+
+    # Stragglers are hedged against the recent latencies of the same state on the same endpoint
+    hedger = get_hedger()
+    hedge_key = (get_llm_state(), str(async_client.base_url))
+
+    async def call_slots(call: Callable[[list[int]], Awaitable[list[Optional[str]]]], slots: list[int]) -> list[Optional[str]]:
+        if hedger is None:
+            return await call(slots)
+
+        # A hedge duplicates every slot of the job, so it costs that many requests
+        return await hedger.run(hedge_key, lambda: call(slots), request_count=len(slots))
+
+    async def run_job(offset: int, slot_count: int, call: Callable[[list[int]], Awaitable[list[Optional[str]]]]) -> tuple[int, list[Optional[str]]]:
+        texts: list[Optional[str]] = [None] * slot_count
+
+        for attempt in range(1 + LLM_REFILL_ATTEMPTS):
+            missing = [i for i, text in enumerate(texts) if text is None]
+            if not missing:
+                break
+
+            if attempt > 0:
+                dprint(f"{PRINT_PREFIX} refilling {len(missing)} failed slot(s) at offset {offset} (attempt {attempt}/{LLM_REFILL_ATTEMPTS})")
+
+            try:
+                for i, text in zip(missing, await call_slots(call, missing)):
+                    texts[i] = text
+            except asyncio.CancelledError:
+                raise
+            except Exception as exc:
+                rprint(f"{PRINT_PREFIX} [red][bold]Error during API call for slots {offset}-{offset + slot_count - 1}: {exc}[/bold][/red]")
+
+                # Non-retryable errors (bad request, auth) will not succeed on a refill either
+                if not is_retryable(exc.__cause__ or exc):
+                    break
+
+        return offset, texts
+
+    # Each job runs as its own task, so the priority it is tagged with stays out of the caller's context
+    tasks = [asyncio.ensure_future(run_with_llm_priority(priority if priority is not None else get_llm_priority(), run_job(offset, slot_count, call)))
+             for offset, slot_count, call in jobs]
+
+    try:
+        for next_done in asyncio.as_completed(tasks):
+            offset, texts = await next_done
+
+            for i, text in enumerate(texts):
+                if text is not None:
+                    yield slot_indices[offset + i], text
+    finally:
+        for task in tasks:
+            task.cancel()
+
+        # Calls cut short by a quorum or a deadline finish unwinding (and record their telemetry) before this returns
+        await asyncio.gather(*tasks, return_exceptions=True)
@@ -0,0 +1,100 @@
+import os
+import threading
+from typing import Optional
+
+from rich import print as rprint
+from utils.console_io import debug_print as dprint
+
+from utils.custom_types import Message
+from utils.enums import Role
+from utils.llm_retry import get_status_code
+
+
+PRINT_PREFIX = "[bold][LLMBatch][/bold]"
+
+# Responses from a server that has no /v1/completions endpoint, or does not take a list of prompts
+UNSUPPORTED_STATUS_CODES = {400, 404, 405, 422, 501}
+
+
+class ChatTemplate:
+    """
+    Renders chat messages to a raw completion prompt, the way the server's tokenizer would.
+    A trailing assistant message is left open, so the completion continues it (prefill).
+    """
+    def __init__(self, name: str, bos: str, turn_start: dict[str, str], turn_end: str, generation_prompt: str) -> None:
+        self.name = name
+        self.bos = bos
+        self.turn_start = turn_start
+        self.turn_end = turn_end
+        self.generation_prompt = generation_prompt
+
+    def render(self, system: str, messages: list[Message]) -> str:
+        turns = ([{"role": Role.SYSTEM.value, "content": system}] if system else []) + list(messages)
+        prompt = self.bos
+
+        for i, turn in enumerate(turns):
+            prompt += self.turn_start[turn["role"]] + turn["content"]
+
+            if turn["role"] == Role.ASSISTANT.value and i == len(turns) - 1:
+                return prompt
+
+            prompt += self.turn_end
+
+        return prompt + self.generation_prompt
+
+    @property
+    def stop_sequences(self) -> list[str]:
+        return [self.turn_end.strip()] if self.turn_end.strip() else []
+
+
+CHAT_TEMPLATES = {
+    "chatml": ChatTemplate("chatml",
+                           bos="",
+                           turn_start={role: f"<|im_start|>{role}\n" for role in ("system", "user", "assistant")},
+                           turn_end="<|im_end|>\n",
+                           generation_prompt="<|im_start|>assistant\n"),
+    "llama3": ChatTemplate("llama3",
+                           bos="<|begin_of_text|>",
+                           turn_start={role: f"<|start_header_id|>{role}<|end_header_id|>\n\n" for role in ("system", "user", "assistant")},
+                           turn_end="<|eot_id|>",
+                           generation_prompt="<|start_header_id|>assistant<|end_header_id|>\n\n"),
+}
+
+
+def use_batching() -> bool:
+    return os.environ.get("LLM_BATCH", "False").lower() == "true"
+
+def get_chat_template() -> ChatTemplate:
+    name = os.environ.get("LLM_BATCH_CHAT_TEMPLATE", "chatml").strip().lower()
+
+    if name not in CHAT_TEMPLATES:
+        error_message = f"{PRINT_PREFIX} unknown LLM_BATCH_CHAT_TEMPLATE {name!r}, expected one of {', '.join(CHAT_TEMPLATES)}"
+        rprint(f"[red][bold]{error_message}[/bold][/red]")
+        raise KeyError(error_message)
+
+    return CHAT_TEMPLATES[name]
+
+def is_unsupported(exc: BaseException) -> bool:
+    return get_status_code(exc) in UNSUPPORTED_STATUS_CODES
+
+
+_unsupported: set[str] = set()
+_unsupported_lock = threading.Lock()
+
+
+def supports_batching(base_url: str) -> bool:
+    """False once base_url has turned a batch down - until then it is assumed to take one."""
+    with _unsupported_lock:
+        return base_url not in _unsupported
+
+def mark_unsupported(base_url: str, reason: str) -> None:
+    with _unsupported_lock:
+        if base_url in _unsupported:
+            return
+        _unsupported.add(base_url)
+
+    dprint(f"{PRINT_PREFIX} {base_url} does not take batched prompts ({reason}) - sending them one per request")
+
+def reset_batch_support() -> None:
+    with _unsupported_lock:
+        _unsupported.clear()
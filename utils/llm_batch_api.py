@@ -0,0 +1,287 @@
+import asyncio
+import json
+import os
+import threading
+import time
+import uuid
+from abc import ABC, abstractmethod
+from typing import Any, Callable, Optional
+
+from anthropic import AsyncAnthropic
+from openai import AsyncOpenAI
+
+from rich import print as rprint
+from utils.console_io import debug_print as dprint
+
+
+PRINT_PREFIX = "[bold][LLMBatchAPI][/bold]"
+
+MODES = ("off", "provider", "file")
+
+ANTHROPIC_URL = "/v1/messages"
+OPENAI_URL = "/v1/chat/completions"
+
+# Job states reported by BatchAPI.status()
+RUNNING = "running"
+ENDED = "ended"
+FAILED = "failed"
+
+
+class BatchAPI(ABC):
+    """
+    Runs a set of requests (custom_id -> request body) as one asynchronous batch job.
+    results() maps each custom_id to its response body, or to None if that request failed.
+    """
+    @abstractmethod
+    async def submit(self, requests: dict[str, dict[str, Any]]) -> str:
+        ...
+
+    @abstractmethod
+    async def status(self, batch_id: str) -> str:
+        ...
+
+    @abstractmethod
+    async def results(self, batch_id: str) -> dict[str, Optional[dict[str, Any]]]:
+        ...
+
+    @abstractmethod
+    async def cancel(self, batch_id: str) -> None:
+        ...
+
+
+class AnthropicBatchAPI(BatchAPI):
+    """Anthropic Message Batches."""
+    def __init__(self, client: AsyncAnthropic) -> None:
+        self.client = client
+
+    async def submit(self, requests: dict[str, dict[str, Any]]) -> str:
+        batch = await self.client.messages.batches.create(requests=[{"custom_id": custom_id, "params": body} for custom_id, body in requests.items()])  # type: ignore
+        return batch.id
+
+    async def status(self, batch_id: str) -> str:
+        batch = await self.client.messages.batches.retrieve(batch_id)
+        return ENDED if batch.processing_status == "ended" else RUNNING
+
+    async def results(self, batch_id: str) -> dict[str, Optional[dict[str, Any]]]:
+        results: dict[str, Optional[dict[str, Any]]] = {}
+
+        async for entry in await self.client.messages.batches.results(batch_id):
+            results[entry.custom_id] = entry.result.message.model_dump(mode="json") if entry.result.type == "succeeded" else None
+
+        return results
+
+    async def cancel(self, batch_id: str) -> None:
+        await self.client.messages.batches.cancel(batch_id)
+
+
+def openai_batch_lines(requests: dict[str, dict[str, Any]], url: str) -> str:
+    return "".join(json.dumps({"custom_id": custom_id, "method": "POST", "url": url, "body": body}) + "\n" for custom_id, body in requests.items())
+
+def parse_openai_batch_output(output: str) -> dict[str, Optional[dict[str, Any]]]:
+    results: dict[str, Optional[dict[str, Any]]] = {}
+
+    for line in output.splitlines():
+        if not line.strip():
+            continue
+
+        entry = json.loads(line)
+        response = entry.get("response") or {}
+        results[entry["custom_id"]] = response.get("body") if not entry.get("error") and response.get("status_code") == 200 else None
+
+    return results
+
+
+class OpenAIBatchAPI(BatchAPI):
+    """OpenAI Batch API: the requests are uploaded as a JSONL file and the results downloaded as one."""
+    def __init__(self, client: AsyncOpenAI) -> None:
+        self.client = client
+
+    async def submit(self, requests: dict[str, dict[str, Any]]) -> str:
+        input_file = await self.client.files.create(file=("batch_input.jsonl", openai_batch_lines(requests, OPENAI_URL).encode("utf-8")), purpose="batch")
+        batch = await self.client.batches.create(input_file_id=input_file.id, endpoint=OPENAI_URL, completion_window="24h")
+        return batch.id
+
+    async def status(self, batch_id: str) -> str:
+        batch = await self.client.batches.retrieve(batch_id)
+
+        # An expired batch still has the results of the requests that finished in time
+        if batch.status in ("completed", "expired"):
+            return ENDED
+        if batch.status in ("failed", "cancelled"):
+            return FAILED
+        return RUNNING
+
+    async def results(self, batch_id: str) -> dict[str, Optional[dict[str, Any]]]:
+        batch = await self.client.batches.retrieve(batch_id)
+        if batch.output_file_id is None:
+            return {}
+
+        output = await self.client.files.content(batch.output_file_id)
+        return parse_openai_batch_output(output.text)
+
+    async def cancel(self, batch_id: str) -> None:
+        await self.client.batches.cancel(batch_id)
+
+
+class FileBatchAPI(BatchAPI):
+    """
+    Local stand-in for a provider batch API: a job is a <id>.input.jsonl file in `directory`, in OpenAI batch
+    format, and has ended once a FileBatchServer (or anything else) has written <id>.output.jsonl next to it.
+    """
+    def __init__(self, directory: str, url: str) -> None:
+        self.directory = directory
+        self.url = url
+
+    def path(self, batch_id: str, kind: str) -> str:
+        return os.path.join(self.directory, f"{batch_id}.{kind}.jsonl")
+
+    async def submit(self, requests: dict[str, dict[str, Any]]) -> str:
+        os.makedirs(self.directory, exist_ok=True)
+        batch_id = f"batch_{uuid.uuid4().hex}"
+
+        # Written under a temporary name so the server never sees a partial file
+        with open(self.path(batch_id, "input") + ".tmp", "w", encoding="utf-8") as f:
+            f.write(openai_batch_lines(requests, self.url))
+        os.replace(self.path(batch_id, "input") + ".tmp", self.path(batch_id, "input"))
+
+        return batch_id
+
+    async def status(self, batch_id: str) -> str:
+        if os.path.exists(self.path(batch_id, "output")):
+            return ENDED
+        if os.path.exists(self.path(batch_id, "cancelled")):
+            return FAILED
+        return RUNNING
+
+    async def results(self, batch_id: str) -> dict[str, Optional[dict[str, Any]]]:
+        with open(self.path(batch_id, "output"), "r", encoding="utf-8") as f:
+            return parse_openai_batch_output(f.read())
+
+    async def cancel(self, batch_id: str) -> None:
+        with open(self.path(batch_id, "cancelled"), "w", encoding="utf-8"):
+            pass
+
+
+class FileBatchServer:
+    """
+    Processes the jobs FileBatchAPI leaves in `directory`, answering each request with respond(url, body),
+    which returns the response body. A request respond() raises for is written out as failed.
+    """
+    def __init__(self, directory: str, respond: Callable[[str, dict[str, Any]], dict[str, Any]]) -> None:
+        self.directory = directory
+        self.respond = respond
+
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def process_pending(self) -> int:
+        """Answers every job without output or cancellation yet, and returns how many there were."""
+        if not os.path.isdir(self.directory):
+            return 0
+
+        processed = 0
+
+        for filename in sorted(os.listdir(self.directory)):
+            if not filename.endswith(".input.jsonl"):
+                continue
+
+            batch_id = filename.removesuffix(".input.jsonl")
+            output_path = os.path.join(self.directory, f"{batch_id}.output.jsonl")
+            if os.path.exists(output_path) or os.path.exists(os.path.join(self.directory, f"{batch_id}.cancelled.jsonl")):
+                continue
+
+            lines = []
+            with open(os.path.join(self.directory, filename), "r", encoding="utf-8") as f:
+                for line in f:
+                    if not line.strip():
+                        continue
+
+                    request = json.loads(line)
+                    try:
+                        response, error = {"status_code": 200, "body": self.respond(request["url"], request["body"])}, None
+                    except Exception as e:
+                        response, error = None, {"message": str(e)}
+
+                    lines.append(json.dumps({"custom_id": request["custom_id"], "response": response, "error": error}) + "\n")
+
+            with open(output_path + ".tmp", "w", encoding="utf-8") as f:
+                f.writelines(lines)
+            os.replace(output_path + ".tmp", output_path)
+
+            processed += 1
+
+        return processed
+
+    def start(self, poll_sec: float = 0.05) -> None:
+        def serve() -> None:
+            while not self._stop.wait(poll_sec):
+                self.process_pending()
+
+        self._thread = threading.Thread(target=serve, name="file-batch-server", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+
+
+def get_batch_api_mode() -> str:
+    mode = os.environ.get("LLM_BATCH_API", "off").strip().lower()
+
+    if mode not in MODES:
+        rprint(f"[yellow]{PRINT_PREFIX} Unknown LLM_BATCH_API {mode!r}, expected one of {', '.join(MODES)} - using off[/yellow]")
+        return "off"
+
+    return mode
+
+def use_batch_api() -> bool:
+    return get_batch_api_mode() != "off"
+
+def get_batch_api_dir() -> str:
+    return os.environ.get("LLM_BATCH_API_DIR") or os.path.join(os.environ.get("OUTPUT_DIR", "data/output/"), "batches")
+
+def get_batch_api(client: AsyncAnthropic | AsyncOpenAI) -> BatchAPI:
+    if get_batch_api_mode() == "file":
+        return FileBatchAPI(get_batch_api_dir(), ANTHROPIC_URL if isinstance(client, AsyncAnthropic) else OPENAI_URL)
+
+    if isinstance(client, AsyncAnthropic):
+        return AnthropicBatchAPI(client)
+
+    return OpenAIBatchAPI(client)
+
+async def cancel_batch(api: BatchAPI, batch_id: str) -> None:
+    try:
+        await api.cancel(batch_id)
+        dprint(f"{PRINT_PREFIX} cancelled {batch_id}")
+    except Exception as e:
+        dprint(f"{PRINT_PREFIX} unable to cancel {batch_id}: {e}")
+
+async def run_batch(api: BatchAPI, requests: dict[str, dict[str, Any]], poll_sec: Optional[float] = None) -> dict[str, Optional[dict[str, Any]]]:
+    """
+    Submits requests as one batch job, polls every poll_sec (LLM_BATCH_API_POLL_SEC) until it has ended and
+    returns its results. A job that failed as a whole has no results. Cancelling the caller cancels the job.
+    """
+    if poll_sec is None:
+        poll_sec = float(os.environ.get("LLM_BATCH_API_POLL_SEC", "30"))
+
+    batch_id = await api.submit(requests)
+    submitted_at = time.monotonic()
+    dprint(f"{PRINT_PREFIX} submitted {len(requests)} request(s) as {batch_id}")
+
+    try:
+        while (status := await api.status(batch_id)) == RUNNING:
+            await asyncio.sleep(poll_sec)
+    except asyncio.CancelledError:
+        # Best effort - the job is billed for whatever it has already run either way
+        asyncio.ensure_future(cancel_batch(api, batch_id))
+        raise
+
+    if status == FAILED:
+        rprint(f"[red][bold]{PRINT_PREFIX} batch {batch_id} failed after {time.monotonic() - submitted_at:0.0f}s[/bold][/red]")
+        return {}
+
+    results = await api.results(batch_id)
+    dprint(f"{PRINT_PREFIX} {batch_id} ended after {time.monotonic() - submitted_at:0.0f}s with {sum(result is not None for result in results.values())}/{len(requests)} result(s)")
+
+    return results
@@ -0,0 +1,188 @@
+import math
+import os
+import threading
+from collections import deque
+from typing import Any, Awaitable, Callable, Iterable, Optional, TypeVar
+
+import numpy as np
+
+from utils.console_io import debug_print as dprint
+from utils.llm_telemetry import get_llm_state, get_telemetry_path, load_events
+from utils.llm_trace import get_llm_backend
+
+
+PRINT_PREFIX = "[bold][LLMBudget][/bold]"
+
+# finish/stop reasons meaning the response was cut off by max_tokens
+TRUNCATED_FINISH_REASONS = {"length", "max_tokens"}
+
+T = TypeVar("T")
+
+# (completion tokens, truncated) for each completion in a response
+Completions = list[tuple[Optional[int], bool]]
+
+
+class GenerationBudgets:
+    """
+    Learns a max_tokens cap per agent state from the completion lengths it has produced: the `percentile`
+    of recent lengths times `multiplier`, clamped to [min_tokens, max_tokens]. A "max_tokens" set on the
+    state in states.json overrides the learned cap. States with fewer than min_samples lengths get no cap.
+    Nothing is learned while LLM_BACKEND is "record" or "replay": the cap is part of the request a trace is
+    keyed on, so it has to be the same when a trace is replayed as when it was recorded.
+    """
+    def __init__(self, learn: bool, percentile: float, multiplier: float, min_samples: int, window: int, min_tokens: int, max_tokens: int, retry_multiplier: float) -> None:
+        self.learn = learn
+        self.percentile = percentile
+        self.multiplier = multiplier
+        self.min_samples = min_samples
+        self.window = window
+        self.min_tokens = min_tokens
+        self.max_tokens = max(min_tokens, max_tokens)
+        self.retry_multiplier = max(1.1, retry_multiplier)
+
+        self.truncations = 0
+        self.extensions = 0
+
+        self._lock = threading.Lock()
+        self._samples: dict[str, deque[int]] = {}
+        self._overrides: dict[str, int] = {}
+
+    def set_override(self, state: str, max_tokens: int) -> None:
+        with self._lock:
+            self._overrides[state] = max_tokens
+
+    def add(self, state: str, completion_tokens: int) -> None:
+        with self._lock:
+            self._samples.setdefault(state, deque(maxlen=self.window)).append(completion_tokens)
+
+    def is_learning(self) -> bool:
+        return self.learn and get_llm_backend() == "live"
+
+    def observe(self, state: str, completions: Completions) -> None:
+        learning = self.is_learning()
+
+        for completion_tokens, truncated in completions:
+            if truncated:
+                # A truncated length says nothing about how long the completion wanted to be
+                self.truncations += 1
+            elif completion_tokens is not None and learning:
+                self.add(state, completion_tokens)
+
+    def get_max_tokens(self, state: str) -> Optional[int]:
+        with self._lock:
+            if state in self._overrides:
+                return self._overrides[state]
+
+            samples = list(self._samples.get(state, ()))
+
+        if not self.is_learning() or len(samples) < self.min_samples:
+            return None
+
+        cap = math.ceil(float(np.percentile(np.array(samples), self.percentile)) * self.multiplier)
+        return min(self.max_tokens, max(self.min_tokens, cap))
+
+    def extend(self, max_tokens: int) -> Optional[int]:
+        """Returns the budget to retry a truncated response with, or None if it cannot grow any further."""
+        if max_tokens >= self.max_tokens:
+            return None
+
+        self.extensions += 1
+        return min(self.max_tokens, math.ceil(max_tokens * self.retry_multiplier))
+
+    def summary(self) -> list[dict[str, Any]]:
+        with self._lock:
+            states = sorted(set(self._samples) | set(self._overrides))
+            sample_counts = {state: len(self._samples.get(state, ())) for state in states}
+
+        return [{"state": state,
+                 "samples": sample_counts[state],
+                 "max_tokens": self.get_max_tokens(state),
+                 "override": state in self._overrides} for state in states]
+
+
+_budgets: Optional[GenerationBudgets] = None
+_budgets_lock = threading.Lock()
+
+
+def seed_from_telemetry(budgets: GenerationBudgets, path: str) -> None:
+    """Warms the budgets up with the completion lengths in an earlier session's telemetry file."""
+    if not os.path.exists(path):
+        return
+
+    seeded = 0
+
+    try:
+        for event in load_events(path):
+            finish_reasons = event.get("finish_reasons") or []
+            if event.get("error") or not event.get("completion_tokens") or "closed" in finish_reasons:
+                continue
+
+            # Telemetry only has the total for n > 1, so every choice is taken to be average length
+            n = max(1, event.get("n") or 1)
+            budgets.observe(event.get("state") or "unknown",
+                            [(event["completion_tokens"] // n, reason in TRUNCATED_FINISH_REASONS) for reason in (finish_reasons or [None] * n)])
+            seeded += 1
+    except (OSError, ValueError) as e:
+        dprint(f"{PRINT_PREFIX} unable to seed budgets from {path}: {e}")
+        return
+
+    dprint(f"{PRINT_PREFIX} seeded budgets from {seeded} calls in {path}")
+
+def get_generation_budgets() -> GenerationBudgets:
+    """Returns the process-wide budgets, configured from .env and seeded from the telemetry file on first use."""
+    global _budgets
+
+    with _budgets_lock:
+        if _budgets is None:
+            _budgets = GenerationBudgets(learn=os.environ.get("LLM_BUDGET", "True").lower() == "true",
+                                         percentile=float(os.environ.get("LLM_BUDGET_PERCENTILE", "99")),
+                                         multiplier=float(os.environ.get("LLM_BUDGET_MULTIPLIER", "1.5")),
+                                         min_samples=int(os.environ.get("LLM_BUDGET_MIN_SAMPLES", "20")),
+                                         window=int(os.environ.get("LLM_BUDGET_WINDOW", "500")),
+                                         min_tokens=int(os.environ.get("LLM_BUDGET_MIN_TOKENS", "256")),
+                                         max_tokens=int(os.environ.get("LLM_BUDGET_MAX_TOKENS", "8192")),
+                                         retry_multiplier=float(os.environ.get("LLM_BUDGET_RETRY_MULTIPLIER", "2")))
+
+            if _budgets.is_learning():
+                seed_from_telemetry(_budgets, get_telemetry_path())
+
+    return _budgets
+
+def reset_generation_budgets() -> None:
+    global _budgets
+
+    with _budgets_lock:
+        _budgets = None
+
+def set_max_tokens_overrides(overrides: Iterable[tuple[str, int]]) -> None:
+    budgets = get_generation_budgets()
+    for state, max_tokens in overrides:
+        budgets.set_override(state, max_tokens)
+
+async def call_with_generation_budget(call: Callable[[Optional[int]], Awaitable[T]], max_tokens: Optional[int], get_completions: Callable[[T], Completions]) -> T:
+    """
+    Awaits call(max_tokens) and learns from the completion lengths of its response. If the caller gave
+    no max_tokens, the current state's budget is used instead, and a response it truncated is requested
+    again with a larger budget until it fits or reaches LLM_BUDGET_MAX_TOKENS.
+    """
+    budgets = get_generation_budgets()
+    state = get_llm_state()
+
+    budgeted = max_tokens is None
+    if budgeted:
+        max_tokens = budgets.get_max_tokens(state)
+
+    while True:
+        response = await call(max_tokens)
+        completions = get_completions(response)
+        budgets.observe(state, completions)
+
+        if not budgeted or max_tokens is None or not any(truncated for _, truncated in completions):
+            return response
+
+        extended = budgets.extend(max_tokens)
+        if extended is None:
+            return response
+
+        dprint(f"{PRINT_PREFIX} {state} response truncated at {max_tokens} tokens - retrying with {extended}")
+        max_tokens = extended
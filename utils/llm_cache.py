@@ -0,0 +1,221 @@
+import asyncio
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from typing import Any, Awaitable, Callable, Optional, TypeVar
+
+from pydantic import BaseModel
+
+from rich import print as rprint
+from utils.console_io import debug_print as dprint
+
+
+PRINT_PREFIX = "[bold][LLMCache][/bold]"
+
+CACHE_FILENAME = "llm_cache.sqlite"
+
+ResponseT = TypeVar("ResponseT", bound=BaseModel)
+
+
+class LLMCache:
+    """
+    Content-addressed store for LLM responses, backed by SQLite.
+    Entries expire after ttl_sec, and the least recently used entries are evicted once the store exceeds max_bytes.
+    """
+    PRINT_PREFIX = PRINT_PREFIX
+
+    def __init__(self, path: str, max_bytes: int, ttl_sec: float, max_temperature: float) -> None:
+        self.path = path
+        self.max_bytes = max_bytes
+        self.ttl_sec = ttl_sec
+        self.max_temperature = max_temperature
+
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.evictions = 0
+
+        self._lock = threading.Lock()
+        self._in_flight: dict[str, asyncio.Future] = {}
+
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS responses (
+                key TEXT PRIMARY KEY,
+                value TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                created_at REAL NOT NULL,
+                last_access REAL NOT NULL
+            )
+        """)
+        self._conn.execute("CREATE INDEX IF NOT EXISTS responses_last_access ON responses (last_access)")
+        self._conn.commit()
+
+    @staticmethod
+    def make_key(provider: str, model: str, system: str, messages: list, stop_sequences: list[str], temperature: float, max_tokens: Optional[int], n: int = 1) -> str:
+        # Only role and content are part of the request - timestamps would defeat the cache
+        request = {
+            "provider": provider,
+            "model": model,
+            "system": system,
+            "messages": [{"role": message["role"], "content": message["content"]} for message in messages],
+            "stop_sequences": list(stop_sequences),
+            "temperature": temperature,
+            "max_tokens": max_tokens,
+            "n": n,
+        }
+
+        return hashlib.sha256(json.dumps(request, sort_keys=True).encode("utf-8")).hexdigest()
+
+    def is_cacheable(self, temperature: float) -> bool:
+        return temperature <= self.max_temperature
+
+    def get(self, key: str) -> Optional[str]:
+        now = time.time()
+
+        with self._lock:
+            row = self._conn.execute("SELECT value, created_at FROM responses WHERE key = ?", (key,)).fetchone()
+
+            if row is None:
+                return None
+
+            value, created_at = row
+            if self.ttl_sec > 0 and now - created_at > self.ttl_sec:
+                self._conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+                self._conn.commit()
+                return None
+
+            self._conn.execute("UPDATE responses SET last_access = ? WHERE key = ?", (now, key))
+            self._conn.commit()
+
+        return value
+
+    def put(self, key: str, value: str) -> None:
+        now = time.time()
+        size = len(value.encode("utf-8"))
+
+        with self._lock:
+            self._conn.execute("INSERT OR REPLACE INTO responses (key, value, size, created_at, last_access) VALUES (?, ?, ?, ?, ?)",
+                               (key, value, size, now, now))
+            self._evict()
+            self._conn.commit()
+
+    def _evict(self) -> None:
+        if self.ttl_sec > 0:
+            cursor = self._conn.execute("DELETE FROM responses WHERE created_at < ?", (time.time() - self.ttl_sec,))
+            self.evictions += max(cursor.rowcount, 0)
+
+        total_bytes = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+
+        if total_bytes <= self.max_bytes:
+            return
+
+        for key, size in self._conn.execute("SELECT key, size FROM responses ORDER BY last_access ASC").fetchall():
+            if total_bytes <= self.max_bytes:
+                break
+
+            self._conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+            total_bytes -= size
+            self.evictions += 1
+
+    def clear(self) -> None:
+        with self._lock:
+            self._conn.execute("DELETE FROM responses")
+            self._conn.commit()
+
+    async def get_or_call(self, key: str, response_type: type[ResponseT], call: Callable[[], Awaitable[ResponseT]]) -> ResponseT:
+        """
+        Returns the cached response for key, or awaits call() and caches its result.
+        Identical requests that arrive while call() is in flight share its result instead of issuing their own.
+        """
+        cached = self.get(key)
+        if cached is not None:
+            self.hits += 1
+            dprint(f"{self.PRINT_PREFIX} hit {key[:12]}")
+            return response_type.model_validate_json(cached)
+
+        in_flight = self._in_flight.get(key)
+        if in_flight is not None:
+            await asyncio.wait({in_flight})
+
+            # The call we were waiting on was cancelled by its own caller, so make the call ourselves
+            if in_flight.cancelled():
+                return await self.get_or_call(key, response_type, call)
+
+            self.coalesced += 1
+            dprint(f"{self.PRINT_PREFIX} coalesced {key[:12]}")
+            return response_type.model_validate_json(in_flight.result())
+
+        self.misses += 1
+
+        future: asyncio.Future = asyncio.get_running_loop().create_future()
+        self._in_flight[key] = future
+
+        try:
+            response = await call()
+            value = response.model_dump_json()
+            self.put(key, value)
+            future.set_result(value)
+            return response
+
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+
+        except Exception as e:
+            future.set_exception(e)
+            # Waiters receive the exception; mark it retrieved so it is not logged when nobody was waiting
+            future.exception()
+            raise
+
+        finally:
+            del self._in_flight[key]
+
+    def get_stats(self) -> dict[str, Any]:
+        with self._lock:
+            entries, total_bytes = self._conn.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM responses").fetchone()
+
+        lookups = self.hits + self.misses + self.coalesced
+
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "coalesced": self.coalesced,
+            "evictions": self.evictions,
+            "hit_rate": (self.hits + self.coalesced) / lookups if lookups else 0.0,
+            "entries": entries,
+            "bytes": total_bytes,
+        }
+
+
+_llm_cache: Optional[LLMCache] = None
+_llm_cache_lock = threading.Lock()
+
+
+def get_llm_cache() -> Optional[LLMCache]:
+    """Returns the process-wide cache, or None unless LLM_CACHE is set to "True" in .env."""
+    global _llm_cache
+
+    if os.environ.get("LLM_CACHE", "False").lower() != "true":
+        return None
+
+    with _llm_cache_lock:
+        if _llm_cache is None:
+            output_dir = os.environ.get("OUTPUT_DIR", "data/output/")
+            os.makedirs(output_dir, exist_ok=True)
+
+            try:
+                _llm_cache = LLMCache(path=os.path.join(output_dir, CACHE_FILENAME),
+                                      max_bytes=int(float(os.environ.get("LLM_CACHE_MAX_MB", "256")) * 1024 * 1024),
+                                      ttl_sec=float(os.environ.get("LLM_CACHE_TTL_SEC", "604800")),
+                                      max_temperature=float(os.environ.get("LLM_CACHE_MAX_TEMPERATURE", "0.0")))
+            except sqlite3.Error as e:
+                rprint(f"[yellow]{PRINT_PREFIX} Unable to open {CACHE_FILENAME}, continuing without a cache: {e}[/yellow]")
+                return None
+
+            dprint(f"{PRINT_PREFIX} opened {_llm_cache.path}")
+
+    return _llm_cache
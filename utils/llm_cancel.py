@@ -0,0 +1,123 @@
+import asyncio
+import threading
+import time
+import weakref
+from typing import Any, Callable, Coroutine, Optional
+
+from utils.console_io import debug_print as dprint
+from utils.custom_exceptions import LLMCancelledError
+
+
+PRINT_PREFIX = "[bold][LLMCancel][/bold]"
+
+
+class CancelToken:
+    """
+    Cancellation token and deadline for LLM calls, safe to trigger from any thread (a signal handler,
+    a keyboard listener). Cancelling aborts every call running under the token, or under a child of it,
+    and they raise LLMCancelledError. Reaching the deadline instead ends the calls with the results
+    that have arrived so far.
+    """
+    def __init__(self, budget_sec: Optional[float] = None, parent: Optional["CancelToken"] = None) -> None:
+        self.deadline = time.monotonic() + budget_sec if budget_sec is not None else None
+        if parent is not None and parent.deadline is not None:
+            self.deadline = min(self.deadline, parent.deadline) if self.deadline is not None else parent.deadline
+
+        self.reason: Optional[str] = None
+
+        self._lock = threading.Lock()
+        self._cancelled = threading.Event()
+        self._callbacks: list[Callable[[], None]] = []
+
+        if parent is not None:
+            child = weakref.ref(self)
+
+            def cancel_child() -> None:
+                token = child()
+                if token is not None:
+                    token.cancel(parent.reason)
+
+            # The parent only holds the child weakly, and forgets it once it is gone - children are made per stage
+            # from a token that lasts the whole run, which would otherwise collect them all
+            weakref.finalize(self, parent.add_callback(cancel_child))
+
+    @property
+    def cancelled(self) -> bool:
+        return self._cancelled.is_set()
+
+    def child(self, budget_sec: Optional[float] = None) -> "CancelToken":
+        """Returns a token that is cancelled with this one and has the earlier of the two deadlines."""
+        return CancelToken(budget_sec, parent=self)
+
+    def cancel(self, reason: Optional[str] = None) -> None:
+        with self._lock:
+            if self._cancelled.is_set():
+                return
+
+            self.reason = reason or "cancelled"
+            self._cancelled.set()
+            callbacks, self._callbacks = self._callbacks, []
+
+        for callback in callbacks:
+            callback()
+
+    def add_callback(self, callback: Callable[[], None]) -> Callable[[], None]:
+        """Calls callback once the token is cancelled (right away if it already is). Returns a function that removes it."""
+        with self._lock:
+            if not self._cancelled.is_set():
+                self._callbacks.append(callback)
+                return lambda: self._remove_callback(callback)
+
+        callback()
+        return lambda: None
+
+    def _remove_callback(self, callback: Callable[[], None]) -> None:
+        with self._lock:
+            if callback in self._callbacks:
+                self._callbacks.remove(callback)
+
+    def remaining(self) -> Optional[float]:
+        return max(0.0, self.deadline - time.monotonic()) if self.deadline is not None else None
+
+    def expired(self) -> bool:
+        remaining = self.remaining()
+        return remaining is not None and remaining <= 0
+
+    def check(self) -> None:
+        if self.cancelled:
+            raise LLMCancelledError(f"{PRINT_PREFIX} LLM calls cancelled: {self.reason}")
+
+    async def run(self, coro: Coroutine[Any, Any, Any]) -> bool:
+        """
+        Awaits coro until it completes, the token is cancelled or the deadline passes, and cancels it in
+        the latter two cases. Returns False if the deadline cut it short, and raises LLMCancelledError if
+        the token was cancelled.
+        """
+        if self.cancelled:
+            coro.close()
+            self.check()
+
+        loop = asyncio.get_running_loop()
+        task = asyncio.ensure_future(coro)
+        remove_callback = self.add_callback(lambda: loop.call_soon_threadsafe(task.cancel))
+
+        try:
+            done, _ = await asyncio.wait({task}, timeout=self.remaining())
+
+            if not done:
+                task.cancel()
+                await asyncio.wait({task})
+
+                if not self.cancelled:
+                    dprint(f"{PRINT_PREFIX} deadline reached - cancelled outstanding LLM calls")
+                    return False
+
+            if task.cancelled():
+                self.check()
+
+            task.result()
+            return True
+
+        finally:
+            remove_callback()
+            task.cancel()
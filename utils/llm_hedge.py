@@ -0,0 +1,153 @@
+import asyncio
+import os
+import threading
+import time
+from collections import deque
+from typing import Any, Awaitable, Callable, Hashable, Optional, TypeVar
+
+import numpy as np
+
+from utils.console_io import debug_print as dprint
+
+
+PRINT_PREFIX = "[bold][LLMHedge][/bold]"
+
+T = TypeVar("T")
+
+
+class HedgeBudget:
+    """
+    Caps hedges at `ratio` of primary requests: every primary request deposits `ratio` tokens (up to `reserve`)
+    and every hedged request spends one. The bucket starts empty, so hedging can never run ahead of the cap.
+    """
+    def __init__(self, ratio: float, reserve: float) -> None:
+        self.ratio = ratio
+        self.reserve = max(1.0, reserve)
+        self.tokens = 0.0
+
+    def on_request(self, count: int = 1) -> None:
+        self.tokens = min(self.reserve, self.tokens + self.ratio * count)
+
+    def try_spend(self, count: int = 1) -> bool:
+        # Tolerate float drift, so e.g. ten deposits of 0.1 buy one hedge
+        if self.tokens >= count - 1e-9:
+            self.tokens = max(0.0, self.tokens - count)
+            return True
+        return False
+
+
+class LatencyTracker:
+    """Recent successful call latencies per key, used to pick the hedging delay."""
+    def __init__(self, window: int, min_samples: int) -> None:
+        self.window = window
+        self.min_samples = min_samples
+        self._samples: dict[Hashable, deque[float]] = {}
+        self._lock = threading.Lock()
+
+    def add(self, key: Hashable, latency_sec: float) -> None:
+        with self._lock:
+            self._samples.setdefault(key, deque(maxlen=self.window)).append(latency_sec)
+
+    def percentile(self, key: Hashable, percentile: float) -> Optional[float]:
+        with self._lock:
+            samples = list(self._samples.get(key, ()))
+
+        if len(samples) < self.min_samples:
+            return None
+
+        return float(np.percentile(np.array(samples), percentile))
+
+
+class Hedger:
+    """
+    Runs a call and, if it is still outstanding after the `percentile` of recent latencies for its key,
+    fires a duplicate. The first to succeed wins and the other is cancelled. A call that stands for several
+    requests (the choices of an n chunk, the prompts of a batch) is counted, and charged to the budget, as that many.
+    """
+    def __init__(self, percentile: float, tracker: LatencyTracker, budget: HedgeBudget) -> None:
+        self.percentile = percentile
+        self.tracker = tracker
+        self.budget = budget
+
+        self.requests = 0
+        self.hedges = 0
+        self.hedge_wins = 0
+
+    async def _timed(self, key: Hashable, call: Callable[[], Awaitable[T]]) -> T:
+        started_at = time.perf_counter()
+        result = await call()
+        self.tracker.add(key, time.perf_counter() - started_at)
+        return result
+
+    async def run(self, key: Hashable, call: Callable[[], Awaitable[T]], request_count: int = 1) -> T:
+        self.requests += request_count
+        self.budget.on_request(request_count)
+
+        delay = self.tracker.percentile(key, self.percentile)
+        primary = asyncio.ensure_future(self._timed(key, call))
+
+        if delay is None:
+            return await primary
+
+        tasks = {primary}
+
+        try:
+            done, _ = await asyncio.wait(tasks, timeout=delay)
+            if done or not self.budget.try_spend(request_count):
+                return await primary
+
+            self.hedges += request_count
+            dprint(f"{PRINT_PREFIX} {key} still outstanding after p{self.percentile:g} ({delay:0.2f}s) - hedging")
+
+            hedge = asyncio.ensure_future(self._timed(key, call))
+            tasks.add(hedge)
+            pending = set(tasks)
+
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+
+                for task in done:
+                    if task.exception() is None:
+                        if task is hedge:
+                            self.hedge_wins += request_count
+                        return task.result()
+
+            # Both failed - surface the primary's error, as an unhedged call would have
+            return primary.result()
+
+        finally:
+            for task in tasks:
+                task.cancel()
+
+            # The losing call finishes unwinding (and records its telemetry) before the winner's result is returned
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+    def get_stats(self) -> dict[str, Any]:
+        return {
+            "requests": self.requests,
+            "hedges": self.hedges,
+            "hedge_wins": self.hedge_wins,
+            "hedge_rate": self.hedges / self.requests if self.requests else 0.0,
+        }
+
+
+_hedger: Optional[Hedger] = None
+_hedger_lock = threading.Lock()
+
+
+def get_hedger() -> Optional[Hedger]:
+    """Returns the process-wide hedger, or None unless LLM_HEDGE is set to "True" in .env."""
+    global _hedger
+
+    if os.environ.get("LLM_HEDGE", "False").lower() != "true":
+        return None
+
+    with _hedger_lock:
+        if _hedger is None:
+            _hedger = Hedger(percentile=float(os.environ.get("LLM_HEDGE_PERCENTILE", "95")),
+                             tracker=LatencyTracker(window=int(os.environ.get("LLM_HEDGE_WINDOW", "200")),
+                                                    min_samples=int(os.environ.get("LLM_HEDGE_MIN_SAMPLES", "20"))),
+                             budget=HedgeBudget(ratio=float(os.environ.get("LLM_HEDGE_MAX_EXTRA_PCT", "5")) / 100,
+                                                reserve=float(os.environ.get("LLM_HEDGE_RESERVE", "2"))))
+
+    return _hedger
@@ -0,0 +1,187 @@
+import asyncio
+import os
+import threading
+import time
+from typing import Any, AsyncIterator, Optional
+from contextlib import asynccontextmanager
+
+from utils.console_io import debug_print as dprint
+
+from utils.llm_retry import get_status_code
+from utils.llm_scheduler import Waiter, get_llm_priority, get_priority_aging_sec, pick_waiter
+
+
+PRINT_PREFIX = "[bold][LLMLimiter][/bold]"
+
+# Responses that mean the endpoint is over capacity and concurrency should back off
+OVERLOAD_STATUS_CODES = {429, 503, 529}
+
+
+class TokenBucket:
+    """Allows `rate` requests per second on average, with bursts of up to `burst` requests."""
+    def __init__(self, rate: float, burst: float) -> None:
+        self.rate = rate
+        self.burst = max(1.0, burst)
+        self.tokens = self.burst
+        self.updated_at = time.monotonic()
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+
+    async def take(self) -> None:
+        while True:
+            self._refill()
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return
+
+            await asyncio.sleep((1 - self.tokens) / self.rate)
+
+
+class AdaptiveLimiter:
+    """
+    Additive-increase/multiplicative-decrease concurrency limit for one endpoint and model.
+    Every success raises the limit by about one per limit's worth of completed requests, and an overload
+    response (429/503/529) multiplies it by `decrease`. Requests over the limit wait in priority order
+    (see utils.llm_scheduler), first come first served within a priority.
+    Must only be used from the LLM event loop.
+    """
+    def __init__(self, endpoint: str, model: str, initial_limit: float, min_limit: float, max_limit: float, decrease: float, bucket: Optional[TokenBucket] = None, aging_sec: float = 0.0) -> None:
+        self.endpoint = endpoint
+        self.model = model
+        self.min_limit = max(1.0, min_limit)
+        self.max_limit = max(self.min_limit, max_limit)
+        self.limit = min(self.max_limit, max(self.min_limit, initial_limit))
+        self.decrease = decrease
+        self.bucket = bucket
+        self.aging_sec = aging_sec
+
+        self.in_flight = 0
+        self.successes = 0
+        self.overloads = 0
+        self.errors = 0
+
+        self._waiters: list[Waiter] = []
+        self._last_decrease = 0.0
+
+    @property
+    def queue_depth(self) -> int:
+        return len(self._waiters)
+
+    def _has_capacity(self) -> bool:
+        return self.in_flight < int(self.limit)
+
+    def _wake(self) -> None:
+        while self._waiters and self._has_capacity():
+            waiter = pick_waiter(self._waiters, self.aging_sec)
+            self._waiters.remove(waiter)  # type: ignore
+            if not waiter.future.done():  # type: ignore
+                self.in_flight += 1
+                waiter.future.set_result(None)  # type: ignore
+
+    async def acquire(self) -> float:
+        """Waits for a request slot and returns its start time, to be passed back to release()."""
+        if self.bucket is not None:
+            await self.bucket.take()
+
+        if self._waiters or not self._has_capacity():
+            waiter = Waiter(get_llm_priority(), asyncio.get_running_loop().create_future())
+            self._waiters.append(waiter)
+            self._wake()
+
+            try:
+                await waiter.future
+            except asyncio.CancelledError:
+                if waiter.future.done() and not waiter.future.cancelled():
+                    # The slot was handed over just as we were cancelled, so pass it on
+                    self.in_flight -= 1
+                    self._wake()
+                elif waiter in self._waiters:
+                    self._waiters.remove(waiter)
+                raise
+        else:
+            self.in_flight += 1
+
+        return time.monotonic()
+
+    def release(self, started_at: float, exc: Optional[BaseException] = None) -> None:
+        self.in_flight -= 1
+
+        if exc is None:
+            self.successes += 1
+            self.limit = min(self.max_limit, self.limit + 1 / self.limit)
+
+        elif get_status_code(exc) in OVERLOAD_STATUS_CODES:
+            self.overloads += 1
+
+            # Requests that were already in flight when the limit was last cut report the same overload,
+            # so only the first of them decreases the limit
+            if started_at >= self._last_decrease:
+                self.limit = max(self.min_limit, self.limit * self.decrease)
+                self._last_decrease = time.monotonic()
+                dprint(f"{PRINT_PREFIX} {self.endpoint} {self.model} overloaded - limit cut to {self.limit:0.2f}")
+
+        elif not isinstance(exc, asyncio.CancelledError):
+            self.errors += 1
+
+        self._wake()
+
+    @asynccontextmanager
+    async def slot(self) -> AsyncIterator[None]:
+        started_at = await self.acquire()
+
+        try:
+            yield
+        except BaseException as exc:
+            self.release(started_at, exc)
+            raise
+        else:
+            self.release(started_at)
+
+    def get_metrics(self) -> dict[str, Any]:
+        return {
+            "endpoint": self.endpoint,
+            "model": self.model,
+            "limit": round(self.limit, 2),
+            "in_flight": self.in_flight,
+            "queue_depth": self.queue_depth,
+            "successes": self.successes,
+            "overloads": self.overloads,
+            "errors": self.errors,
+        }
+
+
+_limiters: dict[tuple[str, str], AdaptiveLimiter] = {}
+_limiters_lock = threading.Lock()
+
+
+def get_limiter(endpoint: str, model: str) -> AdaptiveLimiter:
+    """Returns the process-wide limiter for endpoint and model, configured from .env on first use."""
+    key = (endpoint, model)
+
+    with _limiters_lock:
+        limiter = _limiters.get(key)
+        if limiter is None:
+            max_limit = float(os.environ.get("LLM_LIMIT_MAX", os.environ.get("LLM_MAX_IN_FLIGHT", "16")))
+            rate = float(os.environ.get("LLM_RATE_PER_SEC", "0"))
+
+            limiter = AdaptiveLimiter(endpoint, model,
+                                      initial_limit=float(os.environ.get("LLM_LIMIT_INITIAL", "8")),
+                                      min_limit=float(os.environ.get("LLM_LIMIT_MIN", "1")),
+                                      max_limit=max_limit,
+                                      decrease=float(os.environ.get("LLM_LIMIT_DECREASE", "0.5")),
+                                      bucket=TokenBucket(rate, float(os.environ.get("LLM_RATE_BURST", str(max_limit)))) if rate > 0 else None,
+                                      aging_sec=get_priority_aging_sec())
+            _limiters[key] = limiter
+
+    return limiter
+
+def get_limiter_metrics() -> list[dict[str, Any]]:
+    with _limiters_lock:
+        return [limiter.get_metrics() for limiter in _limiters.values()]
+
+def reset_limiters() -> None:
+    with _limiters_lock:
+        _limiters.clear()
@@ -0,0 +1,197 @@
+import asyncio
+import os
+import random
+import threading
+import time
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Optional
+
+import openai
+from openai import AsyncOpenAI
+
+from rich import print as rprint
+from utils.console_io import debug_print as dprint
+
+from utils.llm_retry import get_status_code
+
+
+PRINT_PREFIX = "[bold][LLMPool][/bold]"
+
+
+def get_openai_base_urls() -> list[str]:
+    """Returns OPENAI_BASE_URLS (comma separated) if set, otherwise just OPENAI_BASE_URL."""
+    base_urls = [base_url.strip() for base_url in os.environ.get("OPENAI_BASE_URLS", "").split(",") if base_url.strip()]
+    if base_urls:
+        return base_urls
+
+    base_url = os.environ.get("OPENAI_BASE_URL")
+    return [base_url] if base_url else []
+
+def normalize_base_url(base_url: Any) -> str:
+    return str(base_url).rstrip("/")
+
+def is_endpoint_failure(exc: BaseException) -> bool:
+    """Server errors, timeouts and connection errors count against an endpoint's health - client errors do not."""
+    if isinstance(exc, (asyncio.TimeoutError, openai.APIConnectionError)):
+        return True
+
+    status_code = get_status_code(exc)
+    return status_code is not None and status_code >= 500
+
+
+class Endpoint:
+    def __init__(self, client: AsyncOpenAI) -> None:
+        self.client = client
+        self.base_url = normalize_base_url(client.base_url)
+
+        self.outstanding = 0
+        self.consecutive_failures = 0
+        self.healthy = True
+        self.ejected_at = 0.0
+
+        self.requests = 0
+        self.failures = 0
+        self.ejections = 0
+
+
+class EndpointPool:
+    """
+    Spreads requests over identical OpenAI-compatible endpoints, sending each to the healthy endpoint with
+    the fewest outstanding requests. An endpoint is ejected after `eject_after` consecutive failures and is
+    probed every `probe_interval_sec` until it answers again. If every endpoint is ejected, requests go to
+    the one ejected longest ago rather than failing outright. Must only be used from the LLM event loop.
+    """
+    def __init__(self, endpoints: list[Endpoint], eject_after: int, probe_interval_sec: float) -> None:
+        self.endpoints = endpoints
+        self.eject_after = max(1, eject_after)
+        self.probe_interval_sec = probe_interval_sec
+
+        self._probes: dict[str, asyncio.Task] = {}
+
+    def pick(self) -> Endpoint:
+        candidates = [endpoint for endpoint in self.endpoints if endpoint.healthy]
+        if not candidates:
+            return min(self.endpoints, key=lambda endpoint: endpoint.ejected_at)
+
+        fewest = min(endpoint.outstanding for endpoint in candidates)
+        return random.choice([endpoint for endpoint in candidates if endpoint.outstanding == fewest])
+
+    def acquire(self) -> Endpoint:
+        endpoint = self.pick()
+        endpoint.outstanding += 1
+        endpoint.requests += 1
+        return endpoint
+
+    def release(self, endpoint: Endpoint, exc: Optional[BaseException] = None) -> None:
+        endpoint.outstanding -= 1
+
+        if exc is None:
+            endpoint.consecutive_failures = 0
+            return
+
+        if not is_endpoint_failure(exc):
+            return
+
+        endpoint.failures += 1
+        endpoint.consecutive_failures += 1
+
+        if endpoint.healthy and endpoint.consecutive_failures >= self.eject_after:
+            self.eject(endpoint)
+
+    def eject(self, endpoint: Endpoint) -> None:
+        endpoint.healthy = False
+        endpoint.ejected_at = time.monotonic()
+        endpoint.ejections += 1
+        rprint(f"[yellow]{PRINT_PREFIX} ejected {endpoint.base_url} after {endpoint.consecutive_failures} consecutive failures[/yellow]")
+
+        if endpoint.base_url not in self._probes or self._probes[endpoint.base_url].done():
+            self._probes[endpoint.base_url] = asyncio.ensure_future(self._probe_until_healthy(endpoint))
+
+    def readmit(self, endpoint: Endpoint) -> None:
+        endpoint.healthy = True
+        endpoint.consecutive_failures = 0
+        rprint(f"[green]{PRINT_PREFIX} readmitted {endpoint.base_url}[/green]")
+
+    async def probe(self, endpoint: Endpoint) -> bool:
+        try:
+            await asyncio.wait_for(endpoint.client.models.list(), timeout=max(1.0, self.probe_interval_sec))
+            return True
+        except Exception as e:
+            dprint(f"{PRINT_PREFIX} probe of {endpoint.base_url} failed: {e}")
+            return False
+
+    async def _probe_until_healthy(self, endpoint: Endpoint) -> None:
+        while not endpoint.healthy:
+            await asyncio.sleep(self.probe_interval_sec)
+
+            if await self.probe(endpoint):
+                self.readmit(endpoint)
+
+    @asynccontextmanager
+    async def use(self) -> AsyncIterator[AsyncOpenAI]:
+        """Yields the client of the endpoint to send one request to, and records how that request went."""
+        endpoint = self.acquire()
+
+        try:
+            yield endpoint.client
+        except BaseException as exc:
+            self.release(endpoint, exc)
+            raise
+        else:
+            self.release(endpoint)
+
+    def get_metrics(self) -> list[dict[str, Any]]:
+        return [{"endpoint": endpoint.base_url,
+                 "healthy": endpoint.healthy,
+                 "outstanding": endpoint.outstanding,
+                 "requests": endpoint.requests,
+                 "failures": endpoint.failures,
+                 "ejections": endpoint.ejections} for endpoint in self.endpoints]
+
+
+_pools: dict[int, tuple[AsyncOpenAI, Optional[EndpointPool]]] = {}
+_pools_lock = threading.Lock()
+
+
+def get_endpoint_pool(client: AsyncOpenAI) -> Optional[EndpointPool]:
+    """
+    Returns the pool for client if OPENAI_BASE_URLS lists more than one endpoint, including the client's own.
+    The other endpoints share the client's settings (API key, timeouts, HTTP connection pool).
+    """
+    with _pools_lock:
+        cached = _pools.get(id(client))
+        if cached is not None and cached[0] is client:
+            return cached[1]
+
+        base_urls = [normalize_base_url(base_url) for base_url in get_openai_base_urls()]
+        own_base_url = normalize_base_url(client.base_url)
+
+        pool = None
+        if len(base_urls) > 1 and own_base_url in base_urls:
+            endpoints = [Endpoint(client if base_url == own_base_url else client.with_options(base_url=base_url)) for base_url in dict.fromkeys(base_urls)]
+            pool = EndpointPool(endpoints,
+                                eject_after=int(os.environ.get("LLM_POOL_EJECT_AFTER", "3")),
+                                probe_interval_sec=float(os.environ.get("LLM_POOL_PROBE_INTERVAL_SEC", "10")))
+            dprint(f"{PRINT_PREFIX} balancing over {len(endpoints)} endpoints: {', '.join(endpoint.base_url for endpoint in endpoints)}")
+
+        _pools[id(client)] = (client, pool)
+
+    return pool
+
+@asynccontextmanager
+async def use_endpoint(client: AsyncOpenAI) -> AsyncIterator[AsyncOpenAI]:
+    """Yields the client to send one request with: client itself, or the least loaded endpoint of its pool."""
+    pool = get_endpoint_pool(client)
+
+    if pool is None:
+        yield client
+        return
+
+    async with pool.use() as endpoint_client:
+        yield endpoint_client
+
+def get_pool_metrics() -> list[dict[str, Any]]:
+    with _pools_lock:
+        pools = [pool for _, pool in _pools.values() if pool is not None]
+
+    return [metrics for pool in pools for metrics in pool.get_metrics()]
@@ -0,0 +1,172 @@
+import asyncio
+import os
+import random
+import time
+from email.utils import parsedate_to_datetime
+from typing import Awaitable, Callable, Optional, TypeVar
+
+import anthropic
+import openai
+
+from rich import print as rprint
+from utils.console_io import debug_print as dprint
+
+from utils.custom_exceptions import LLMAPIInternalServerError, LLMAPIRateLimitError
+
+
+PRINT_PREFIX = "[bold][LLMRetry][/bold]"
+
+RETRYABLE_STATUS_CODES = {408, 409, 429}
+
+T = TypeVar("T")
+
+
+class RetryBudget:
+    """
+    Process-wide limit on retries: every request deposits `ratio` tokens (up to `reserve`) and every retry spends one,
+    so during an outage retries add at most `ratio` extra load instead of multiplying it.
+    """
+    def __init__(self, ratio: float, reserve: float) -> None:
+        self.ratio = ratio
+        self.reserve = reserve
+        self.tokens = reserve
+
+    def on_request(self) -> None:
+        self.tokens = min(self.reserve, self.tokens + self.ratio)
+
+    def try_spend(self) -> bool:
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return True
+        return False
+
+
+class RetryPolicy:
+    def __init__(self, max_attempts: int, base_sec: float, cap_sec: float, deadline_sec: Optional[float], budget: Optional[RetryBudget]) -> None:
+        self.max_attempts = max_attempts
+        self.base_sec = base_sec
+        self.cap_sec = cap_sec
+        self.deadline_sec = deadline_sec
+        self.budget = budget
+
+    def next_sleep(self, previous_sleep: float) -> float:
+        # Decorrelated jitter (sleep = min(cap, U(base, 3 * previous sleep)))
+        return min(self.cap_sec, random.uniform(self.base_sec, max(self.base_sec, previous_sleep * 3)))
+
+
+_retry_budget: Optional[RetryBudget] = None
+
+
+def get_retry_policy() -> RetryPolicy:
+    global _retry_budget
+
+    if _retry_budget is None:
+        _retry_budget = RetryBudget(ratio=float(os.environ.get("LLM_RETRY_BUDGET_RATIO", "0.2")),
+                                    reserve=float(os.environ.get("LLM_RETRY_BUDGET_RESERVE", "10")))
+
+    deadline_sec = float(os.environ.get("LLM_CALL_DEADLINE_SEC", "600"))
+
+    return RetryPolicy(max_attempts=int(os.environ.get("LLM_MAX_ATTEMPTS", "8")),
+                       base_sec=float(os.environ.get("LLM_RETRY_BASE_SEC", "0.5")),
+                       cap_sec=float(os.environ.get("LLM_RETRY_CAP_SEC", "60")),
+                       deadline_sec=deadline_sec if deadline_sec > 0 else None,
+                       budget=_retry_budget)
+
+def get_status_code(exc: BaseException) -> Optional[int]:
+    status_code = getattr(exc, "status_code", None)
+    return status_code if isinstance(status_code, int) else None
+
+def is_retryable(exc: BaseException) -> bool:
+    if isinstance(exc, (anthropic.APIConnectionError, openai.APIConnectionError)):
+        return True
+
+    status_code = get_status_code(exc)
+    return status_code is not None and (status_code in RETRYABLE_STATUS_CODES or status_code >= 500)
+
+def get_retry_after(exc: BaseException) -> Optional[float]:
+    """Returns the server-requested delay in seconds from Retry-After / retry-after-ms, if any."""
+    response = getattr(exc, "response", None)
+    headers = getattr(response, "headers", None)
+    if headers is None:
+        return None
+
+    retry_after_ms = headers.get("retry-after-ms")
+    if retry_after_ms:
+        try:
+            return max(0.0, float(retry_after_ms) / 1000)
+        except ValueError:
+            pass
+
+    retry_after = headers.get("retry-after")
+    if retry_after:
+        try:
+            return max(0.0, float(retry_after))
+        except ValueError:
+            try:
+                return max(0.0, parsedate_to_datetime(retry_after).timestamp() - time.time())
+            except (TypeError, ValueError):
+                pass
+
+    return None
+
+def to_llm_api_error(exc: BaseException, description: str) -> BaseException:
+    status_code = get_status_code(exc)
+
+    if status_code == 429:
+        return LLMAPIRateLimitError(f"{PRINT_PREFIX} {description} RateLimitError: {exc}")
+    if status_code is not None and status_code >= 500:
+        return LLMAPIInternalServerError(f"{PRINT_PREFIX} {description} InternalServerError: {exc}")
+
+    return exc
+
+async def call_with_retries(call: Callable[[], Awaitable[T]], description: str, policy: Optional[RetryPolicy] = None) -> T:
+    """
+    Awaits call(), retrying rate limits, server errors and connection errors with decorrelated jitter.
+    A Retry-After header from the server takes precedence over the computed delay. Retries stop at
+    max_attempts, when the next attempt would start past the deadline, or when the retry budget is spent.
+    """
+    policy = policy or get_retry_policy()
+    deadline = time.monotonic() + policy.deadline_sec if policy.deadline_sec is not None else None
+
+    if policy.budget is not None:
+        policy.budget.on_request()
+
+    sleep_sec = policy.base_sec
+    attempt = 1
+
+    while True:
+        try:
+            if deadline is None:
+                return await call()
+
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise asyncio.TimeoutError()
+
+            return await asyncio.wait_for(call(), timeout=remaining)
+
+        except asyncio.TimeoutError:
+            error_message = f"{PRINT_PREFIX} {description} call exceeded its {policy.deadline_sec:0.0f}s deadline after {attempt} tries"
+            rprint(f"[red][bold]{error_message}[/bold][/red]")
+            raise
+
+        except Exception as exc:
+            if not is_retryable(exc) or attempt >= policy.max_attempts:
+                raise to_llm_api_error(exc, description) from exc
+
+            retry_after = get_retry_after(exc)
+            sleep_sec = policy.next_sleep(sleep_sec)
+            wait_sec = max(sleep_sec, retry_after) if retry_after is not None else sleep_sec
+
+            if deadline is not None and time.monotonic() + wait_sec >= deadline:
+                dprint(f"{PRINT_PREFIX} {description} not retrying - next attempt would start past the deadline")
+                raise to_llm_api_error(exc, description) from exc
+
+            if policy.budget is not None and not policy.budget.try_spend():
+                rprint(f"[red][bold]{PRINT_PREFIX} {description} retry budget exhausted - not retrying[/bold][/red]")
+                raise to_llm_api_error(exc, description) from exc
+
+            rprint(f"[red][bold]{PRINT_PREFIX} {description} API error - backing off {wait_sec:0.1f} seconds after {attempt} tries\n{exc}[/bold][/red]")
+
+            await asyncio.sleep(wait_sec)
+            attempt += 1
@@ -0,0 +1,68 @@
+import os
+import threading
+from typing import Any, Optional
+
+from anthropic import Anthropic, AsyncAnthropic
+
+from rich import print as rprint
+
+
+PRINT_PREFIX = "[bold][LLMRouting][/bold]"
+
+MODEL_ENV_VARS = {"anthropic": "ANTHROPIC_MODEL", "openai": "OPENAI_MODEL"}
+SMALL_MODEL_ENV_VARS = {"anthropic": "ANTHROPIC_SMALL_MODEL", "openai": "OPENAI_SMALL_MODEL"}
+
+# Model tiers that can be used in place of a model name
+LARGE = "large"
+SMALL = "small"
+
+# A model name or tier, or a mapping from provider ("anthropic"/"openai") to one
+ModelSpec = str | dict[str, str]
+
+_routes: dict[str, dict[str, Any]] = {}
+_routes_lock = threading.Lock()
+
+
+def set_state_route(state: str, model: Optional[ModelSpec] = None, temperature: Optional[float] = None) -> None:
+    """Routes the LLM calls made in state (as named by utils.llm_telemetry) to model and/or temperature."""
+    with _routes_lock:
+        _routes[state] = {"model": model, "temperature": temperature}
+
+def get_state_route(state: str) -> dict[str, Any]:
+    with _routes_lock:
+        return dict(_routes.get(state, {"model": None, "temperature": None}))
+
+def clear_state_routes() -> None:
+    with _routes_lock:
+        _routes.clear()
+
+def resolve_model(provider: str, model: Optional[ModelSpec] = None) -> str:
+    """
+    Returns the model name to call provider with. A missing model or the "large" tier is the provider's
+    default model (ANTHROPIC_MODEL/OPENAI_MODEL), and the "small" tier is ANTHROPIC_SMALL_MODEL/OPENAI_SMALL_MODEL,
+    falling back to the default model when that is not set.
+    """
+    if isinstance(model, dict):
+        model = model.get(provider)
+
+    if model == SMALL:
+        small_model = os.environ.get(SMALL_MODEL_ENV_VARS[provider])
+        if small_model:
+            return small_model
+        model = None
+
+    if model is None or model == LARGE:
+        default_model = os.environ.get(MODEL_ENV_VARS[provider])
+        if default_model is None:
+            error_message = f"{PRINT_PREFIX} {MODEL_ENV_VARS[provider]} not set"
+            rprint(f"[red][bold]{error_message}[/bold][/red]")
+            raise KeyError(error_message)
+        return default_model
+
+    return model
+
+def get_provider(client: Any) -> str:
+    return "anthropic" if isinstance(client, (Anthropic, AsyncAnthropic)) else "openai"
+
+def has_small_model(provider: str) -> bool:
+    return resolve_model(provider, SMALL) != resolve_model(provider, LARGE)
@@ -0,0 +1,229 @@
+import asyncio
+import contextvars
+import math
+import os
+import threading
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+from enum import IntEnum
+from typing import Any, AsyncIterator, Coroutine, Iterable, Optional, TypeVar
+
+import numpy as np
+
+from rich import print as rprint
+from utils.console_io import debug_print as dprint
+
+
+PRINT_PREFIX = "[bold][LLMScheduler][/bold]"
+
+T = TypeVar("T")
+
+
+class Priority(IntEnum):
+    """Priority classes for LLM requests - lower values are served first."""
+    INTERACTIVE = 0
+    ROUTING = 1
+    PLANNING = 2
+    VOTING = 3
+    REPAIR = 4
+    # Work that may turn out not to be needed at all, e.g. plans generated ahead of the step vote
+    SPECULATIVE = 5
+
+
+# Fraction of the in-flight slots each class may hold at once, so background work always leaves
+# headroom for the classes above it
+DEFAULT_SHARES = {
+    Priority.INTERACTIVE: 1.0,
+    Priority.ROUTING: 1.0,
+    Priority.PLANNING: 0.75,
+    Priority.VOTING: 0.5,
+    Priority.REPAIR: 0.25,
+    Priority.SPECULATIVE: 0.25,
+}
+
+_llm_priority: contextvars.ContextVar[Priority] = contextvars.ContextVar("llm_priority", default=Priority.PLANNING)
+
+
+def get_llm_priority() -> Priority:
+    return _llm_priority.get()
+
+def use_llm_priority(priority: Priority) -> None:
+    _llm_priority.set(priority)
+
+async def run_with_llm_priority(priority: Priority, coro: Coroutine[Any, Any, T]) -> T:
+    # Meant to run as its own task, so the priority only applies to the calls coro makes
+    use_llm_priority(priority)
+    return await coro
+
+def get_priority_aging_sec() -> float:
+    return float(os.environ.get("LLM_PRIORITY_AGING_SEC", "5"))
+
+def parse_shares(shares_str: str) -> dict[Priority, float]:
+    """Parses "voting=0.5,repair=0.25" into shares, keeping the defaults for classes it does not mention."""
+    shares = dict(DEFAULT_SHARES)
+
+    for item in shares_str.split(","):
+        if not item.strip():
+            continue
+
+        name, _, share = item.partition("=")
+        try:
+            shares[Priority[name.strip().upper()]] = min(1.0, max(0.0, float(share)))
+        except (KeyError, ValueError):
+            rprint(f"[yellow]{PRINT_PREFIX} ignoring invalid LLM_PRIORITY_SHARES entry {item.strip()!r}[/yellow]")
+
+    return shares
+
+
+class Waiter:
+    def __init__(self, priority: Priority, future: asyncio.Future) -> None:
+        self.priority = priority
+        self.future = future
+        self.enqueued_at = time.monotonic()
+
+    def effective_priority(self, now: float, aging_sec: float) -> float:
+        # A waiter moves up one class for every aging_sec it has waited, so low-priority work is never starved
+        if aging_sec <= 0:
+            return self.priority
+
+        return self.priority - (now - self.enqueued_at) / aging_sec
+
+def pick_waiter(waiters: Iterable[Waiter], aging_sec: float) -> Optional[Waiter]:
+    """Returns the waiter to serve next: the best effective priority, first come first served within it."""
+    now = time.monotonic()
+    return min(waiters, key=lambda waiter: (waiter.effective_priority(now, aging_sec), waiter.enqueued_at), default=None)
+
+
+class PriorityScheduler:
+    """
+    Hands out the process-wide in-flight request slots by priority class. Each class may hold at most its
+    share of the slots, and waiting requests are served in order of priority, aged by how long they have
+    waited. Queue wait times are kept per class. Must only be used from the LLM event loop.
+    """
+    def __init__(self, capacity: int, shares: dict[Priority, float], aging_sec: float, wait_window: int = 500) -> None:
+        self.capacity = max(1, capacity)
+        self.shares = shares
+        self.aging_sec = aging_sec
+
+        self.in_flight = 0
+        self.class_in_flight: dict[Priority, int] = {priority: 0 for priority in Priority}
+        self.requests: dict[Priority, int] = {priority: 0 for priority in Priority}
+        self.waits: dict[Priority, deque[float]] = {priority: deque(maxlen=wait_window) for priority in Priority}
+
+        self._waiters: list[Waiter] = []
+
+    def class_limit(self, priority: Priority) -> int:
+        return max(1, math.ceil(self.capacity * self.shares.get(priority, 1.0)))
+
+    def _can_start(self, priority: Priority) -> bool:
+        return self.in_flight < self.capacity and self.class_in_flight[priority] < self.class_limit(priority)
+
+    def _start(self, priority: Priority) -> None:
+        self.in_flight += 1
+        self.class_in_flight[priority] += 1
+
+    def _wake(self) -> None:
+        while self.in_flight < self.capacity:
+            waiter = pick_waiter((waiter for waiter in self._waiters if self._can_start(waiter.priority)), self.aging_sec)
+            if waiter is None:
+                return
+
+            self._waiters.remove(waiter)
+            if waiter.future.done():
+                continue
+
+            self._start(waiter.priority)
+            self.waits[waiter.priority].append(time.monotonic() - waiter.enqueued_at)
+            waiter.future.set_result(None)
+
+    async def acquire(self, priority: Optional[Priority] = None) -> float:
+        """Waits for a slot for a request of priority (the current task's by default) and returns the seconds it queued."""
+        if priority is None:
+            priority = get_llm_priority()
+
+        waiter = Waiter(priority, asyncio.get_running_loop().create_future())
+        self.requests[priority] += 1
+        self._waiters.append(waiter)
+        self._wake()
+
+        try:
+            await waiter.future
+        except asyncio.CancelledError:
+            if waiter.future.done() and not waiter.future.cancelled():
+                # The slot was handed over just as we were cancelled, so pass it on
+                self.release(priority)
+            elif waiter in self._waiters:
+                self._waiters.remove(waiter)
+            raise
+
+        return time.monotonic() - waiter.enqueued_at
+
+    def release(self, priority: Priority) -> None:
+        self.in_flight -= 1
+        self.class_in_flight[priority] -= 1
+        self._wake()
+
+    @asynccontextmanager
+    async def slot(self, priority: Optional[Priority] = None) -> AsyncIterator[float]:
+        """Holds a slot for one request, yielding the seconds it queued for it."""
+        if priority is None:
+            priority = get_llm_priority()
+
+        queue_wait_sec = await self.acquire(priority)
+
+        try:
+            yield queue_wait_sec
+        finally:
+            self.release(priority)
+
+    def get_metrics(self) -> list[dict[str, Any]]:
+        metrics = []
+
+        for priority in Priority:
+            waits = np.array(self.waits[priority]) if self.waits[priority] else None
+
+            metrics.append({
+                "priority": priority.name.lower(),
+                "limit": self.class_limit(priority),
+                "in_flight": self.class_in_flight[priority],
+                "queued": sum(waiter.priority == priority for waiter in self._waiters),
+                "requests": self.requests[priority],
+                "wait_avg_ms": round(float(np.mean(waits)) * 1000, 1) if waits is not None else None,
+                "wait_p95_ms": round(float(np.percentile(waits, 95)) * 1000, 1) if waits is not None else None,
+                "wait_max_ms": round(float(np.max(waits)) * 1000, 1) if waits is not None else None,
+            })
+
+        return metrics
+
+
+_scheduler: Optional[PriorityScheduler] = None
+_scheduler_lock = threading.Lock()
+
+
+def get_scheduler() -> PriorityScheduler:
+    """Returns the process-wide scheduler, configured from .env on first use."""
+    global _scheduler
+
+    with _scheduler_lock:
+        if _scheduler is None:
+            _scheduler = PriorityScheduler(capacity=int(os.environ.get("LLM_MAX_IN_FLIGHT", "16")),
+                                           shares=parse_shares(os.environ.get("LLM_PRIORITY_SHARES", "")),
+                                           aging_sec=get_priority_aging_sec())
+
+            dprint(f"{PRINT_PREFIX} {_scheduler.capacity} slots, class limits: "
+                   + ", ".join(f"{priority.name.lower()}={_scheduler.class_limit(priority)}" for priority in Priority))
+
+    return _scheduler
+
+def get_scheduler_metrics() -> list[dict[str, Any]]:
+    with _scheduler_lock:
+        scheduler = _scheduler
+
+    return scheduler.get_metrics() if scheduler is not None else []
+
+def reset_scheduler() -> None:
+    global _scheduler
+
+    with _scheduler_lock:
+        _scheduler = None
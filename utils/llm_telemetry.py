@@ -0,0 +1,307 @@
+import os
+import sys
+import json
+import time
+import logging
+import threading
+import contextvars
+from collections import defaultdict, deque
+from datetime import datetime
+from logging.handlers import RotatingFileHandler
+from typing import Any, Iterable, Optional
+
+import numpy as np
+
+from rich import print as rprint
+from rich.console import Console
+from rich.table import Table
+
+from utils.console_io import debug_print as dprint
+from utils.llm_scheduler import get_llm_priority
+
+
+PRINT_PREFIX = "[bold][LLMTelemetry][/bold]"
+
+TELEMETRY_FILENAME = "llm_telemetry.jsonl"
+
+PERCENTILES = (50, 95, 99)
+
+# Samples kept per state by the in-memory aggregator
+MAX_SAMPLES_PER_STATE = 2048
+
+# The agent state making LLM calls ("<owner class>.<hpath>", e.g. "ToT.PlanVote"), set by
+# ConversationStateMachine on every transition and carried onto the LLM event loop by utils.llm
+_llm_state: contextvars.ContextVar[str] = contextvars.ContextVar("llm_state", default="unknown")
+
+
+def get_llm_state() -> str:
+    return _llm_state.get()
+
+def format_llm_state(agent: str, hpath: str) -> str:
+    return f"{agent}.{hpath}" if agent else hpath
+
+def set_llm_state(agent: str, hpath: str) -> None:
+    _llm_state.set(format_llm_state(agent, hpath))
+
+def use_llm_state(state: str) -> None:
+    _llm_state.set(state)
+
+
+class TelemetryAggregator:
+    """Keeps per-state call counts, token totals and recent latency samples for percentile summaries."""
+    def __init__(self, max_samples: int = MAX_SAMPLES_PER_STATE) -> None:
+        self._lock = threading.Lock()
+        self._max_samples = max_samples
+        self._stats: dict[str, dict[str, Any]] = defaultdict(self._new_stats)
+
+    def _new_stats(self) -> dict[str, Any]:
+        return {
+            "calls": 0,
+            "errors": 0,
+            "cached": 0,
+            "retries": 0,
+            "prompt_tokens": 0,
+            "completion_tokens": 0,
+            "cache_read_tokens": 0,
+            "cache_write_tokens": 0,
+            "voters": 0,
+            "voters_saved": 0,
+            "latency_sec": deque(maxlen=self._max_samples),
+            "ttft_sec": deque(maxlen=self._max_samples),
+        }
+
+    def add(self, event: dict[str, Any]) -> None:
+        with self._lock:
+            stats = self._stats[event.get("state") or "unknown"]
+
+            if event.get("event") == "vote":
+                stats["voters"] += event.get("voters") or 0
+                stats["voters_saved"] += event.get("voters_saved") or 0
+                return
+
+            stats["calls"] += 1
+            stats["errors"] += 1 if event.get("error") else 0
+            stats["cached"] += 1 if event.get("cached") else 0
+            stats["retries"] += event.get("retries") or 0
+            stats["prompt_tokens"] += event.get("prompt_tokens") or 0
+            stats["completion_tokens"] += event.get("completion_tokens") or 0
+            stats["cache_read_tokens"] += event.get("cache_read_tokens") or 0
+            stats["cache_write_tokens"] += event.get("cache_write_tokens") or 0
+
+            if event.get("latency_sec") is not None:
+                stats["latency_sec"].append(event["latency_sec"])
+            if event.get("ttft_sec") is not None:
+                stats["ttft_sec"].append(event["ttft_sec"])
+
+    def clear(self) -> None:
+        with self._lock:
+            self._stats.clear()
+
+    def summary(self) -> list[dict[str, Any]]:
+        """Returns one row per state with totals and p50/p95/p99 of latency and TTFT, slowest total time first."""
+        rows = []
+
+        with self._lock:
+            for state, stats in self._stats.items():
+                latencies = list(stats["latency_sec"])
+                ttfts = list(stats["ttft_sec"])
+
+                row = {key: value for key, value in stats.items() if not isinstance(value, deque)}
+                row["state"] = state
+                row["total_sec"] = float(sum(latencies))
+                row.update(get_percentiles(latencies, "latency"))
+                row.update(get_percentiles(ttfts, "ttft"))
+                rows.append(row)
+
+        return sorted(rows, key=lambda row: row["total_sec"], reverse=True)
+
+
+def get_percentiles(samples: list[float], name: str) -> dict[str, Optional[float]]:
+    if not samples:
+        return {f"{name}_p{p}": None for p in PERCENTILES}
+
+    values = np.percentile(np.array(samples, dtype=float), PERCENTILES)
+    return {f"{name}_p{p}": float(value) for p, value in zip(PERCENTILES, values)}
+
+
+_aggregator = TelemetryAggregator()
+_telemetry_logger: Optional[logging.Logger] = None
+_telemetry_logger_lock = threading.Lock()
+
+
+def get_aggregator() -> TelemetryAggregator:
+    return _aggregator
+
+def use_telemetry() -> bool:
+    return os.environ.get("LLM_TELEMETRY", "True").lower() == "true"
+
+def get_telemetry_path() -> str:
+    return os.path.join(os.environ.get("OUTPUT_DIR", "data/output/"), TELEMETRY_FILENAME)
+
+def get_telemetry_logger() -> Optional[logging.Logger]:
+    """Returns a logger writing one JSON event per line to a size-rotated file in OUTPUT_DIR."""
+    global _telemetry_logger
+
+    with _telemetry_logger_lock:
+        if _telemetry_logger is None:
+            path = get_telemetry_path()
+
+            try:
+                os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+                handler = RotatingFileHandler(path,
+                                              maxBytes=int(float(os.environ.get("LLM_TELEMETRY_MAX_MB", "16")) * 1024 * 1024),
+                                              backupCount=int(os.environ.get("LLM_TELEMETRY_BACKUPS", "5")),
+                                              encoding="utf-8")
+            except OSError as e:
+                rprint(f"[yellow]{PRINT_PREFIX} Unable to open {path}, telemetry will only be kept in memory: {e}[/yellow]")
+                return None
+
+            handler.setFormatter(logging.Formatter("%(message)s"))
+
+            logger = logging.getLogger("apex.llm_telemetry")
+            logger.setLevel(logging.INFO)
+            logger.propagate = False
+            logger.addHandler(handler)
+
+            _telemetry_logger = logger
+            dprint(f"{PRINT_PREFIX} writing LLM telemetry to {path}")
+
+    return _telemetry_logger
+
+def reset_telemetry_logger() -> None:
+    """Closes the telemetry file, so the next event opens it again under the current OUTPUT_DIR."""
+    global _telemetry_logger
+
+    with _telemetry_logger_lock:
+        logger = logging.getLogger("apex.llm_telemetry")
+        for handler in list(logger.handlers):
+            handler.close()
+            logger.removeHandler(handler)
+
+        _telemetry_logger = None
+
+def record_llm_call(event: dict[str, Any]) -> None:
+    if not use_telemetry():
+        return
+
+    _aggregator.add(event)
+
+    logger = get_telemetry_logger()
+    if logger is not None:
+        logger.info(json.dumps(event))
+
+def record_vote(voters: int, max_voters: int) -> dict[str, Any]:
+    """Records how many voters a vote in the caller's state used out of the max_voters it could have (see VOTE_ADAPTIVE)."""
+    event = {
+        "timestamp": datetime.now().isoformat(timespec="milliseconds"),
+        "event": "vote",
+        "state": get_llm_state(),
+        "voters": voters,
+        "voters_saved": max(0, max_voters - voters),
+    }
+
+    record_llm_call(event)
+    return event
+
+
+class CallTelemetry:
+    """
+    Collects the telemetry event for one LLM call as it progresses.
+    Create it on the calling task (so it picks up the caller's state), then call finish() exactly once.
+    """
+    def __init__(self, provider: str, model: str, endpoint: str, n: int, stream: bool) -> None:
+        self.state = get_llm_state()
+        self.priority = get_llm_priority()
+        self.provider = provider
+        self.model = model
+        self.endpoint = endpoint
+        self.n = n
+        self.stream = stream
+
+        self.attempts = 0
+        self.queue_wait_sec = 0.0
+        self.prompt_tokens: Optional[int] = None
+        self.completion_tokens: Optional[int] = None
+        self.cache_read_tokens: Optional[int] = None
+        self.cache_write_tokens: Optional[int] = None
+        self.finish_reasons: list[Optional[str]] = []
+
+        self.started_at = time.perf_counter()
+        self.first_token_at: Optional[float] = None
+
+    def on_first_token(self) -> None:
+        if self.first_token_at is None:
+            self.first_token_at = time.perf_counter()
+
+    def finish(self, error: Optional[BaseException] = None) -> dict[str, Any]:
+        finished_at = time.perf_counter()
+
+        event = {
+            "timestamp": datetime.now().isoformat(timespec="milliseconds"),
+            "state": self.state,
+            "priority": self.priority.name.lower(),
+            "provider": self.provider,
+            "model": self.model,
+            "endpoint": self.endpoint,
+            "n": self.n,
+            "stream": self.stream,
+            "prompt_tokens": self.prompt_tokens,
+            "completion_tokens": self.completion_tokens,
+            "cache_read_tokens": self.cache_read_tokens,
+            "cache_write_tokens": self.cache_write_tokens,
+            # Only streamed calls can observe the first token - a non-streamed response arrives all at once
+            "ttft_sec": round(self.first_token_at - self.started_at, 4) if self.first_token_at is not None else None,
+            "latency_sec": round(finished_at - self.started_at, 4),
+            # Time spent waiting for a slot behind higher priority requests (see utils.llm_scheduler)
+            "queue_wait_sec": round(self.queue_wait_sec, 4),
+            "retries": max(0, self.attempts - 1),
+            "cached": self.attempts == 0 and error is None,
+            "finish_reasons": self.finish_reasons,
+            "error": type(error).__name__ if error is not None else None,
+        }
+
+        record_llm_call(event)
+        return event
+
+
+def load_events(path: str) -> Iterable[dict[str, Any]]:
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if line:
+                yield json.loads(line)
+
+def format_sec(value: Optional[float]) -> str:
+    return f"{value:.2f}" if value is not None else "-"
+
+def print_llm_telemetry_summary(aggregator: Optional[TelemetryAggregator] = None) -> None:
+    rows = (aggregator or _aggregator).summary()
+
+    if not rows:
+        rprint(f"{PRINT_PREFIX} no LLM calls recorded yet")
+        return
+
+    table = Table(title="LLM Calls by State (seconds)", show_header=True, header_style="bold magenta")
+    for column in ["State", "Calls", "Errors", "Cached", "Retries", "Tokens In/Out", "Cache Read/Write", "Voters Used/Saved", "Total", "Latency p50/p95/p99", "TTFT p50/p95/p99"]:
+        table.add_column(column)
+
+    for row in rows:
+        table.add_row(row["state"], str(row["calls"]), str(row["errors"]), str(row["cached"]), str(row["retries"]),
+                      f"{row['prompt_tokens']}/{row['completion_tokens']}", f"{row['cache_read_tokens']}/{row['cache_write_tokens']}",
+                      f"{row['voters']}/{row['voters_saved']}" if row["voters"] else "-",
+                      format_sec(row["total_sec"]),
+                      "/".join(format_sec(row[f"latency_p{p}"]) for p in PERCENTILES),
+                      "/".join(format_sec(row[f"ttft_p{p}"]) for p in PERCENTILES))
+
+    Console().print(table)
+
+
+# Summarize a telemetry file: python -m utils.llm_telemetry [path/to/llm_telemetry.jsonl]
+if __name__ == "__main__":
+    telemetry_path = sys.argv[1] if len(sys.argv) > 1 else get_telemetry_path()
+
+    file_aggregator = TelemetryAggregator(max_samples=sys.maxsize)
+    for telemetry_event in load_events(telemetry_path):
+        file_aggregator.add(telemetry_event)
+
+    print_llm_telemetry_summary(file_aggregator)
@@ -0,0 +1,205 @@
+import math
+import os
+import threading
+from typing import Any, Callable, Optional
+
+from rich import print as rprint
+from utils.console_io import debug_print as dprint
+
+from utils.custom_exceptions import LLMContextOverflowError
+from utils.custom_types import Message, PromptsDict
+
+try:
+    import tiktoken
+    TIKTOKEN_AVAILABLE = True
+except ImportError:
+    TIKTOKEN_AVAILABLE = False
+
+
+PRINT_PREFIX = "[bold][LLMTokens][/bold]"
+
+TOKENIZERS = ("auto", "tiktoken", "heuristic")
+
+# Role markers and separators the provider adds around each message
+MESSAGE_OVERHEAD_TOKENS = 4
+
+# Context windows by model name prefix, for models LLM_CONTEXT_WINDOW does not cover
+CONTEXT_WINDOWS = (
+    ("claude", 200000),
+    ("gpt-4o", 128000),
+    ("gpt-4-turbo", 128000),
+)
+
+TRIM_ATTEMPTS = 3
+
+# Called with the prompts and by how many tokens they are over the context window; returns smaller prompts
+TrimHook = Callable[[PromptsDict, int], PromptsDict]
+
+
+class TokenCounter:
+    """
+    Estimates prompt sizes before they are sent. Text is counted with tiktoken's o200k_base encoding if it
+    is installed, and as characters / chars_per_token otherwise. The raw count is then scaled by a per-model
+    factor calibrated against the prompt sizes the provider reports, so either way it tracks the real tokenizer.
+    Message counts are cached on the message dicts themselves under "tokens".
+    """
+    def __init__(self, tokenizer: str, chars_per_token: float, calibration_weight: float = 0.2) -> None:
+        self.encoding = tiktoken.get_encoding("o200k_base") if tokenizer == "tiktoken" else None
+        self.name = tokenizer if self.encoding is not None else f"heuristic/{chars_per_token}"
+        self.chars_per_token = chars_per_token
+        self.calibration_weight = calibration_weight
+
+        self._lock = threading.Lock()
+        self._scales: dict[str, float] = {}
+
+    def count_text(self, text: str) -> int:
+        if not text:
+            return 0
+
+        if self.encoding is not None:
+            return len(self.encoding.encode(text, disallowed_special=()))
+
+        return math.ceil(len(text) / self.chars_per_token)
+
+    def count_message(self, message: Message) -> int:
+        # str caches its own hash, so checking an unchanged message is cheap
+        key = [self.name, hash(message["content"])]
+
+        cached = message.get("tokens")
+        if isinstance(cached, (list, tuple)) and list(cached[:2]) == key:
+            return cached[2]
+
+        count = self.count_text(message["content"]) + MESSAGE_OVERHEAD_TOKENS
+        message["tokens"] = key + [count]
+        return count
+
+    def count_prompt(self, system: str, messages: list[Message]) -> int:
+        """Raw (uncalibrated) count of a prompt."""
+        return self.count_text(system) + sum(self.count_message(message) for message in messages)
+
+    def get_scale(self, model: str) -> float:
+        with self._lock:
+            return self._scales.get(model, 1.0)
+
+    def estimate(self, model: str, system: str, messages: list[Message]) -> int:
+        return math.ceil(self.count_prompt(system, messages) * self.get_scale(model))
+
+    def calibrate(self, model: str, system: str, messages: list[Message], actual_tokens: Optional[int]) -> None:
+        """Moves model's scale towards the ratio of actual_tokens, as reported for a prompt that was sent, to its raw count."""
+        raw_count = self.count_prompt(system, messages)
+        if not raw_count or not actual_tokens:
+            return
+
+        with self._lock:
+            scale = self._scales.get(model)
+            ratio = actual_tokens / raw_count
+            self._scales[model] = ratio if scale is None else scale + self.calibration_weight * (ratio - scale)
+
+
+_token_counter: Optional[TokenCounter] = None
+_token_counter_lock = threading.Lock()
+
+
+def get_tokenizer() -> str:
+    tokenizer = os.environ.get("LLM_TOKENIZER", "auto").strip().lower()
+
+    if tokenizer not in TOKENIZERS:
+        rprint(f"[yellow]{PRINT_PREFIX} Unknown LLM_TOKENIZER {tokenizer!r}, expected one of {', '.join(TOKENIZERS)} - using auto[/yellow]")
+        tokenizer = "auto"
+
+    if tokenizer == "tiktoken" and not TIKTOKEN_AVAILABLE:
+        rprint(f"[yellow]{PRINT_PREFIX} LLM_TOKENIZER is tiktoken but it is not installed - using the heuristic[/yellow]")
+        return "heuristic"
+
+    if tokenizer == "auto":
+        return "tiktoken" if TIKTOKEN_AVAILABLE else "heuristic"
+
+    return tokenizer
+
+def get_token_counter() -> TokenCounter:
+    """Returns the process-wide token counter, configured from .env on first use."""
+    global _token_counter
+
+    with _token_counter_lock:
+        if _token_counter is None:
+            _token_counter = TokenCounter(get_tokenizer(), chars_per_token=float(os.environ.get("LLM_CHARS_PER_TOKEN", "3.5")))
+            dprint(f"{PRINT_PREFIX} counting tokens with {_token_counter.name}")
+
+    return _token_counter
+
+def reset_token_counter() -> None:
+    global _token_counter
+
+    with _token_counter_lock:
+        _token_counter = None
+
+def get_context_window(model: str) -> Optional[int]:
+    """LLM_CONTEXT_WINDOW if set, else the known window of model - None if it is unknown."""
+    context_window = os.environ.get("LLM_CONTEXT_WINDOW")
+    if context_window:
+        return int(context_window)
+
+    for prefix, window in CONTEXT_WINDOWS:
+        if model.startswith(prefix):
+            return window
+
+    return None
+
+def check_context(model: str, prompts: PromptsDict, reserve_tokens: int, trim: Optional[TrimHook] = None) -> PromptsDict:
+    """
+    Returns prompts if they leave room for reserve_tokens of completion in model's context window. Otherwise
+    trim, if given, is asked to cut them down, and LLMContextOverflowError is raised if that is not enough.
+    """
+    context_window = get_context_window(model)
+    if context_window is None:
+        return prompts
+
+    counter = get_token_counter()
+    limit = context_window - reserve_tokens
+
+    estimate = counter.estimate(model, prompts['system'], prompts['messages'])  # type: ignore
+    if estimate <= limit:
+        return prompts
+
+    # The hook only estimates how much to cut, so it gets a few goes as long as each one helps
+    for _ in range(TRIM_ATTEMPTS if trim is not None else 0):
+        dprint(f"{PRINT_PREFIX} prompt of ~{estimate} tokens is over the {limit} available for {model} - trimming")
+        prompts = trim(prompts, estimate - limit)  # type: ignore
+
+        previous_estimate, estimate = estimate, counter.estimate(model, prompts['system'], prompts['messages'])  # type: ignore
+        if estimate <= limit:
+            return prompts
+        if estimate >= previous_estimate:
+            break
+
+    error_message = f"{PRINT_PREFIX} prompt of ~{estimate} tokens does not fit the {context_window} token context window of {model} with {reserve_tokens} tokens left for the completion"
+    rprint(f"[red][bold]{error_message}[/bold][/red]")
+    raise LLMContextOverflowError(error_message)
+
+def trim_longest_messages(prompts: PromptsDict, excess_tokens: int, keep_last: int = 2, marker: str = "\n[... truncated ...]\n") -> PromptsDict:
+    """
+    Trim hook that cuts the middle out of the longest messages (never the last keep_last, e.g. the current
+    request and its prefill) until about excess_tokens are gone. The messages are copied, not modified.
+    """
+    counter = get_token_counter()
+    messages: list[Any] = list(prompts['messages'])  # type: ignore
+
+    candidates = sorted(range(max(0, len(messages) - keep_last)), key=lambda i: counter.count_message(messages[i]), reverse=True)
+    # The raw count is what trimming changes, so the excess is converted back from the calibrated estimate
+    excess_chars = math.ceil(excess_tokens * len("".join(message["content"] for message in messages)) / max(1, counter.count_prompt("", messages)))
+
+    for i in candidates:
+        if excess_chars <= 0:
+            break
+
+        content = messages[i]["content"]
+        cut = min(len(content) - len(marker), excess_chars + len(marker))
+        if cut <= 0:
+            continue
+
+        keep = len(content) - cut
+        messages[i] = {**messages[i], "content": content[:keep // 2] + marker + content[len(content) - (keep - keep // 2):]}
+        messages[i].pop("tokens", None)
+        excess_chars -= cut - len(marker)
+
+    return {"system": prompts['system'], "messages": messages}
@@ -0,0 +1,198 @@
+import asyncio
+import json
+import os
+import threading
+import time
+from collections import defaultdict
+from typing import Any, AsyncIterator, Awaitable, Callable, Optional, TypeVar
+
+from pydantic import BaseModel
+
+from rich import print as rprint
+from utils.console_io import debug_print as dprint
+from utils.custom_exceptions import LLMReplayMissError
+
+
+PRINT_PREFIX = "[bold][LLMTrace][/bold]"
+
+TRACE_FILENAME = "llm_trace.jsonl"
+
+BACKENDS = ("live", "record", "replay")
+
+ResponseT = TypeVar("ResponseT", bound=BaseModel)
+
+
+class LLMTrace:
+    """
+    Record/replay backend for LLM calls, keyed by request hash (see LLMCache.make_key).
+    In "record" mode every live response is appended to a JSONL trace file along with its latency.
+    In "replay" mode responses are served back from that file without touching the network, after sleeping
+    for the recorded latency times latency_scale (or for latency_sec, if set). Identical requests recorded
+    several times (e.g. sampled votes) are replayed in the order they were recorded, wrapping around.
+    """
+    PRINT_PREFIX = PRINT_PREFIX
+
+    def __init__(self, path: str, mode: str, latency_scale: float = 1.0, latency_sec: Optional[float] = None) -> None:
+        if mode not in ("record", "replay"):
+            error_message = f"{PRINT_PREFIX} expected mode to be 'record' or 'replay', got {mode!r} instead"
+            rprint(f"[red][bold]{error_message}[/bold][/red]")
+            raise ValueError(error_message)
+
+        self.path = path
+        self.mode = mode
+        self.latency_scale = latency_scale
+        self.latency_sec = latency_sec
+
+        self.recorded = 0
+        self.replayed = 0
+        self.misses = 0
+
+        self._lock = threading.Lock()
+        self._entries: dict[str, list[dict[str, Any]]] = defaultdict(list)
+        self._replay_counts: dict[str, int] = defaultdict(int)
+
+        if mode == "replay":
+            self._load()
+
+    def _load(self) -> None:
+        with open(self.path, "r", encoding="utf-8") as f:
+            for line in f:
+                line = line.strip()
+                if line:
+                    entry = json.loads(line)
+                    self._entries[entry["key"]].append(entry)
+
+        dprint(f"{PRINT_PREFIX} loaded {sum(len(entries) for entries in self._entries.values())} responses for {len(self._entries)} requests from {self.path}")
+
+    def _append(self, entry: dict[str, Any]) -> None:
+        with self._lock:
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write(json.dumps(entry) + "\n")
+            self.recorded += 1
+
+    def _next_entry(self, key: str, kind: str) -> dict[str, Any]:
+        with self._lock:
+            entries = [entry for entry in self._entries.get(key, ()) if entry["kind"] == kind]
+
+            if not entries:
+                self.misses += 1
+                error_message = f"{PRINT_PREFIX} no recorded {kind} for request {key[:12]} in {self.path}"
+                rprint(f"[red][bold]{error_message}[/bold][/red]")
+                raise LLMReplayMissError(error_message)
+
+            entry = entries[self._replay_counts[key] % len(entries)]
+            self._replay_counts[key] += 1
+            self.replayed += 1
+
+        return entry
+
+    def get_delay(self, recorded_sec: float) -> float:
+        return self.latency_sec if self.latency_sec is not None else recorded_sec * self.latency_scale
+
+    async def call(self, key: str, response_type: type[ResponseT], call: Callable[[], Awaitable[ResponseT]]) -> ResponseT:
+        """Replays the response recorded for key, or awaits call() and records its response."""
+        if self.mode == "replay":
+            entry = self._next_entry(key, "response")
+            await asyncio.sleep(self.get_delay(entry["latency_sec"]))
+            dprint(f"{PRINT_PREFIX} replayed {key[:12]}")
+            return response_type.model_validate(entry["response"])
+
+        started_at = time.perf_counter()
+        response = await call()
+
+        self._append({"key": key,
+                      "kind": "response",
+                      "latency_sec": round(time.perf_counter() - started_at, 4),
+                      "response": response.model_dump(mode="json")})
+
+        return response
+
+    async def stream(self, key: str, open_stream: Callable[[], AsyncIterator[str]]) -> AsyncIterator[str]:
+        """
+        Replays the text deltas recorded for key with their original spacing, or iterates open_stream() and
+        records its deltas. A stream closed early by the caller records the deltas it had received by then.
+        """
+        if self.mode == "replay":
+            entry = self._next_entry(key, "stream")
+            dprint(f"{PRINT_PREFIX} replaying stream {key[:12]}")
+
+            for delay_sec, delta in entry["deltas"]:
+                await asyncio.sleep(self.get_delay(delay_sec))
+                yield delta
+            return
+
+        deltas: list[tuple[float, str]] = []
+        stream = open_stream()
+        stream_error: Optional[BaseException] = None
+        previous_at = time.perf_counter()
+
+        try:
+            async for delta in stream:
+                now = time.perf_counter()
+                deltas.append((round(now - previous_at, 4), delta))
+                previous_at = now
+                yield delta
+        except Exception as e:
+            stream_error = e
+            raise
+        finally:
+            await stream.aclose()  # type: ignore
+
+            if stream_error is None:
+                self._append({"key": key, "kind": "stream", "deltas": deltas})
+
+    def get_stats(self) -> dict[str, Any]:
+        return {
+            "mode": self.mode,
+            "path": self.path,
+            "recorded": self.recorded,
+            "replayed": self.replayed,
+            "misses": self.misses,
+        }
+
+
+_llm_trace: Optional[LLMTrace] = None
+_llm_trace_lock = threading.Lock()
+
+
+def get_llm_backend() -> str:
+    backend = os.environ.get("LLM_BACKEND", "live").strip().lower()
+
+    if backend not in BACKENDS:
+        rprint(f"[yellow]{PRINT_PREFIX} Unknown LLM_BACKEND {backend!r}, expected one of {', '.join(BACKENDS)} - using live[/yellow]")
+        return "live"
+
+    return backend
+
+def get_trace_path() -> str:
+    return os.environ.get("LLM_TRACE_PATH") or os.path.join(os.environ.get("OUTPUT_DIR", "data/output/"), TRACE_FILENAME)
+
+def get_llm_trace() -> Optional[LLMTrace]:
+    """Returns the process-wide trace, or None unless LLM_BACKEND is set to "record" or "replay" in .env."""
+    global _llm_trace
+
+    backend = get_llm_backend()
+    if backend == "live":
+        return None
+
+    with _llm_trace_lock:
+        if _llm_trace is None or _llm_trace.mode != backend:
+            path = get_trace_path()
+            latency_sec = os.environ.get("LLM_REPLAY_LATENCY_SEC")
+
+            if backend == "record":
+                os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+
+            _llm_trace = LLMTrace(path, backend,
+                                  latency_scale=float(os.environ.get("LLM_REPLAY_LATENCY_SCALE", "1.0")),
+                                  latency_sec=float(latency_sec) if latency_sec else None)
+
+            dprint(f"{PRINT_PREFIX} {backend} mode using {path}")
+
+    return _llm_trace
+
+def reset_llm_trace() -> None:
+    global _llm_trace
+
+    with _llm_trace_lock:
+        _llm_trace = None
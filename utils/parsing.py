@@ -11,6 +11,7 @@ from rich import print
 
 from utils.enums import Role
 from utils.llm import llm_turn
+from utils.llm_scheduler import Priority
 from utils.custom_types import NestedStrDict
 
 from agents.prompt_management import get_msg
@@ -141,7 +142,9 @@ def xmlstr2dict(xml_string: str, client: Anthropic, depth: int = 0) -> dict:
                                         "messages": messages},
                                 stop_sequences=[stop_seq],
                                 temperature=0.0,
-                                max_tokens=None)
+                                max_tokens=None,
+                                model=os.environ.get("LLM_REPAIR_MODEL", "small"),
+                                priority=Priority.REPAIR)
 
             if not fixed_xml.strip().endswith("</root>"):
                 fixed_xml = fixed_xml.strip() + "</root>"
@@ -20,6 +20,8 @@ import dotenv
 
 from openai import OpenAI
 
+from utils.http_transport import get_http_client
+
 
 class STT():
     PRINT_PREFIX = "[bold][STT][/bold]"
@@ -93,7 +95,7 @@ class STT():
             self.is_recording = False
             self.done = False
 
-            client: OpenAI = OpenAI(api_key=os.environ.get("OPENAI_API_KEY"))
+            client: OpenAI = OpenAI(api_key=os.environ.get("OPENAI_API_KEY"), http_client=get_http_client())
 
             # sounddevice.py does not annotate the default (None, None) as Optional
             # modified line (58+3 = 61) to include "from typing import Optional"
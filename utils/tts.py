@@ -1,6 +1,5 @@
 import dotenv
 import os
-import requests
 
 from io import BytesIO
 import sounddevice as sd
@@ -8,6 +7,8 @@ import soundfile as sf
 
 from rich import print
 
+from utils.http_transport import get_http_client
+
 
 dotenv.load_dotenv()
 
@@ -35,7 +36,7 @@ def tts(text: str) -> None:
         }
     }
 
-    response = requests.post(url, json=data, headers=headers, stream=True)
+    response = get_http_client().post(url, json=data, headers=headers)
 
     if response.status_code == 200:
         audio_bytes = response.content